@@ -1,7 +1,8 @@
 import sys
 sys.path.append('cosim/src/')
 
-import io, os, time, datetime
+import io, os, time, datetime, json
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 
@@ -9,6 +10,10 @@ import pandas as pd
 from cosim.src.CoSimCore import CoSimCore
 from cosim.src.CoSimDict import DATA, CONTROL, SETTING
 from cosim.src.CoSimUtils import get_record_template, update_record
+from cosim.src.CoSimKPI import KPIAccumulator
+from cosim.src.CoSimSharedRecord import share_record, extend_record, get_record_frame
+from cosim.src.CoSimEvents import EVENT_CHANNEL, events_to_frame, get_override_events, get_channel_steps
+from cosim.src.CoSimManifest import reap_orphaned_sites
 
 # Import occupant model
 from cosim.src.occupant_model.src.model import OccupantModel
@@ -30,16 +35,63 @@ from eppy.modeleditor import IDF
 def id(name):
     return '-' + name + '-'
 
+
+class FigureCache:
+    '''
+    LRU cache of rendered figures (serialized as JSON), keyed by (alias, tab, record version, downsampling level).
+    The least recently used entries are evicted once the total size of the cached figures exceeds max_bytes.
+    '''
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, figure_json):
+        size = len(figure_json)
+        # Do not cache a figure that alone exceeds the memory budget
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (figure_json, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, size_evicted) = self.entries.popitem(last=False)
+            self.total_bytes -= size_evicted
+
+    def invalidate(self, alias):
+        # Drop every entry of the given model (entries of older record versions can never be served again)
+        for key in [key for key in self.entries if key[0] == alias]:
+            self.total_bytes -= self.entries.pop(key)[1]
+
+
 class CoSimGUI:
     def __init__(self,
                  cosim_sessions: list[CoSimCore],
                  test_gui_only=False,
                  test_default_model=False,
+                 plot_downsampling=1,
+                 figure_cache_budget_mb=256,
                  debug=False):
         self.test_default_model = test_default_model
         self.debug = debug
         self.test_gui_only = test_gui_only
 
+        # Rendered figures are memoized per (alias, tab, record version, downsampling level)
+        # The record version of a model is bumped whenever update_output() appends new steps to its record
+        self.plot_downsampling = max(1, int(plot_downsampling))
+        self.record_version = dict()
+        self.figure_cache = FigureCache(max_bytes=figure_cache_budget_mb * 1024 * 1024)
+
+        # Streaming KPIs of each model (see CoSimKPI.py), updated with the steps of update_output() and shown below the plots
+        self.kpi = dict()
+
         # Use DashProxy instead of Dash to use ServerSideOutput
         #app = Dash(__name__)
         app = DashProxy(transforms=[ServersideOutputTransform()])
@@ -56,7 +108,12 @@ class CoSimGUI:
         #  -without parallelization: 89 sec
         #  -with parallelization: 19 sec
         # --> decieded to perform with parallelization
+        # With a session manifest, the sites still running from a previous run of the GUI are reattached by initialize() (a few seconds),
+        # and the sites of the models which are not used anymore are stopped
         if not self.test_gui_only:
+            for dir_manifest in sorted({cosim_session.manifest.dir_manifest for cosim_session in cosim_sessions if cosim_session.manifest is not None}):
+                for entry in reap_orphaned_sites(dir_manifest, [cosim_session.alias for cosim_session in cosim_sessions], debug=self.debug):
+                    print(f"=Stopped orphaned site {entry['site_id']} (alias: {entry['alias']})")
             self.cosim_sessions = Parallel(n_jobs=len(cosim_sessions))\
                                           (delayed(cosim_session.initialize)\
                                                   () for cosim_session in cosim_sessions)
@@ -92,19 +149,25 @@ class CoSimGUI:
 
                 # For each model, get initial record and assign initialization flag
                 self.initialized[cosim_session.alias] = False
+                self.record_version[cosim_session.alias] = 0
+                self.kpi[cosim_session.alias] = KPIAccumulator(name=cosim_session.alias,
+                                                               conditioned_zones=cosim_session.conditioned_zones,
+                                                               time_step_size=cosim_session.time_step_size)
                 self.record_initial[cosim_session.alias] = get_record_template(name=cosim_session.alias,
                                                                                time_start=time_start, 
                                                                                time_end=time_end, 
                                                                                conditioned_zones=cosim_session.conditioned_zones, 
                                                                                unconditioned_zones=cosim_session.unconditioned_zones, 
-                                                                               is_initial_record=True) if self.test_gui_only else \
+                                                                               is_initial_record=True,
+                                                                               events=True) if self.test_gui_only else \
                                                            get_record_template(name=cosim_session.alias,
                                                                                time_start=time_start, 
                                                                                time_end=time_end, 
                                                                                conditioned_zones=cosim_session.conditioned_zones, 
                                                                                unconditioned_zones=cosim_session.unconditioned_zones, 
                                                                                is_initial_record=True, 
-                                                                               output_step=cosim_session.retrieve_outputs())
+                                                                               output_step=cosim_session.retrieve_outputs(),
+                                                                               events=True)
 
             # Styles for label and input of information
             style_label_information = {'display': 'inline-block', 'width': '21em'}
@@ -253,7 +316,8 @@ class CoSimGUI:
         # Tested on surface laptop (100 steps, 3 models):
         #  -Without parallelization: 47.9603716 sec
         #  -With parallelization:  18.2678293 sec
-        def update_model_each(cosim_session: CoSimCore, steps_to_proceed):
+        def update_model_each(cosim_session: CoSimCore, steps_to_proceed, kpi):
+            # kpi is updated in the worker and returned, as the accumulator of the main process is not shared
             output_step = cosim_session.retrieve_outputs()
             time_sim_input = output_step[DATA.TIME_SIM]
             record_each = get_record_template(name=cosim_session.alias,
@@ -262,7 +326,8 @@ class CoSimGUI:
                                               conditioned_zones=cosim_session.conditioned_zones,
                                               unconditioned_zones=cosim_session.unconditioned_zones,
                                               is_initial_record=False, 
-                                              output_step=output_step)
+                                              output_step=output_step,
+                                              events=True)
             for _ in range(int(np.floor(float(steps_to_proceed)))):
                 control_input, control_information = \
                     cosim_session.compute_control(time_sim=time_sim_input,
@@ -284,22 +349,25 @@ class CoSimGUI:
                 update_record(output_step=output_step,
                               record=record_each,
                               conditioned_zones=cosim_session.conditioned_zones,
-                              unconditioned_zones=cosim_session.unconditioned_zones)
+                              unconditioned_zones=cosim_session.unconditioned_zones,
+                              kpi=kpi)
 
                 update_record(output_step=output_step,
                               record=record_each,
                               conditioned_zones=cosim_session.conditioned_zones,
                               unconditioned_zones=cosim_session.unconditioned_zones)
-            return cosim_session.alias, record_each
+            # The new rows are returned through shared memory (see CoSimSharedRecord.py), instead of being pickled by joblib
+            return cosim_session.alias, share_record(record_each), kpi
 
         record_aggregated = Parallel(n_jobs=len(self.cosim_sessions))\
                                     (delayed(update_model_each)\
-                                            (cosim_session, steps_to_proceed)
+                                            (cosim_session, steps_to_proceed, self.kpi[cosim_session.alias])
                                                 for cosim_session in self.cosim_sessions if cosim_session.alias in model_to_control)
 
         record_current = dict()
-        for alias, record_each in record_aggregated:
-            record_current[alias] = record_each.copy()
+        for alias, shared_each, kpi in record_aggregated:
+            record_current[alias] = shared_each
+            self.kpi[alias] = kpi
         
         # Record elapsed time for simulation?
         time_end = time.time_ns()
@@ -308,9 +376,11 @@ class CoSimGUI:
         ## Append global record with current record (except for DATA.SETTING)
         for cosim_session in self.cosim_sessions:
             if cosim_session.alias in model_to_control:
-                for category in [DATA.INPUT, DATA.STATUS]:
-                    for key in record_current[cosim_session.alias][category]:
-                        record[cosim_session.alias][category][key].extend(record_current[cosim_session.alias][category][key])
+                extend_record(record[cosim_session.alias], record_current[cosim_session.alias])
+
+                # New steps are appended: bump the record version so that cached figures of this model are never served again
+                self.record_version[cosim_session.alias] = self.record_version.get(cosim_session.alias, 0) + 1
+                self.figure_cache.invalidate(cosim_session.alias)
 
         print("update_output:refresh tab --> add a whitespace to change tab value triggerring graph update callback")
         tab_with_whitespace = tab + ' '
@@ -325,9 +395,7 @@ class CoSimGUI:
         print("exit:entering callback")
         print("n_clicks:", n_clicks)
         for cosim_session in self.cosim_sessions:
-            cosim_session.alfalfa_client.stop(
-                cosim_session.model_id     # site_id
-            )
+            cosim_session.tear_down()
         print("exit:finishing callback")
         exit()
         return n_clicks
@@ -347,6 +415,29 @@ class CoSimGUI:
             record[alias] = self.record_initial[alias].copy()
             print('render_plots:initial empty record is used (note: initialization will be done at update_output()')
 
+        # Serve the figure from the cache if the record of the model has not changed since it was rendered
+        key_cache = (alias, tab_stripped, self.record_version.get(alias, 0), self.plot_downsampling)
+        figure_json = self.figure_cache.get(key_cache)
+        if figure_json is not None:
+            print("render_plots:figure served from cache")
+            return html.Div([
+                dcc.Graph(
+                    id='-plot_dcc-',
+                    figure=json.loads(figure_json),
+                ),
+                self.render_kpi(alias)
+            ])
+
+        # Rows of the record, with the steps of the workers read from their Arrow tables (see CoSimSharedRecord.get_record_frame())
+        status = get_record_frame(record[alias], categories=[DATA.STATUS])
+        # Plot every n-th step only, if downsampling is requested
+        if self.plot_downsampling > 1:
+            status = status.iloc[::self.plot_downsampling]
+
+        # Setpoints, thermostat and occupant flags are change events (see CoSimEvents.py): plotted as steps held until the last step
+        events = events_to_frame(record[alias][DATA.EVENTS])
+        time_last = status[DATA.TIME_SIM].iloc[-1] if len(status) > 0 else None
+
         figure = make_subplots(
             rows=7, cols=1, shared_xaxes=True, vertical_spacing=0.02,
             subplot_titles=(
@@ -380,96 +471,58 @@ class CoSimGUI:
 
         ## Subplot 1: Temperature Plot
         # Add zone mean temperature for each zone
-        for key_record in record[alias][DATA.STATUS]:
+        for key_record in status:
             if DATA.ZONE_MEAN_TEMP in key_record:
                 figure.add_trace(
                     go.Scatter(name=key_record,
                                legendgroup='temperature', legendgrouptitle_text='Plot 1: Temperatures',
-                               x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][key_record]),
+                               x=status[DATA.TIME_SIM], y=status[key_record]),
                     row=1, col=1, secondary_y=False
                 )
 
-        figure.add_trace(
-            go.Scatter(name=DATA.HEATING_SETPOINT_DEADBAND_APPLIED,
-                       legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.HEATING_SETPOINT_DEADBAND_APPLIED]),
-            row=1, col=1, secondary_y=False
-        )
-        figure.add_trace(
-            go.Scatter(name=DATA.HEATING_SETPOINT_BASE,
-                       legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.HEATING_SETPOINT_BASE]),
-            row=1, col=1, secondary_y=False
-        )
-        figure.add_trace(
-            go.Scatter(name=DATA.COOLING_SETPOINT_DEADBAND_APPLIED,
-                       legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.COOLING_SETPOINT_DEADBAND_APPLIED]),
-            row=1, col=1, secondary_y=False
-        )
-        figure.add_trace(
-            go.Scatter(name=DATA.COOLING_SETPOINT_BASE,
-                       legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.COOLING_SETPOINT_BASE]),
-            row=1, col=1, secondary_y=False
-        )
+        for channel in [DATA.HEATING_SETPOINT_DEADBAND_APPLIED, DATA.HEATING_SETPOINT_BASE,
+                        DATA.COOLING_SETPOINT_DEADBAND_APPLIED, DATA.COOLING_SETPOINT_BASE]:
+            x_steps, y_steps = get_channel_steps(events, channel, time_end=time_last)
+            figure.add_trace(
+                go.Scatter(name=channel,
+                           legendgroup='temperature', line_shape='hv',
+                           x=x_steps, y=y_steps),
+                row=1, col=1, secondary_y=False
+            )
         figure.add_trace(
             go.Scatter(name=DATA.SYSTEM_NODE_TEMPERATURE,
                        legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.SYSTEM_NODE_TEMPERATURE]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.SYSTEM_NODE_TEMPERATURE]),
             row=1, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE,
                        legendgroup='temperature',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE]),
             row=1, col=1, secondary_y=False
         )
 
-        indices_habitual_override = np.where(np.array(record[alias][DATA.STATUS][DATA.OCCUPANT_HABITUAL_OVERRIDE]) == True)[0]
-        indices_discomfort_override = np.where(np.array(record[alias][DATA.STATUS][DATA.OCCUPANT_DISCOMFORT_OVERRIDE]) == True)[0]
-
-        x_coord_habitual_override = []
-        y_coord_habitual_override = []
-        for index_habitual_override in indices_habitual_override:
-            x_coord_habitual_override.append(record[alias][DATA.STATUS][DATA.TIME_SIM][index_habitual_override])
-            y_coord_habitual_override.append(record[alias][DATA.STATUS][DATA.HEATING_SETPOINT_BASE][index_habitual_override])
-
-            x_coord_habitual_override.append(record[alias][DATA.STATUS][DATA.TIME_SIM][index_habitual_override])
-            y_coord_habitual_override.append(record[alias][DATA.STATUS][DATA.COOLING_SETPOINT_BASE][index_habitual_override])
-        figure.add_trace(
-            go.Scatter(name=DATA.OCCUPANT_HABITUAL_OVERRIDE, mode='markers',
-                       legendgroup='temperature',
-                       marker={'color': 'blue', 'symbol': 'circle'},
-                       x=x_coord_habitual_override, y=y_coord_habitual_override),
-            row=1, col=1, secondary_y=False
-        )
-
-        x_coord_discomfort_override = []
-        y_coord_discomfort_override = []
-        for index_discomfort_override in indices_discomfort_override:
-            x_coord_discomfort_override.append(record[alias][DATA.STATUS][DATA.TIME_SIM][index_discomfort_override])
-            y_coord_discomfort_override.append(
-                record[alias][DATA.STATUS][DATA.HEATING_SETPOINT_BASE][index_discomfort_override])
-
-            x_coord_discomfort_override.append(record[alias][DATA.STATUS][DATA.TIME_SIM][index_discomfort_override])
-            y_coord_discomfort_override.append(
-                record[alias][DATA.STATUS][DATA.COOLING_SETPOINT_BASE][index_discomfort_override])
-        figure.add_trace(
-            go.Scatter(name=DATA.OCCUPANT_DISCOMFORT_OVERRIDE, mode='markers',
-                       legendgroup='temperature',
-                       marker={'color': 'red', 'symbol': 'x'},
-                       x=x_coord_discomfort_override, y=y_coord_discomfort_override),
-            row=1, col=1, secondary_y=False
-        )
+        # Overrides are read from the events, with the heating and cooling setpoints at the time of the override
+        overrides = get_override_events(events)
+        for channel, marker in [(DATA.OCCUPANT_HABITUAL_OVERRIDE, {'color': 'blue', 'symbol': 'circle'}),
+                                (DATA.OCCUPANT_DISCOMFORT_OVERRIDE, {'color': 'red', 'symbol': 'x'})]:
+            overrides_channel = overrides[overrides[EVENT_CHANNEL] == channel]
+            figure.add_trace(
+                go.Scatter(name=channel, mode='markers',
+                           legendgroup='temperature',
+                           marker=marker,
+                           x=list(overrides_channel[DATA.TIME_SIM]) * 2,
+                           y=list(overrides_channel[DATA.HEATING_SETPOINT_BASE]) + list(overrides_channel[DATA.COOLING_SETPOINT_BASE])),
+                row=1, col=1, secondary_y=False
+            )
 
         ## Subplot 2: Humidity Plot
-        for key_record in record[alias][DATA.STATUS]:
+        for key_record in status:
             if DATA.ZONE_RELATIVE_HUMIDITY in key_record:
                 figure.add_trace(
                     go.Scatter(name=key_record,
                                legendgroup='humidity', legendgrouptitle_text='Plot 2: Humidity',
-                               x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][key_record]),
+                               x=status[DATA.TIME_SIM], y=status[key_record]),
                     row=2, col=1, secondary_y=False
                 )
 
@@ -477,19 +530,19 @@ class CoSimGUI:
         figure.add_trace(
             go.Scatter(name=DATA.HEATING_COIL_RUNTIME_FRACTION,
                        legendgroup='runtime', legendgrouptitle_text='Plot 3: Runtime Fraction',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.HEATING_COIL_RUNTIME_FRACTION]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.HEATING_COIL_RUNTIME_FRACTION]),
             row=3, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.COOLING_COIL_RUNTIME_FRACTION,
                        legendgroup='runtime',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.COOLING_COIL_RUNTIME_FRACTION]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.COOLING_COIL_RUNTIME_FRACTION]),
             row=3, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE,
                        legendgroup='runtime',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE]),
             row=3, col=1, secondary_y=False
         )
 
@@ -497,43 +550,31 @@ class CoSimGUI:
         figure.add_trace(
             go.Scatter(name=DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE,
                        legendgroup='airflow', legendgrouptitle_text='Plot 4: Airflow',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE]),
             row=4, col=1, secondary_y=False
         )
 
         ## Subplot 5: Occupancy Plot
-        # Remove 'None' from the data using backfill
-        data_thermostat_schedule = np.array(record[alias][DATA.STATUS][DATA.THERMOSTAT_SCHEDULE]).copy()
-        data_thermostat_mode = np.array(record[alias][DATA.STATUS][DATA.THERMOSTAT_MODE]).copy()
-
-        indices_none_thermostat_schedule = np.where(data_thermostat_schedule == 'None')[0]
-        indices_none_thermostat_mode = np.where(data_thermostat_mode == 'None')[0]
-
-        if len(data_thermostat_schedule) > 1:
-            for index_none_thermostat_schedule in indices_none_thermostat_schedule:
-                data_thermostat_schedule[index_none_thermostat_schedule] = data_thermostat_schedule[
-                    index_none_thermostat_schedule + 1]
-
-        if len(data_thermostat_mode) > 1:
-            for index_none_thermostat_mode in indices_none_thermostat_mode:
-                data_thermostat_mode[index_none_thermostat_mode] = data_thermostat_mode[index_none_thermostat_mode + 1]
-
+        # 'None' (before the first control step) is not plotted
+        x_steps, y_steps = get_channel_steps(events, DATA.THERMOSTAT_SCHEDULE, time_end=time_last, skip_none=True)
         figure.add_trace(
             go.Scatter(name=DATA.THERMOSTAT_SCHEDULE,
-                       legendgroup='occupancy', legendgrouptitle_text='Plot 5: Occupancy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_thermostat_schedule),
+                       legendgroup='occupancy', legendgrouptitle_text='Plot 5: Occupancy', line_shape='hv',
+                       x=x_steps, y=y_steps),
             row=5, col=1, secondary_y=False
         )
+        x_steps, y_steps = get_channel_steps(events, DATA.THERMOSTAT_MODE, time_end=time_last, skip_none=True)
         figure.add_trace(
             go.Scatter(name=DATA.THERMOSTAT_MODE,
-                       legendgroup='occupancy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_thermostat_mode),
+                       legendgroup='occupancy', line_shape='hv',
+                       x=x_steps, y=y_steps),
             row=5, col=1, secondary_y=False
         )
+        x_steps, y_steps = get_channel_steps(events, DATA.OCCUPANT_MOTION, time_end=time_last)
         figure.add_trace(
             go.Scatter(name=DATA.OCCUPANT_MOTION,
-                       legendgroup='occupancy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.OCCUPANT_MOTION]),
+                       legendgroup='occupancy', line_shape='hv',
+                       x=x_steps, y=y_steps),
             row=5, col=1, secondary_y=False
         )
 
@@ -541,21 +582,21 @@ class CoSimGUI:
         figure.add_trace(
             go.Scatter(name=DATA.OCCUPANT_THERMAL_FRUSTRATION,
                        legendgroup='sensation', legendgrouptitle_text='Plot 6: Thermal Frustration',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.OCCUPANT_THERMAL_FRUSTRATION]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.OCCUPANT_THERMAL_FRUSTRATION]),
             row=6, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.OCCUPANT_COMFORT_DELTA,
                        legendgroup='sensation',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=record[alias][DATA.STATUS][DATA.OCCUPANT_COMFORT_DELTA]),
+                       x=status[DATA.TIME_SIM], y=status[DATA.OCCUPANT_COMFORT_DELTA]),
             row=6, col=1, secondary_y=True
         )
 
         ## Subplot 7: HVAC Energy Plot
-        data_cooling_coil_energy = np.array(record[alias][DATA.STATUS][DATA.COOLING_COIL_ELECTRICITY_ENERGY]).copy()
-        data_heating_coil_electricity_energy = np.array(record[alias][DATA.STATUS][DATA.HEATING_COIL_ELECTRICITY_ENERGY]).copy()
-        data_heating_coil_fuel_energy = np.array(record[alias][DATA.STATUS][DATA.HEATING_COIL_FUEL_ENERGY]).copy()
-        data_fan_energy = np.array(record[alias][DATA.STATUS][DATA.FAN_ELECTRICITY_ENERGY]).copy()
+        data_cooling_coil_energy = np.array(status[DATA.COOLING_COIL_ELECTRICITY_ENERGY]).copy()
+        data_heating_coil_electricity_energy = np.array(status[DATA.HEATING_COIL_ELECTRICITY_ENERGY]).copy()
+        data_heating_coil_fuel_energy = np.array(status[DATA.HEATING_COIL_FUEL_ENERGY]).copy()
+        data_fan_energy = np.array(status[DATA.FAN_ELECTRICITY_ENERGY]).copy()
         data_hvac_energy = data_cooling_coil_energy + \
                            data_heating_coil_electricity_energy + \
                            data_heating_coil_fuel_energy + \
@@ -564,41 +605,53 @@ class CoSimGUI:
         figure.add_trace(
             go.Scatter(name=DATA.COOLING_COIL_ELECTRICITY_ENERGY,
                        legendgroup='energy', legendgrouptitle_text='Plot 7: Energy Usage',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_cooling_coil_energy),
+                       x=status[DATA.TIME_SIM], y=data_cooling_coil_energy),
             row=7, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.HEATING_COIL_ELECTRICITY_ENERGY,
                        legendgroup='energy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_heating_coil_electricity_energy),
+                       x=status[DATA.TIME_SIM], y=data_heating_coil_electricity_energy),
             row=7, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.HEATING_COIL_FUEL_ENERGY,
                        legendgroup='energy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_heating_coil_fuel_energy),
+                       x=status[DATA.TIME_SIM], y=data_heating_coil_fuel_energy),
             row=7, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name=DATA.FAN_ELECTRICITY_ENERGY,
                        legendgroup='energy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_fan_energy),
+                       x=status[DATA.TIME_SIM], y=data_fan_energy),
             row=7, col=1, secondary_y=False
         )
         figure.add_trace(
             go.Scatter(name='HVAC total energy input',
                        legendgroup='energy',
-                       x=record[alias][DATA.STATUS][DATA.TIME_SIM], y=data_hvac_energy),
+                       x=status[DATA.TIME_SIM], y=data_hvac_energy),
             row=7, col=1, secondary_y=False
         )
 
+        self.figure_cache.put(key_cache, figure.to_json())
+
         return html.Div([
             dcc.Graph(
                 id='-plot_dcc-',
                 figure=figure,
-            )
+            ),
+            self.render_kpi(alias)
         ])
 
+    def render_kpi(self, alias):
+        # KPIs of the whole run so far, from the streaming accumulator (no pass over the record)
+        if alias not in self.kpi or self.kpi[alias].total.steps == 0:
+            return html.Div()
+        kpi = self.kpi[alias].totals()
+        return html.Table([html.Tr([html.Th(key) for key in kpi]),
+                           html.Tr([html.Td(f'{value:.2f}' if isinstance(value, float) else str(value)) for value in kpi.values()])],
+                          style={'font-size': 'small'})
+
     def change_control_mode(self, value_radio, control_mode, debug=True):
         ## Note: graph reference --> https://plotly.com/javascript/reference/
         if value_radio == CONTROL.PASSTHROUGH:
@@ -638,7 +691,7 @@ class CoSimGUI:
         for cosim_session in self.cosim_sessions:
             sheet_prefix = cosim_session.alias.split(':')[0]
             record_setting = pd.DataFrame.from_dict(record[cosim_session.alias][DATA.SETTING])
-            record_data = pd.DataFrame.from_dict({**record[cosim_session.alias][DATA.INPUT], **record[cosim_session.alias][DATA.STATUS]})
+            record_data = get_record_frame(record[cosim_session.alias])
             record_setting.to_excel(writer, sheet_name=sheet_prefix + '_' + DATA.SETTING, index=False)  # writes to BytesIO buffer
             record_data.to_excel(writer, sheet_name=sheet_prefix + '_' + DATA.DATA, index=False)
 
@@ -702,6 +755,10 @@ if __name__ == "__main__":
 
     # Resolve the IP address of another container by its name
     alfalfa_url = 'http://localhost'
+    # Folder of the session manifest: if the GUI is restarted without pressing exit, the running sites are reattached instead of submitted again
+    path_session_manifest = os.path.join('output', 'session_manifest')
+    # Folder of the pool of warm sites: if a site pool is running (see CoSimSitePool.py), the models lease its started sites (no submission and warm-up)
+    path_site_pool = os.path.join('output', 'site_pool')
 
     ## Simulation Time
     time_start = datetime.datetime(2019, 1, 1, 0, 0, 0)
@@ -749,6 +806,8 @@ if __name__ == "__main__":
             SETTING.PATH_BUILDING_MODEL: os.path.join('cosim', 'ip_op', 'idf_files', model_name),
             SETTING.CONDITIONED_ZONES: conditioned_zones,
             SETTING.UNCONDITIONED_ZONES: unconditioned_zones,
+            SETTING.PATH_SESSION_MANIFEST: path_session_manifest,
+            SETTING.PATH_SITE_POOL: path_site_pool,
         }
         simulation_information = {
             SETTING.TIME_START: time_start,
@@ -0,0 +1,294 @@
+import threading
+import uuid
+
+import pandas as pd
+
+from CoSimDict import SETTING, DATA
+from CoSimUtils import create_model_archive, record_to_output_data
+from CoSimStorage import read_results
+from CoSimSurrogate import SurrogateClient
+
+
+class SimulationBackend:
+    """
+    Interface between CoSimCore and the simulator of the building models.
+    Lifecycle: submit() --> start() --> [write_inputs() --> advance() --> read_outputs()]* --> stop()
+    Batched methods take a list of site_ids, so that backends able to serve several sites per request (or in one pass) can do so.
+
+    Capability flags:
+      - supports_multi_site_advance: advance() of several sites is a single request (otherwise, it is split per site)
+      - supports_fast_forward: inputs persist until changed, so that open-loop stepping can skip set_inputs (see CoSimCore.fast_forward())
+      - in_process: the sites are simulated in this process (no HTTP serialization), and one backend instance is shared by the sessions of the process
+    """
+    name = None
+    supports_multi_site_advance = False
+    supports_fast_forward = False
+    in_process = False
+    # Key of the building model information used as the model path of submit()
+    model_path_setting = SETTING.PATH_BUILDING_MODEL
+
+    def __init__(self, host=None):
+        self.host = host
+
+    # Lifecycle
+    def submit(self, model_path, alias):
+        raise NotImplementedError
+
+    def get_site_id(self, alias):
+        raise NotImplementedError
+
+    def set_alias(self, site_id, alias):
+        raise NotImplementedError
+
+    def start(self, site_id, time_start, time_end, time_scale, external_clock):
+        raise NotImplementedError
+
+    def status(self, site_id):
+        raise NotImplementedError
+
+    def stop(self, site_id):
+        raise NotImplementedError
+
+    # Single site read/write/advance
+    def set_inputs(self, site_id, inputs):
+        raise NotImplementedError
+
+    def get_outputs(self, site_id):
+        raise NotImplementedError
+
+    def get_sim_time(self, site_id):
+        raise NotImplementedError
+
+    def advance(self, site_ids):
+        for site_id in site_ids:
+            self.advance_site(site_id)
+
+    def advance_site(self, site_id):
+        raise NotImplementedError
+
+    # Batched read/write (overridden by backends with batched requests)
+    def write_inputs(self, site_ids, list_inputs):
+        for site_id, inputs in zip(site_ids, list_inputs):
+            self.set_inputs(site_id, inputs)
+
+    def read_outputs(self, site_ids):
+        return [self.get_outputs(site_id) for site_id in site_ids]
+
+    def read_sim_times(self, site_ids):
+        return [self.get_sim_time(site_id) for site_id in site_ids]
+
+
+class ClientBackend(SimulationBackend):
+    # Backend calling a client with the surface of alfalfa_client.AlfalfaClient
+    def __init__(self, host=None, client=None):
+        super().__init__(host)
+        self.client = client
+
+    def prepare_model(self, model_path):
+        return model_path
+
+    def submit(self, model_path, alias):
+        ## Note: Do not put argument names for alfalfa_client.submit(), as it will raise error for the GUI version
+        site_id = self.client.submit(
+            self.prepare_model(model_path),     # model_path
+            True                                # wait_for_status
+        )
+        self.client.set_alias(
+            alias=alias,
+            site_id=site_id
+        )
+        self.client.wait(
+            site_id,    # site_id
+            "ready"     # desired_status
+        )
+        return site_id
+
+    def get_site_id(self, alias):
+        return self.client.get_alias(alias)
+
+    def set_alias(self, site_id, alias):
+        self.client.set_alias(
+            alias=alias,
+            site_id=site_id
+        )
+
+    def start(self, site_id, time_start, time_end, time_scale, external_clock):
+        self.client.start(
+            site_id,            # site_id
+            time_start,         # start_datatime: time to start the model from
+            time_end,           # end_datetime: time to stop the model at (may not be honored for external_clock=True)
+            time_scale,         # timescale: multiple of real time to run model at (for external_clock=False)
+            external_clock,     # external_clock
+            False,              # Realtime flag (time_scale = 1)
+            True                # wait_for_status
+        )
+
+    def status(self, site_id):
+        return self.client.status(site_id)
+
+    def stop(self, site_id):
+        self.client.stop(
+            site_id     # site_id
+        )
+
+    def set_inputs(self, site_id, inputs):
+        self.client.set_inputs(
+            site_id,    # site_id
+            inputs      # inputs
+        )
+
+    def get_outputs(self, site_id):
+        return self.client.get_outputs(
+            site_id     # site_id
+        )
+
+    def get_sim_time(self, site_id):
+        return self.client.get_sim_time(
+            site_id     # site_id
+        )
+
+    def advance(self, site_ids):
+        if self.supports_multi_site_advance:
+            self.client.advance(
+                list(site_ids)  # site_id
+            )
+        else:
+            super().advance(site_ids)
+
+    def advance_site(self, site_id):
+        self.client.advance(
+            [site_id]   # site_id
+        )
+
+
+class AlfalfaBackend(ClientBackend):
+    # Alfalfa deployment at `host` (SETTING.ALFALFA_URL)
+    name = 'alfalfa'
+    supports_multi_site_advance = True
+    supports_fast_forward = True
+
+    def __init__(self, host=None):
+        # Imported here, so that in-process backends do not need alfalfa_client
+        from alfalfa_client import alfalfa_client as ac
+        super().__init__(host, ac.AlfalfaClient(host=host))
+
+    def prepare_model(self, model_path):
+        return create_model_archive(model_path)  ## Example from Alfalfa as is
+
+
+class InProcessBackend(ClientBackend):
+    # In-process client (no HTTP serialization), shared by every session of the process
+    name = 'in_process'
+    supports_multi_site_advance = True
+    supports_fast_forward = True
+    in_process = True
+
+
+class SurrogateBackend(InProcessBackend):
+    # Surrogate models of the buildings (see CoSimSurrogate.py), simulated in this process
+    name = 'surrogate'
+    model_path_setting = SETTING.PATH_SURROGATE_MODEL
+
+    def __init__(self, host=None):
+        super().__init__(host, SurrogateClient())
+
+
+class TraceClient:
+    """
+    In-process client playing back the outputs of a results file, whatever the inputs (e.g., to test the co-simulation loop without Alfalfa).
+    The model path given to submit() is the path of a results file.
+    """
+    def __init__(self, host=None):
+        self.traces = dict()    # site_id --> list of output_step
+        self.rows = dict()      # site_id --> current row
+        self.inputs = dict()
+        self.site_status = dict()
+        self.aliases = dict()
+        # Sessions may be initialized by threads (e.g., CoSimGroup, CoSimVectorEnv) sharing this client
+        self.lock = threading.Lock()
+
+    def submit(self, model_path, wait_for_status=True):
+        # Unique site per session, even if the sessions play back the same file
+        site_id = model_path + '#' + str(uuid.uuid4())
+        output_data, _, _ = record_to_output_data(read_results(model_path))
+        with self.lock:
+            self.traces[site_id] = output_data.to_dict('records')
+            self.site_status[site_id] = 'ready'
+        return site_id
+
+    def set_alias(self, alias, site_id):
+        self.aliases[alias] = site_id
+
+    def get_alias(self, alias):
+        return self.aliases[alias]
+
+    def wait(self, site_id, desired_status):
+        return
+
+    def status(self, site_id):
+        return self.site_status[site_id]
+
+    def start(self, site_id, start_datetime, end_datetime=None, timescale=None, external_clock=True, realtime=False, wait_for_status=True):
+        # Playback starts from the first row at or after start_datetime
+        with self.lock:
+            times = [pd.Timestamp(output_step[DATA.TIME_SIM]) for output_step in self.traces[site_id]]
+            self.rows[site_id] = next((row for row, time_row in enumerate(times) if time_row >= pd.Timestamp(start_datetime)), 0)
+            self.site_status[site_id] = 'running'
+
+    def set_inputs(self, site_id, inputs):
+        self.inputs[site_id] = inputs
+
+    def advance(self, site_ids):
+        for site_id in site_ids:
+            self.rows[site_id] = min(self.rows[site_id] + 1, len(self.traces[site_id]) - 1)
+
+    def get_outputs(self, site_id):
+        return dict(self.traces[site_id][self.rows[site_id]])
+
+    def get_sim_time(self, site_id):
+        return pd.Timestamp(self.traces[site_id][self.rows[site_id]][DATA.TIME_SIM]).to_pydatetime()
+
+    def stop(self, site_id):
+        self.site_status[site_id] = 'complete'
+
+
+class TraceBackend(InProcessBackend):
+    # Playback of results files (SETTING.PATH_TRACE), for tests and replay
+    name = 'trace'
+    model_path_setting = SETTING.PATH_TRACE
+
+    def __init__(self, host=None):
+        super().__init__(host, TraceClient())
+
+
+# Backends selected by SETTING.BACKEND of the building model information
+# (InProcessBackend is the base of in-process backends, e.g., register_backend() of a subclass creating its own client)
+BACKENDS = {backend.name: backend for backend in [AlfalfaBackend, SurrogateBackend, TraceBackend]}
+
+# In-process backends are shared by the sessions of this process, so that their sites are advanced together
+_BACKENDS_IN_PROCESS = dict()
+
+
+def register_backend(backend_class):
+    BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+
+def get_backend_name(building_model_information):
+    # Default: Alfalfa, or the surrogate if only a surrogate model is given
+    if building_model_information.get(SETTING.BACKEND) is not None:
+        return building_model_information[SETTING.BACKEND]
+    if building_model_information.get(SETTING.PATH_SURROGATE_MODEL) is not None:
+        return SurrogateBackend.name
+    return AlfalfaBackend.name
+
+
+def create_backend(name, host=None):
+    if name not in BACKENDS:
+        raise ValueError("Not valid backend:", name, "(available backends:", list(BACKENDS), ")")
+    backend_class = BACKENDS[name]
+    if not backend_class.in_process:
+        return backend_class(host=host)
+    if (name, host) not in _BACKENDS_IN_PROCESS:
+        _BACKENDS_IN_PROCESS[(name, host)] = backend_class(host=host)
+    return _BACKENDS_IN_PROCESS[(name, host)]
@@ -0,0 +1,142 @@
+import datetime
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from CoSimDict import SETTING
+
+# Settings which do not change the results of a run (where and how it is simulated)
+CACHE_EXCLUDED_SETTINGS = [SETTING.ALFALFA_URL, SETTING.ENDPOINT_POOL, SETTING.PATH_SESSION_MANIFEST, SETTING.PATH_SITE_POOL]
+# Settings given as paths: the content of the file or folder is hashed instead of the path
+CACHE_HASHED_PATHS = [SETTING.PATH_BUILDING_MODEL, SETTING.PATH_SURROGATE_MODEL, SETTING.PATH_TRACE, SETTING.PATH_CSV_DIR, SETTING.PATH_MODEL_DIR]
+# Settings given as a name or as the path of a file (e.g., a built-in thermostat program or a JSON/CSV program): the content is hashed if it is a file
+CACHE_HASHED_FILES = [SETTING.THERMOSTAT_SCHEDULE_TYPE]
+
+# Hashes of files, memoized by (path, size, mtime) so that the model folders are only read once per process
+_HASHES_FILE = dict()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _HASHES_FILE:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        _HASHES_FILE[key] = digest.hexdigest()
+    return _HASHES_FILE[key]
+
+
+def hash_path(path, pattern='**/*'):
+    # Hash of the content of a file, or of every file of a folder (with their relative paths)
+    if path is None:
+        return None
+    if os.path.isfile(path):
+        return hash_file(path)
+    digest = hashlib.sha256()
+    for path_file in sorted(glob.glob(os.path.join(path, pattern), recursive=True)):
+        if os.path.isfile(path_file):
+            digest.update(os.path.relpath(path_file, path).replace(os.sep, '/').encode())
+            digest.update(hash_file(path_file).encode())
+    return digest.hexdigest()
+
+
+def get_code_version(dir_source=None):
+    # Hash of the Python sources of the co-simulation (including the occupant model), so that a change of code invalidates the cache
+    dir_source = dir_source if dir_source is not None else os.path.dirname(os.path.abspath(__file__))
+    return hash_path(dir_source, pattern='**/*.py')
+
+
+def normalize_setting(key, value):
+    # JSON-serializable and deterministic representation of a setting
+    if key in CACHE_HASHED_PATHS:
+        return hash_path(value)
+    if key in CACHE_HASHED_FILES and isinstance(value, str) and os.path.isfile(value):
+        return hash_file(value)
+    if isinstance(value, dict):
+        return {str(key_item): normalize_setting(key_item, value_item) for key_item, value_item in sorted(value.items(), key=lambda item: str(item[0]))
+                if key_item not in CACHE_EXCLUDED_SETTINGS}
+    if isinstance(value, (list, tuple)):
+        return [normalize_setting(None, value_item) for value_item in value]
+    if isinstance(value, type) or callable(value):
+        return getattr(value, '__module__', '') + '.' + getattr(value, '__qualname__', repr(value))
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # NumPy scalars
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+def get_run_fingerprint(input_each, run_settings, code_version=None):
+    """
+    Deterministic fingerprint of a run: settings of the session (same format as the inputs of CoSimMain.py, with the content of the
+    building model and occupant model files instead of their paths), settings of the run (control mode, steps, replicate, ...) and code version.
+    :param run_settings: dictionary of the settings of the run which change its results
+    """
+    fingerprint = {'input': normalize_setting(None, input_each),
+                   'run': normalize_setting(None, run_settings),
+                   'code': code_version if code_version is not None else get_code_version()}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Index of the results files by run fingerprint (SQLite file, shared by the processes of a batch run).
+    Cached files are evicted by age (since their last use) and by total size (least recently used first), if limits are given.
+    """
+    def __init__(self, path_index, max_age_days=None, max_size_gb=None, timeout=60.0):
+        self.path_index = path_index
+        self.max_age_days = max_age_days
+        self.max_size_gb = max_size_gb
+        self.timeout = timeout
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'fingerprint TEXT PRIMARY KEY, path TEXT, size INTEGER, description TEXT, time_created REAL, time_accessed REAL)')
+
+    def connect(self):
+        return sqlite3.connect(self.path_index, timeout=self.timeout)
+
+    def lookup(self, fingerprint):
+        # Path of the cached results file, or None (entries whose file was removed are dropped)
+        with self.connect() as connection:
+            row = connection.execute('SELECT path FROM results WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.isfile(row[0]):
+                connection.execute('DELETE FROM results WHERE fingerprint = ?', (fingerprint,))
+                return None
+            connection.execute('UPDATE results SET time_accessed = ? WHERE fingerprint = ?', (time.time(), fingerprint))
+        return row[0]
+
+    def store(self, fingerprint, path, description=None):
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                               (fingerprint, path, os.path.getsize(path), json.dumps(description, default=str), time.time(), time.time()))
+        return path
+
+    def evict(self):
+        # Remove the results files beyond the limits of age and size (with their KPI summaries and events), and their entries
+        with self.connect() as connection:
+            rows = connection.execute('SELECT fingerprint, path, size, time_accessed FROM results ORDER BY time_accessed').fetchall()
+        evicted = []
+        size_total = sum(size for _, _, size, _ in rows)
+        for fingerprint, path, size, time_accessed in rows:
+            too_old = self.max_age_days is not None and time.time() - time_accessed > self.max_age_days * 86400
+            too_large = self.max_size_gb is not None and size_total > self.max_size_gb * 1e9
+            if not (too_old or too_large):
+                continue
+            for path_file in [path, os.path.splitext(path)[0] + '_kpi.json', os.path.splitext(path)[0] + '_events.parquet']:
+                if os.path.isfile(path_file):
+                    os.remove(path_file)
+            size_total -= size
+            evicted.append(path)
+            with self.connect() as connection:
+                connection.execute('DELETE FROM results WHERE fingerprint = ?', (fingerprint,))
+        return evicted
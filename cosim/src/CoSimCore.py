@@ -1,15 +1,16 @@
-from CoSimUtils import is_convertable_to_float, create_model_archive, initialize_control_information, apply_deadband
+from CoSimUtils import is_convertable_to_float, initialize_control_information, apply_deadband, read_schedule, get_schedule_setpoints
 
-import base64
 import pandas as pd
 import pickle
-import io
-from datetime import datetime, timedelta
+from datetime import timedelta
 import time
 import pathlib
 
-from alfalfa_client import alfalfa_client as ac
 from CoSimDict import SETTING, DATA, CONTROL
+from CoSimBackend import create_backend, get_backend_name, BACKENDS
+from CoSimManifest import SessionManifest, get_config_hash, stop_site, MANIFEST_UPDATE_SECONDS, STATUS_REATTACHABLE
+from CoSimSitePool import lease_warm_site
+from CoSimKPI import KPI_ENERGY_CHANNELS, KPI_ENERGY_CUMULATIVE
 
 class CoSimCore:
     def __init__(self,
@@ -28,9 +29,23 @@ class CoSimCore:
         
         # Import building model settings
         self.alfalfa_url = building_model_information[SETTING.ALFALFA_URL]
-        self.model_path = building_model_information[SETTING.PATH_BUILDING_MODEL]
+        # If a pool of Alfalfa deployments is given, the session is placed on one of them at initialize()
+        self.endpoint_pool = building_model_information.get(SETTING.ENDPOINT_POOL)
+        self.endpoint = None
+        # Simulation backend (see CoSimBackend.py): Alfalfa by default
+        self.backend_name = get_backend_name(building_model_information)
+        self.backend = None
+        self.model_path = building_model_information[BACKENDS[self.backend_name].model_path_setting]
         self.conditioned_zones = building_model_information[SETTING.CONDITIONED_ZONES]
         self.unconditioned_zones = building_model_information[SETTING.UNCONDITIONED_ZONES]
+        # If a manifest folder is given, the site of the session is recorded there and reattached by initialize() after a restart
+        path_session_manifest = building_model_information.get(SETTING.PATH_SESSION_MANIFEST)
+        self.manifest = SessionManifest(path_session_manifest) if path_session_manifest is not None else None
+        # If a site pool folder is given, a warm site of the same configuration is leased by initialize() when available
+        self.path_site_pool = building_model_information.get(SETTING.PATH_SITE_POOL)
+        self.config_hash = None
+        self.reattached = False
+        self.time_manifest = 0.0
 
         # Import simulation settings
         self.time_start = simulation_information[SETTING.TIME_START]
@@ -41,7 +56,8 @@ class CoSimCore:
         self.time_sim = self.time_start # Initial simulation time == time_start
 
         # Import occupant model settings
-        self.o_occupant_model = occupant_model_information[SETTING.OCCUPANT_MODEL]
+        self.o_occupant_model_class = occupant_model_information[SETTING.OCCUPANT_MODEL]
+        self.o_occupant_model = None
         self.o_num_occupants = occupant_model_information[SETTING.NUM_OCCUPANT]
         self.o_num_homes = occupant_model_information[SETTING.NUM_HOME]
         self.o_discomfort_theory = occupant_model_information[SETTING.DISCOMFORT_THEORY]
@@ -58,10 +74,22 @@ class CoSimCore:
         self.current_datetime = thermostat_model_information[SETTING.CURRENT_DATETIME]
         self.idf_db = thermostat_model_information[SETTING.IDF_DB]
 
-    def initialize(self):
+        # Schedule file parsed once (contents, lookup table), instead of decoding the uploaded file at every step
+        self.schedule_lookup = (None, None)
+        # Energy of the steps advanced but not retrieved since the last retrieve_outputs() (channel --> sum), and number of steps advanced
+        self.energy_advanced = None
+        self.steps_advanced = 1
+        # Cumulative meters of the energy channels at the last retrieve_outputs(), if the building model reports them (see DATA.ENERGY_CUMULATIVE)
+        self.energy_cumulative = None
+
+    def initialize_thermostat_model(self):
         self.thermostat_model = self.thermostat_model(schedule_type=self.thermostat_schedule_type,
                                                       current_datetime=self.current_datetime,
-                                                      db=self.idf_db)
+                                                      db=self.idf_db,
+                                                      end_datetime=self.time_end)
+        return self.thermostat_model
+
+    def create_occupant_model(self, num_homes):
         init_data_dir = pathlib.Path(self.o_occupant_model_data_paths[SETTING.PATH_CSV_DIR]).resolve()
         models_dir = pathlib.Path(self.o_occupant_model_data_paths[SETTING.PATH_MODEL_DIR]).resolve()
         data_files = list(init_data_dir.iterdir())
@@ -72,63 +100,55 @@ class CoSimCore:
         models = {}
         for model_file in model_files:
             models[model_file.stem] = pickle.load(open(model_file,'rb'))
-        self.o_occupant_model = self.o_occupant_model(units="c",
-                                                      N_homes=self.o_num_homes,
-                                                      N_occupants_in_home=self.o_num_occupants,
-                                                      sampling_frequency=self.time_step_size,
-                                                      init_data=init_data,
-                                                      models=models, 
-                                                      discomfort_theory_name=self.o_discomfort_theory, 
-                                                      comfort_temperature=self.o_occup_comfort_temperature,
-                                                      threshold=self.o_discomfort_theory_threshold,
-                                                      TFT_alpha=self.o_TFT_alpha,
-                                                      TFT_beta=self.o_TFT_beta,
-                                                      start_datetime=self.time_start,
-                                                      tstat_db=self.o_tstat_db)
-
-        if self.debug: print(f"\n==Initializing alfalfa client, connecting to the Alfalfa at: {self.alfalfa_url}")
-        self.alfalfa_client = ac.AlfalfaClient(host=self.alfalfa_url)
-        if self.debug: print(f"\t--> Complete!\n")
-
-        self.model_archive_path = create_model_archive(self.model_path)  ## Example from Alfalfa as is
-        
-        if self.debug: print(f"\n=Submitting building model <{self.model_path}> from <{self.model_archive_path}>", end="\n")
-        
-        ## Note: Do not put argument names for alfalfa_client.submit(), as it will raise error for the GUI version
-        self.model_id = self.alfalfa_client.submit(
-            self.model_archive_path,    # model_path
-            True                        # wait_for_status
-        )
-        """
-        self.alfalfa_client.wait(
-            self.model_id,  # site_id
-            "ready"         # desired_status
-        )
-        """
-        
-        ## This alias is to test bacnet bridge and/or multiple model test
-        self.alfalfa_client.set_alias(
-            alias=self.alias,
-            site_id=self.model_id
-        )
-        site_id_check = self.alfalfa_client.get_alias(self.alias)
-        if self.debug: print(f"\t--> Complete! (site_id: {self.model_id}, alias: {self.alias}), compare with site_id: {site_id_check}")
-
-        if self.debug: print(f"\n=Warming up the building model...", end="\n")
-        self.alfalfa_client.wait(
-            self.model_id,  # site_id
-            "ready"         # desired_status
-        )
-        self.alfalfa_client.start(
-            self.model_id,          # site_id
-            self.time_start,        # start_datatime: time to start the model from
-            self.time_end,          # end_datetime: time to stop the model at (may not be honored for external_clock=True)
-            self.time_scale,        # timescale: multiple of real time to run model at (for external_clock=False)
-            self.external_clock,    # external_clock
-            False,                  # Realtime flag (time_scale = 1)
-            True                    # wait_for_status
-        )
-        if self.debug: print(f"\t--> site_id: {self.model_id} with alias: {self.alias} is warmed up! (status: {self.alfalfa_client.status(self.model_id)})\n")
+        return self.o_occupant_model_class(units="c",
+                                           N_homes=num_homes,
+                                           N_occupants_in_home=self.o_num_occupants,
+                                           sampling_frequency=self.time_step_size,
+                                           init_data=init_data,
+                                           models=models, 
+                                           discomfort_theory_name=self.o_discomfort_theory, 
+                                           comfort_temperature=self.o_occup_comfort_temperature,
+                                           threshold=self.o_discomfort_theory_threshold,
+                                           TFT_alpha=self.o_TFT_alpha,
+                                           TFT_beta=self.o_TFT_beta,
+                                           start_datetime=self.time_start,
+                                           tstat_db=self.o_tstat_db)
+
+    def initialize(self, shared_occupant_model=False):
+        # shared_occupant_model: if True, the occupant model is not created here, as it is stepped for several homes by CoSimGroup
+        self.initialize_thermostat_model()
+        if not shared_occupant_model:
+            self.o_occupant_model = self.create_occupant_model(num_homes=self.o_num_homes)
+
+        entry = None
+        if self.manifest is not None or self.path_site_pool is not None:
+            self.config_hash = get_config_hash(self.backend_name, self.model_path, self.time_start, self.time_end,
+                                               self.time_step_size, self.time_scale, self.external_clock)
+        if self.manifest is not None:
+            entry = self.manifest.read(self.alias)
+        if self.endpoint_pool is not None:
+            self.endpoint = self.endpoint_pool.acquire(self.alias, url_preferred=entry['host'] if entry is not None else None)
+            self.alfalfa_url = self.endpoint.url
+        if self.debug: print(f"\n==Initializing {self.backend_name} backend (host: {self.alfalfa_url})")
+        try:
+            self.backend = create_backend(self.backend_name, host=self.alfalfa_url)
+            if self.debug: print(f"\t--> Complete!\n")
+
+            if not self.reattach_site(entry) and not self.lease_site():
+                if self.debug: print(f"\n=Submitting building model <{self.model_path}>", end="\n")
+                ## This alias is to test bacnet bridge and/or multiple model test
+                self.model_id = self.backend.submit(self.model_path, self.alias)
+                site_id_check = self.backend.get_site_id(self.alias)
+                if self.debug: print(f"\t--> Complete! (site_id: {self.model_id}, alias: {self.alias}), compare with site_id: {site_id_check}")
+
+                if self.debug: print(f"\n=Warming up the building model...", end="\n")
+                self.backend.start(self.model_id, self.time_start, self.time_end, self.time_scale, self.external_clock)
+                if self.debug: print(f"\t--> site_id: {self.model_id} with alias: {self.alias} is warmed up! (status: {self.backend.status(self.model_id)})\n")
+            self.write_manifest()
+        except Exception as e:
+            # Counted towards draining the endpoint, so that the retry of the session is placed on another one
+            if self.endpoint is not None: self.endpoint.record_failure(e)
+            raise
 
         # This is required to start advancing the simulation only after Alfalfa is ready
         if self.debug: print(f"--> Complete!\n")
@@ -141,18 +161,79 @@ class CoSimCore:
         #self.output_step = self.retrieve_outputs()
         return self
 
+    def reattach_site(self, entry):
+        """
+        Reattach to the site recorded in the manifest for this alias (e.g., after the GUI or main script was restarted without exit),
+        if it is still running with the same configuration on the same host. Otherwise, the recorded site is stopped.
+        :return: True if reattached (the model is neither submitted nor warmed up again)
+        """
+        if entry is None or self.backend.in_process:
+            return False
+        status = None
+        if entry['config_hash'] == self.config_hash and entry['backend'] == self.backend_name and entry['host'] == self.alfalfa_url:
+            try:
+                if self.backend.get_site_id(self.alias) == entry['site_id']:
+                    status = str(self.backend.status(entry['site_id'])).lower()
+            except Exception as e:
+                if self.debug: print(f"[{self.alias}] Site {entry['site_id']} of the manifest not found: {e}")
+        if status not in STATUS_REATTACHABLE:
+            # Different configuration, or the site is not running anymore: replaced by a new site
+            stop_site(entry, debug=self.debug)
+            self.manifest.remove(self.alias)
+            return False
+
+        self.model_id = entry['site_id']
+        self.time_sim = self.backend.get_sim_time(self.model_id)
+        self.reattached = True
+        if self.debug: print(f"\n=Reattached to site_id: {self.model_id} with alias: {self.alias} at {self.time_sim} (status: {status})\n")
+        return True
+
+    def lease_site(self):
+        # Lease a warm site of the site pool (already submitted and started at time_start), and give it the alias of the session
+        if self.path_site_pool is None or self.backend.in_process:
+            return False
+        site = lease_warm_site(self.path_site_pool, self.config_hash, host=self.alfalfa_url)
+        if site is None:
+            if self.debug: print(f"[{self.alias}] No warm site available in the site pool")
+            return False
+        self.model_id = site['site_id']
+        self.backend.set_alias(self.model_id, self.alias)
+        if self.debug: print(f"\n=Leased warm site_id: {self.model_id} with alias: {self.alias} (status: {self.backend.status(self.model_id)})\n")
+        return True
+
+    def write_manifest(self):
+        if self.manifest is None or self.backend.in_process:
+            return
+        self.manifest.write(self.alias, self.backend_name, self.alfalfa_url, self.model_id, self.time_sim, self.config_hash)
+        self.time_manifest = time.monotonic()
 
-    def retrieve_outputs(self, control_information: dict = None, debug=False):
-        # Retrieve outputs from alfalfa_client
-        output_step = self.alfalfa_client.get_outputs(
-            self.model_id   # site_id
-        )
 
-        # Update simulation time
-        self.sim_time = self.alfalfa_client.get_sim_time(
-            self.model_id   # site_id
-        )
-        output_step[DATA.TIME_SIM] = self.sim_time
+    def retrieve_outputs(self, control_information: dict = None, debug=False):
+        # Retrieve outputs from the backend
+        try:
+            output_step = self.backend.get_outputs(self.model_id)
+
+            # Update simulation time
+            self.sim_time = self.backend.get_sim_time(self.model_id)
+        except Exception as e:
+            if self.endpoint is not None: self.endpoint.record_failure(e)
+            raise
+        output_step[DATA.TIME_SIM] = self.time_sim = self.sim_time
+        # Energy channels as the mean per step over the steps advanced since the last retrieve_outputs() (see update_record(steps=...)):
+        # differences of the cumulative meters if the building model reports them, otherwise sums of the steps read by read_energy_step()
+        energy_cumulative = {channel: float(output_step[key]) for channel, key in KPI_ENERGY_CUMULATIVE.items() if key in output_step}
+        if self.energy_advanced is not None:
+            for channel, energy in self.energy_advanced.items():
+                output_step[channel] = (energy + float(output_step[channel])) / self.steps_advanced
+        elif self.steps_advanced > 1 and self.energy_cumulative:
+            for channel, energy in energy_cumulative.items():
+                if channel in self.energy_cumulative:
+                    output_step[channel] = (energy - self.energy_cumulative[channel]) / self.steps_advanced
+        self.energy_cumulative = energy_cumulative
+        self.energy_advanced = None
+        self.steps_advanced = 1
+        if self.manifest is not None and time.monotonic() - self.time_manifest > MANIFEST_UPDATE_SECONDS:
+            self.write_manifest()
 
         #if debug: print("alfalfa_client.get_inputs:", self.alfalfa_client.get_inputs(self.model_id))
         #if debug: print("alfalfa_client.get_outputs:", self.alfalfa_client.get_outputs(self.model_id))
@@ -203,15 +284,7 @@ class CoSimCore:
         return output_step
 
 
-    def compute_control(self, time_sim, control_mode, setpoints_manual, schedule_info, output_step, debug=True):
-        """
-        y has any of the accessible model outputs such as the cooling power etc.
-        costs are the caclulated costs for the latest timestep, including PMV
-
-        :param y: Temperature of zone, K
-        :param heating_setpoint: Temperature Setpoint, C
-        :return: dict, control input to be used for the next step {<input_name> : <input_value>}
-        """
+    def get_zone_state(self, output_step):
         # retrieve zone_mean_temperature and zone_relative_humidity from the first conditioned zone (Note: Currently only consider single zone)
         zone_mean_temperature, zone_relative_humidity = None, None
         for key_output_step in output_step:
@@ -222,13 +295,68 @@ class CoSimCore:
                     zone_mean_temperature = output_step[key_output_step]
                 elif DATA.ZONE_RELATIVE_HUMIDITY in key_output_step:
                     zone_relative_humidity = output_step[key_output_step]
+        return zone_mean_temperature, zone_relative_humidity
+
+    def get_zone_temperatures(self, output_step):
+        # Zone mean temperature of every conditioned zone, in the order of conditioned_zones
+        return [output_step[zone_name + ' ' + DATA.ZONE_MEAN_TEMP] for zone_name in self.conditioned_zones]
 
+    def get_state(self, output_step):
         state = {DATA.HEATING_SETPOINT_BASE: output_step[DATA.HEATING_SETPOINT_BASE],
                  DATA.COOLING_SETPOINT_BASE: output_step[DATA.COOLING_SETPOINT_BASE],
                  # TODO: change the input here to humidity only
                  DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE: output_step[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE],
                  DATA.HEATING_COIL_RUNTIME_FRACTION: output_step[DATA.HEATING_COIL_RUNTIME_FRACTION],
                  DATA.COOLING_COIL_RUNTIME_FRACTION: output_step[DATA.COOLING_COIL_RUNTIME_FRACTION]}
+        return state
+
+    def apply_occupant_output(self, occupant_output, datetime_time_sim, control_information):
+        # Thermostat decision given the output of an occupant (overrides are passed to the thermostat, otherwise the thermostat follows its schedule)
+        control_input = {}
+        control_input['u'] = {}
+        
+        control_information[DATA.OCCUPANT_MOTION] = occupant_output['Motion']
+        control_information[DATA.OCCUPANT_THERMAL_FRUSTRATION] = occupant_output['Thermal Frustration']
+        control_information[DATA.OCCUPANT_COMFORT_DELTA] = occupant_output['Comfort Delta']
+        control_information[DATA.OCCUPANT_HABITUAL_OVERRIDE] = occupant_output['Habitual override']
+        control_information[DATA.OCCUPANT_DISCOMFORT_OVERRIDE] = occupant_output['Discomfort override']
+
+        if occupant_output['Habitual override'] or occupant_output['Discomfort override']:
+            tstat_mode, tstat_schedule, tstat_stp_cool, tstat_stp_heat = self.thermostat_model.manual_override(tstp_heat = occupant_output['T_stp_heat'], tstp_cool = occupant_output['T_stp_cool'])
+        else:
+            tstat_mode, tstat_schedule, tstat_stp_cool, tstat_stp_heat = self.thermostat_model.update_output(current_datetime=datetime_time_sim)
+        
+        # TODO: remove this statement once occupant model is updated to prevent setpoint issue.
+        if tstat_stp_cool < tstat_stp_heat:
+            input(f"Heating SP ({tstat_stp_heat}) is higher than cooling SP ({tstat_stp_cool})! --> Adjust Cooling SP")
+            tstat_stp_cool = tstat_stp_heat + 2                
+
+        control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = tstat_stp_heat
+        control_input['u'][CONTROL.COOLING_SETPOINT_TO_ALFALFA] = tstat_stp_cool
+
+        control_information[DATA.HEATING_SETPOINT_NEW] = tstat_stp_heat
+        control_information[DATA.COOLING_SETPOINT_NEW] = tstat_stp_cool
+        
+        control_information[DATA.THERMOSTAT_SCHEDULE] = tstat_schedule
+        control_information[DATA.THERMOSTAT_MODE] = tstat_mode
+        return control_input, control_information
+
+    def get_schedule_lookup(self, schedule_info):
+        if self.schedule_lookup[0] != schedule_info['contents']:
+            self.schedule_lookup = (schedule_info['contents'], read_schedule(schedule_info))
+        return self.schedule_lookup[1]
+
+    def compute_control(self, time_sim, control_mode, setpoints_manual, schedule_info, output_step, debug=True):
+        """
+        y has any of the accessible model outputs such as the cooling power etc.
+        costs are the caclulated costs for the latest timestep, including PMV
+
+        :param y: Temperature of zone, K
+        :param heating_setpoint: Temperature Setpoint, C
+        :return: dict, control input to be used for the next step {<input_name> : <input_value>}
+        """
+        zone_mean_temperature, zone_relative_humidity = self.get_zone_state(output_step)
+        state = self.get_state(output_step)
         
         datetime_time_sim = time_sim
         control_information = initialize_control_information()
@@ -263,92 +391,16 @@ class CoSimCore:
             control_input = {}
             control_input['u'] = {}
 
-            schedule_filename = schedule_info['filename']
-            schedule_contents = schedule_info['contents']
-            schedule_type, schedule_content_splitted = schedule_contents.split(',')
-            schedule_content_decoded = base64.b64decode(schedule_content_splitted)
             try:
-                # Assume that the user uploaded a CSV file
-                if 'csv' in schedule_filename:
-                    schedule_dataframe = pd.read_csv(io.StringIO(schedule_content_decoded.decode('utf-8')))
-                # Assume that the user uploaded an excel file
-                elif 'xls' in schedule_filename:
-                    schedule_dataframe = pd.read_excel(io.BytesIO(schedule_content_decoded))
+                schedule_lookup = self.get_schedule_lookup(schedule_info)
             except Exception as e:
                 print(e)
                 #return html.Div(['There was an error processing this file.'])
                 return 'There was an error processing this file.'
 
-            #datetime_time_sim = datetime.strptime(time_sim, '%Y-%m-%d %H:%M:%S')
-
-            index_exact_same = None
-            index_same_except_for_year = None
-            time_year = 1900
-            for index, row in schedule_dataframe.iterrows():
-                time_parsed = row['datetime'].split('  ')
-                time_month_day = time_parsed[0].split('/')
-                time_hour_minute_second = time_parsed[1].split(':')
-
-                time_hour = int(time_hour_minute_second[0])
-                time_month = int(time_month_day[0])
-                time_day = int(time_month_day[1])
-                time_minute = int(time_hour_minute_second[1])
-                # print("Y/M/D/H/M:", time_year, time_month, time_day, time_hour, time_minute)
-
-                # EP generate 24 O'clock, which is invalid time. It should be compensated to 0 O'clock of the next day
-                if time_hour == 24:
-                    time_hour = 0
-                    # print("--Y/M/D/H/M:", time_year, time_month, time_day, time_hour, time_minute)
-                    datetime_row = datetime(time_year, time_month, time_day, time_hour, time_minute)
-                    datetime_row += timedelta(days=1)
-                else:
-                    datetime_row = datetime(time_year, time_month, time_day, time_hour, time_minute)
-
-                if (datetime_row.month == datetime_time_sim.month) and \
-                   (datetime_row.day == datetime_time_sim.day) and \
-                   (datetime_row.hour == datetime_time_sim.hour) and \
-                   (datetime_row.minute == datetime_time_sim.minute):
-
-                    if (datetime_row.year == datetime_time_sim.year):
-                        index_exact_same = index
-                        break
-                    else:
-                        index_same_except_for_year = index
-
-            # If there is a time exactly the same, use it
-            if index_exact_same is not None:
-                setpoints_schedule = dict()
-                setpoints_schedule[DATA.HEATING_SETPOINT_NEW] = schedule_dataframe[DATA.HEATING_SETPOINT_NEW][index_exact_same]
-                setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_UP][index_exact_same]
-                setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_DOWN][index_exact_same]
-
-                setpoints_schedule[DATA.COOLING_SETPOINT_NEW] = schedule_dataframe[DATA.COOLING_SETPOINT_NEW][index_exact_same]
-                setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_UP][index_exact_same]
-                setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_DOWN][index_exact_same]
-                control_information = setpoints_schedule
-
-                control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = \
-                    apply_deadband(mode=CONTROL.HEATING,
-                                   zone_mean_temperature=zone_mean_temperature,
-                                   state=state,
-                                   setpoints=setpoints_schedule)
-
-                control_input['u'][CONTROL.COOLING_SETPOINT_TO_ALFALFA] = \
-                    apply_deadband(mode=CONTROL.COOLING,
-                                   zone_mean_temperature=zone_mean_temperature,
-                                   state=state,
-                                   setpoints=setpoints_schedule)
-
-            # If there is a time almost the same (except for year), use it
-            elif index_same_except_for_year is not None:
-                setpoints_schedule = dict()
-                setpoints_schedule[DATA.HEATING_SETPOINT_NEW] = schedule_dataframe[DATA.HEATING_SETPOINT_NEW][index_same_except_for_year]
-                setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_UP][index_same_except_for_year]
-                setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_DOWN][index_same_except_for_year]
-
-                setpoints_schedule[DATA.COOLING_SETPOINT_NEW] = schedule_dataframe[DATA.COOLING_SETPOINT_NEW][index_same_except_for_year]
-                setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_UP][index_same_except_for_year]
-                setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_DOWN][index_same_except_for_year]
+            # If there is a time exactly the same (or almost the same, except for year), use it
+            setpoints_schedule = get_schedule_setpoints(schedule_lookup, datetime_time_sim)
+            if setpoints_schedule is not None:
                 control_information = setpoints_schedule
 
                 control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = \
@@ -397,33 +449,9 @@ class CoSimCore:
                                                     'equip_run_cool': True if state[DATA.COOLING_COIL_RUNTIME_FRACTION] != 0 else False
                                                     })
             for occupant in self.o_occupant_model.schedule.agents:
-                control_input = {}
-                control_input['u'] = {}
-                
-                control_information[DATA.OCCUPANT_MOTION] = occupant.output['Motion']
-                control_information[DATA.OCCUPANT_THERMAL_FRUSTRATION] = occupant.output['Thermal Frustration']
-                control_information[DATA.OCCUPANT_COMFORT_DELTA] = occupant.output['Comfort Delta']
-                control_information[DATA.OCCUPANT_HABITUAL_OVERRIDE] = occupant.output['Habitual override']
-                control_information[DATA.OCCUPANT_DISCOMFORT_OVERRIDE] = occupant.output['Discomfort override']
-
-                if occupant.output['Habitual override'] or occupant.output['Discomfort override']:
-                    tstat_mode, tstat_schedule, tstat_stp_cool, tstat_stp_heat = self.thermostat_model.manual_override(tstp_heat = occupant.output['T_stp_heat'], tstp_cool = occupant.output['T_stp_cool'])
-                else:
-                    tstat_mode, tstat_schedule, tstat_stp_cool, tstat_stp_heat = self.thermostat_model.update_output(current_datetime=datetime_time_sim)
-                
-                # TODO: remove this statement once occupant model is updated to prevent setpoint issue.
-                if tstat_stp_cool < tstat_stp_heat:
-                    input(f"Heating SP ({tstat_stp_heat}) is higher than cooling SP ({tstat_stp_cool})! --> Adjust Cooling SP")
-                    tstat_stp_cool = tstat_stp_heat + 2                
-
-                control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = tstat_stp_heat
-                control_input['u'][CONTROL.COOLING_SETPOINT_TO_ALFALFA] = tstat_stp_cool
-
-                control_information[DATA.HEATING_SETPOINT_NEW] = tstat_stp_heat
-                control_information[DATA.COOLING_SETPOINT_NEW] = tstat_stp_cool
-                
-                control_information[DATA.THERMOSTAT_SCHEDULE] = tstat_schedule
-                control_information[DATA.THERMOSTAT_MODE] = tstat_mode
+                control_input, control_information = self.apply_occupant_output(occupant_output=occupant.output,
+                                                                                datetime_time_sim=datetime_time_sim,
+                                                                                control_information=control_information)
 
         else:
             raise ValueError("Control mode not implemented. Provided mode is:", control_mode)
@@ -440,12 +468,10 @@ class CoSimCore:
         # Currently pass-through the setpoints from the building model
         return control_input, control_information
 
-    def proceed_simulation(self, control_input, control_information: dict):
+    def proceed_simulation(self, control_input, control_information: dict, steps=1):
+        # steps: number of steps advanced with the same control input (see CoSimStepping.AdaptiveStepPolicy)
         #print("before set_input", self.alfalfa_client.status(self.model_id))
-        self.alfalfa_client.set_inputs(
-            self.model_id,      # site_id
-            control_input['u']  # inputs
-        )
+        self.backend.set_inputs(self.model_id, control_input['u'])
         ###### TODO: Here, we test what can be done to ensure that alfalfa_client is not inturrepted by background saving by REDIS #####
         """
         self.alfalfa_client.wait(
@@ -455,9 +481,18 @@ class CoSimCore:
         """
         ###############################################################################################################################
         #print("before advance", self.alfalfa_client.status(self.model_id))
-        self.alfalfa_client.advance(
-            [self.model_id]     # site_id
-        )
+        time_request = time.perf_counter()
+        # With several steps, only the outputs of the last step are retrieved
+        self.start_energy_steps(steps)
+        try:
+            for index_step in range(int(steps)):
+                self.backend.advance([self.model_id])
+                if index_step + 1 < int(steps):
+                    self.read_energy_step()
+        except Exception as e:
+            if self.endpoint is not None: self.endpoint.record_failure(e)
+            raise
+        if self.endpoint is not None: self.endpoint.record_latency((time.perf_counter() - time_request) / max(int(steps), 1))
         #print("before retrieve_outputs", self.alfalfa_client.status(self.model_id))
         #self.output_step = self.retrieve_outputs()
 
@@ -465,3 +500,94 @@ class CoSimCore:
             #self.output_step[key] = control_information[key]
             #self.output_step[key] = control_information[key]
         return #self.output_step
+
+    def start_energy_steps(self, steps):
+        # Energy of the next `steps` steps, of which only the last one is retrieved: the others are read by read_energy_step(),
+        # unless the building model reports cumulative meters (differenced by retrieve_outputs(), without reading the steps in between)
+        self.steps_advanced = max(int(steps), 1)
+        self.energy_advanced = dict() if self.steps_advanced > 1 and not self.energy_cumulative else None
+
+    def read_energy_step(self):
+        # Energy of a step advanced but not retrieved, added to the mean per step of the next retrieve_outputs()
+        if self.energy_advanced is None:
+            return
+        output_step = self.backend.get_outputs(self.model_id)
+        for channel in KPI_ENERGY_CHANNELS:
+            if channel in output_step:
+                self.energy_advanced[channel] = self.energy_advanced.get(channel, 0.0) + float(output_step[channel])
+
+    def open_loop_trajectory(self, control_mode, schedule_info=None):
+        """
+        Input trajectory of a control mode which does not depend on the state of the building, to be used by fast_forward().
+        :return: function of the simulation time returning (control_input, control_information), as compute_control()
+        """
+        if control_mode == CONTROL.PASSTHROUGH:
+            return lambda time_sim: ({'u': {}}, None)
+
+        elif control_mode == CONTROL.SCHEDULE:
+            schedule_lookup = self.get_schedule_lookup(schedule_info)
+            schedule_dataframe = schedule_lookup['dataframe']
+            # With deadbands, the setpoints depend on the zone temperature (closed-loop only)
+            for key in [DATA.HEATING_SETPOINT_DEADBAND_UP, DATA.HEATING_SETPOINT_DEADBAND_DOWN,
+                        DATA.COOLING_SETPOINT_DEADBAND_UP, DATA.COOLING_SETPOINT_DEADBAND_DOWN]:
+                if (schedule_dataframe[key].astype(float) != 0).any():
+                    raise ValueError("Schedule with deadband depends on the zone temperature and cannot be fast-forwarded")
+
+            def trajectory(time_sim):
+                setpoints_schedule = get_schedule_setpoints(schedule_lookup, time_sim)
+                if setpoints_schedule is None:
+                    return {'u': {}}, None
+                control_input = {'u': {CONTROL.HEATING_SETPOINT_TO_ALFALFA: float(setpoints_schedule[DATA.HEATING_SETPOINT_NEW]),
+                                       CONTROL.COOLING_SETPOINT_TO_ALFALFA: float(setpoints_schedule[DATA.COOLING_SETPOINT_NEW])}}
+                return control_input, setpoints_schedule
+            return trajectory
+
+        else:
+            raise ValueError("Control mode depends on the state of the building and cannot be fast-forwarded:", control_mode)
+
+    def fast_forward(self, steps, input_trajectory, output_interval=0, read_energy=True):
+        """
+        Open-loop stepping: the inputs are taken from a precomputed trajectory instead of compute_control(), they are only sent
+        to Alfalfa when they change, and the outputs are only retrieved every output_interval steps (and after the last step).
+        The session can switch back to closed-loop stepping (compute_control/proceed_simulation) right after this call.
+        Note: Alfalfa (0.5) neither accepts future inputs nor switches to its internal clock without restarting the model,
+        so the model keeps running with the external clock and only the control/output round trips are skipped.
+
+        :param steps: number of steps to fast-forward
+        :param input_trajectory: function of the simulation time returning (control_input, control_information), e.g., open_loop_trajectory()
+        :param output_interval: retrieve outputs every output_interval steps (0: only after the last step)
+        :param read_energy: if True, the energy of the steps which are not retrieved is read, so that the energy channels of each output_step
+                            are the mean per step since the previous one (False, e.g., for a warm-up which is not recorded)
+        :return: list of output_step retrieved
+        """
+        list_output_step = []
+        time_sim = self.backend.get_sim_time(self.model_id)
+        inputs_previous = None
+        control_information = None
+        steps_output = int(output_interval) if output_interval else int(steps)
+        for index_step in range(int(steps)):
+            if index_step % steps_output == 0:
+                # Steps until the next output retrieved (fewer for the last one)
+                self.start_energy_steps(min(steps_output, int(steps) - index_step) if read_energy else 1)
+            control_input, control_information = input_trajectory(time_sim)
+            # Inputs are only sent when they change, if the backend keeps them until changed
+            if control_input['u'] != inputs_previous or not self.backend.supports_fast_forward:
+                self.backend.set_inputs(self.model_id, control_input['u'])
+                inputs_previous = control_input['u']
+            self.backend.advance([self.model_id])
+            time_sim += timedelta(minutes=self.time_step_size)
+
+            if (index_step + 1) % steps_output == 0 or index_step + 1 == int(steps):
+                output_step = self.retrieve_outputs(control_information=control_information)
+                time_sim = output_step[DATA.TIME_SIM]
+                list_output_step.append(output_step)
+            else:
+                self.read_energy_step()
+        if self.debug: print(f"[{self.alias}] Fast-forwarded {int(steps)} steps to {time_sim} ({len(list_output_step)} outputs retrieved)")
+        return list_output_step
+
+    def tear_down(self):
+        self.backend.stop(self.model_id)
+        if self.manifest is not None: self.manifest.remove(self.alias)
+        if self.endpoint is not None: self.endpoint.release()
+        return
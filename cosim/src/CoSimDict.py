@@ -6,6 +6,12 @@ class SETTING():
     PATH_BUILDING_MODEL = 'path_building_model'
     CONDITIONED_ZONES = 'conditioned_zones'
     UNCONDITIONED_ZONES = 'unconditioned_zones'
+    BACKEND = 'backend'                               # Optional: simulation backend among CoSimBackend.BACKENDS ('alfalfa' by default)
+    PATH_SURROGATE_MODEL = 'path_surrogate_model'     # Optional: saved surrogate model (see CoSimSurrogate.py), for the 'surrogate' backend
+    PATH_TRACE = 'path_trace'                         # Optional: results file played back by the 'trace' backend
+    ENDPOINT_POOL = 'endpoint_pool'                   # Optional: pool of Alfalfa deployments (see CoSimEndpoints.py), used instead of ALFALFA_URL
+    PATH_SESSION_MANIFEST = 'path_session_manifest'   # Optional: folder of the session manifest (see CoSimManifest.py), to reattach to running sites after a restart
+    PATH_SITE_POOL = 'path_site_pool'                 # Optional: folder of a pool of warm sites (see CoSimSitePool.py), leased instead of submitting the model
 
     # Simulation information
     SIMULATION_INFORMATION = 'simulation_information'
@@ -100,6 +106,11 @@ class DATA:
     FAN_ELECTRICITY_ENERGY = 'Fan Electricity Energy'
     HEATING_COIL_FUEL_ENERGY = 'Heating Coil FuelOilNo2 Energy'
     HEATING_COIL_ELECTRICITY_ENERGY = 'Heating Coil Electricity Energy'
+    # Optional outputs of the building model: meters of the energy channels accumulated since the start (e.g., 'Fan Electricity Energy (Cumulative)')
+    ENERGY_CUMULATIVE = '(Cumulative)'
+
+    ## Events: change events of the slowly changing channels (see CoSimEvents.py)
+    EVENTS = 'events'
 
 
 class CONTROL():
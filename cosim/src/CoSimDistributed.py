@@ -0,0 +1,421 @@
+'''
+CoSimDistributed.py
+
+Distributed batch runner: a coordinator publishes session jobs to a queue, and stateless workers on any number of nodes
+claim them, heartbeat while running, and upload their results.
+A job whose lease expires (e.g., the node of its worker died) is claimed again by another worker.
+
+Usage:
+    Coordinator: set `distributed_queue_url` in CoSimMain.py (e.g., 'sqlite:////shared/cosim_jobs.sqlite')
+    Worker:      python CoSimDistributed.py worker --queue sqlite:////shared/cosim_jobs.sqlite --dir-results /shared/output
+    Status:      python CoSimDistributed.py status --queue sqlite:////shared/cosim_jobs.sqlite
+'''
+import argparse
+import logging
+import os
+import pickle
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from CoSimDict import SETTING
+from CoSimKPI import get_kpi_path, read_kpi_summary
+from CoSimMonitor import STATE_RUNNING, STATE_DONE, STATE_FAILED
+from CoSimLogging import LOGGER_ROOT, JsonLinesFormatter, get_session_logger
+
+# States of a job
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Interface of the job queue shared by the coordinator and the workers.
+    Specs and results are pickled, so that a queue can be backed by a file, a database or a broker.
+    """
+    def publish(self, job_id, spec):
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds, max_attempts):
+        # Returns (job_id, spec) of a pending job or of a running job with an expired lease, or None
+        # (a running job whose lease expired after max_attempts attempts is failed instead)
+        raise NotImplementedError
+
+    def heartbeat(self, job_id, worker_id, lease_seconds, progress=None):
+        # Returns False if the job is not leased to this worker anymore (e.g., the lease expired and the job was reassigned)
+        raise NotImplementedError
+
+    def complete(self, job_id, worker_id, result):
+        # Returns False if the job is not running on this worker anymore (e.g., its lease expired)
+        raise NotImplementedError
+
+    def fail(self, job_id, worker_id, error, max_attempts):
+        # Returns False if the job is not running on this worker anymore (e.g., its lease expired)
+        raise NotImplementedError
+
+    def jobs(self):
+        # Returns the status of every job (without specs and results)
+        raise NotImplementedError
+
+    def results(self):
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Job queue backed by a SQLite file, e.g., on a volume shared by the nodes.
+    Claims are done in an immediate transaction, so that a job is leased to a single worker.
+    """
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                               'job_id TEXT PRIMARY KEY, spec BLOB, state TEXT, worker_id TEXT, lease_expires REAL, '
+                               'attempts INTEGER DEFAULT 0, progress BLOB, result BLOB, error TEXT, time_created REAL, time_updated REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)')
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def publish(self, job_id, spec):
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO jobs (job_id, spec, state, attempts, time_created, time_updated) VALUES (?, ?, ?, 0, ?, ?)',
+                               (job_id, pickle.dumps(spec), JOB_PENDING, time.time(), time.time()))
+
+    def claim(self, worker_id, lease_seconds, max_attempts):
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            # Jobs whose workers died at every attempt (e.g., a session crashing its node) are not claimed again
+            connection.execute('UPDATE jobs SET state = ?, error = ?, time_updated = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+                               (JOB_FAILED, f'Lease expired ({max_attempts} attempts)', now, JOB_RUNNING, now, max_attempts))
+            row = connection.execute('SELECT job_id, spec FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ? AND attempts < ?) ORDER BY time_created LIMIT 1',
+                                     (JOB_PENDING, JOB_RUNNING, now, max_attempts)).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            connection.execute('UPDATE jobs SET state = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1, time_updated = ? WHERE job_id = ?',
+                               (JOB_RUNNING, worker_id, now + lease_seconds, now, row[0]))
+            connection.execute('COMMIT')
+            return row[0], pickle.loads(row[1])
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def heartbeat(self, job_id, worker_id, lease_seconds, progress=None):
+        with self.connect() as connection:
+            cursor = connection.execute('UPDATE jobs SET lease_expires = ?, progress = ?, time_updated = ? WHERE job_id = ? AND worker_id = ? AND state = ?',
+                                        (time.time() + lease_seconds, pickle.dumps(progress), time.time(), job_id, worker_id, JOB_RUNNING))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        # Only a running job is completed: a job failed after its lease expired (see claim()) stays failed
+        with self.connect() as connection:
+            cursor = connection.execute('UPDATE jobs SET state = ?, result = ?, time_updated = ? WHERE job_id = ? AND worker_id = ? AND state = ?',
+                                        (JOB_DONE, pickle.dumps(result), time.time(), job_id, worker_id, JOB_RUNNING))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error, max_attempts):
+        # The job is published again, unless it already failed max_attempts times
+        with self.connect() as connection:
+            cursor = connection.execute('UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, time_updated = ? '
+                                        'WHERE job_id = ? AND worker_id = ? AND state = ?',
+                                        (max_attempts, JOB_FAILED, JOB_PENDING, error, time.time(), job_id, worker_id, JOB_RUNNING))
+            return cursor.rowcount == 1
+
+    def jobs(self):
+        with self.connect() as connection:
+            rows = connection.execute('SELECT job_id, state, worker_id, lease_expires, attempts, progress, error, time_updated FROM jobs ORDER BY time_created').fetchall()
+        return [{'job_id': job_id, 'state': state, 'worker_id': worker_id, 'lease_expires': lease_expires, 'attempts': attempts,
+                 'progress': pickle.loads(progress) if progress is not None else None, 'error': error, 'time_updated': time_updated}
+                for job_id, state, worker_id, lease_expires, attempts, progress, error, time_updated in rows]
+
+    def results(self):
+        with self.connect() as connection:
+            rows = connection.execute('SELECT job_id, result FROM jobs WHERE state = ?', (JOB_DONE,)).fetchall()
+        return {job_id: pickle.loads(result) for job_id, result in rows}
+
+
+# Queue implementations by URL scheme (e.g., a broker-backed queue can be added with register_job_queue())
+JOB_QUEUES = {'sqlite': SQLiteJobQueue}
+
+
+def register_job_queue(scheme, job_queue_class):
+    JOB_QUEUES[scheme] = job_queue_class
+    return job_queue_class
+
+
+def get_job_queue(queue_url):
+    # e.g., 'sqlite:////shared/cosim_jobs.sqlite' (absolute path) or 'sqlite:///cosim_jobs.sqlite' (relative path)
+    scheme, location = queue_url.split('://', 1)
+    if scheme not in JOB_QUEUES:
+        raise ValueError("Not valid job queue:", queue_url, "(available schemes:", list(JOB_QUEUES), ")")
+    return JOB_QUEUES[scheme](location[1:] if location.startswith('/') else location)
+
+
+def create_job_spec(alias, input_each, steps, control_mode, setpoints_manual=None, schedule_info=None, steps_warm_up=0,
+                    fast_forward_output_interval=None, max_steps_per_decision=None, fingerprint=None,
+                    result_codec='zstd', result_row_group_size=131072, result_float32_sensors=False, record_events=False,
+                    progress_every_steps=1440, progress_every_seconds=60.0, profile_step_start=None, profile_steps=1440,
+                    profile_interval_seconds=0.005):
+    # Everything needed to run a session on any node (input_each has the same format as the inputs of CoSimMain.py)
+    # The settings of the run are those of CoSimSession.run_session_steps(), and the results are named by `fingerprint` (see CoSimCache.py)
+    return {'alias': alias,
+            'input_each': input_each,
+            'steps': int(steps),
+            'control_mode': control_mode,
+            'setpoints_manual': setpoints_manual,
+            'schedule_info': schedule_info,
+            'steps_warm_up': steps_warm_up,
+            'fast_forward_output_interval': fast_forward_output_interval,
+            'max_steps_per_decision': max_steps_per_decision,
+            'fingerprint': fingerprint,
+            'result_codec': result_codec,
+            'result_row_group_size': result_row_group_size,
+            'result_float32_sensors': result_float32_sensors,
+            'record_events': record_events,
+            'progress_every_steps': progress_every_steps,
+            'progress_every_seconds': progress_every_seconds,
+            'profile_step_start': profile_step_start,
+            'profile_steps': profile_steps,
+            'profile_interval_seconds': profile_interval_seconds}
+
+
+class Coordinator:
+    """
+    Publishes session jobs and waits for their completion, logging the progress of the workers.
+    """
+    def __init__(self, job_queue: JobQueue, logger=None):
+        self.job_queue = job_queue
+        self.logger = logger if logger is not None else get_session_logger('coordinator')
+
+    def publish(self, list_spec):
+        list_job_id = []
+        for spec in list_spec:
+            job_id = spec['alias'].replace(': ', '_') + '_' + str(uuid.uuid4())[:8]
+            self.job_queue.publish(job_id, spec)
+            list_job_id.append(job_id)
+        self.logger.info(f'{len(list_job_id)} jobs published')
+        return list_job_id
+
+    def wait(self, list_job_id, poll_seconds=30.0, reporters=None):
+        # Returns {job_id: result} once every job is done or failed
+        # reporters: {job_id: MonitorReporter}, updated with the progress sent by the workers (see CoSimMonitor.py)
+        reporters = reporters if reporters is not None else dict()
+        while True:
+            jobs = [job for job in self.job_queue.jobs() if job['job_id'] in list_job_id]
+            for job in jobs:
+                if job['job_id'] in reporters:
+                    self.update_reporter(reporters[job['job_id']], job)
+            count = {state: sum(job['state'] == state for job in jobs) for state in [JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED]}
+            self.logger.info(f'Jobs: {count[JOB_DONE]} done, {count[JOB_RUNNING]} running, {count[JOB_PENDING]} pending, {count[JOB_FAILED]} failed',
+                             extra={'jobs': count})
+            if count[JOB_DONE] + count[JOB_FAILED] == len(list_job_id):
+                for job in jobs:
+                    if job['state'] == JOB_FAILED:
+                        self.logger.error(f"Job {job['job_id']} failed after {job['attempts']} attempts: {job['error']}")
+                results = self.job_queue.results()
+                return {job_id: results[job_id] for job_id in list_job_id if job_id in results}
+            time.sleep(poll_seconds)
+
+    @staticmethod
+    def update_reporter(reporter, job):
+        if job['state'] == JOB_RUNNING:
+            if reporter.status['state'] != STATE_RUNNING:
+                reporter.set_state(STATE_RUNNING)
+            if job['progress'] is not None:
+                if job['progress'].get('usage') is not None:
+                    reporter.record_resources(job['progress']['usage'])
+                reporter.update(job['progress']['steps_done'], job['progress']['time_sim'])
+        elif job['state'] == JOB_DONE and reporter.status['state'] != STATE_DONE:
+            reporter.record_done()
+        elif job['state'] == JOB_FAILED and reporter.status['state'] != STATE_FAILED:
+            reporter.record_failure(job['error'])
+
+
+class LeaseKeeper:
+    # Heartbeat thread of the job being run: the lease is extended every heartbeat_seconds, with the latest progress
+    # The keeper is the reporter of the session (see CoSimSession.run_session_steps()): update() stops the session once the job is reassigned
+    def __init__(self, job_queue, job_id, worker_id, lease_seconds, heartbeat_seconds):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.progress = None
+        self.state = None
+        self.usage = None
+        self.lost = False
+        self.event_stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.event_stop.wait(self.heartbeat_seconds):
+            if not self.job_queue.heartbeat(self.job_id, self.worker_id, self.lease_seconds, self.progress):
+                # The job was reassigned: the result of this worker will be discarded
+                self.lost = True
+
+    def set_state(self, state):
+        self.state = state
+
+    def record_resources(self, usage):
+        # Resource usage of the worker (see CoSimGovernor.SessionGovernor), sent with the progress
+        self.usage = usage
+
+    def update(self, steps_done, time_sim=None, kpi=None):
+        if self.lost:
+            raise RuntimeError('Lease of the job lost (reassigned to another worker)')
+        self.progress = {'steps_done': steps_done, 'time_sim': str(time_sim), 'state': self.state, 'usage': self.usage}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.event_stop.set()
+        self.thread.join()
+
+
+def run_session_job(spec, dir_output, lease_keeper=None, logger=None):
+    """
+    Run the session of a job spec and write its results file in dir_output, with the summary of its KPIs next to it (see CoSimKPI.py).
+    The steps and the results are those of a local run (see CoSimSession.py).
+    :return: path of the results file
+    """
+    # Imported here, so that the coordinator does not need the building and occupant models
+    from CoSimCore import CoSimCore
+    from CoSimGovernor import SessionGovernor
+    from CoSimProfiler import SessionProfiler
+    from CoSimSession import run_session_steps, export_session_record
+
+    input_each = spec['input_each']
+    logger = logger if logger is not None else get_session_logger(spec['alias'])
+    # Usage of the worker, sent with the progress of the job (no budget: the worker has the resources of its node)
+    session_governor = SessionGovernor(None, spec['alias'], [lease_keeper] if lease_keeper is not None else [], logger=logger).start()
+    try:
+        cosim_session = CoSimCore(alias=spec['alias'],
+                                  building_model_information=input_each[SETTING.BUILDING_MODEL_INFORMATION],
+                                  simulation_information=input_each[SETTING.SIMULATION_INFORMATION],
+                                  occupant_model_information=input_each[SETTING.OCCUPANT_MODEL_INFORMATION],
+                                  thermostat_model_information=input_each[SETTING.THERMOSTAT_MODEL_INFORMATION],
+                                  test_default_model=False,
+                                  debug=False)
+        logger.info(f'Initializing cosim-session (pid: {os.getpid()})', extra={'pid': os.getpid()})
+        cosim_session.initialize()
+        try:
+            session_profiler = SessionProfiler(alias=cosim_session.alias,
+                                               dir_output=dir_output,
+                                               step_start=spec.get('profile_step_start'),
+                                               steps_window=spec.get('profile_steps', 1440),
+                                               interval_seconds=spec.get('profile_interval_seconds', 0.005),
+                                               logger=logger)
+            record_each, kpi = run_session_steps(cosim_session, spec['steps'],
+                                                 control_mode=spec['control_mode'],
+                                                 setpoints_manual=spec['setpoints_manual'],
+                                                 schedule_info=spec['schedule_info'],
+                                                 steps_warm_up=spec['steps_warm_up'],
+                                                 fast_forward_output_interval=spec.get('fast_forward_output_interval'),
+                                                 max_steps_per_decision=spec.get('max_steps_per_decision'),
+                                                 record_events=spec.get('record_events', False),
+                                                 reporter=lease_keeper,
+                                                 logger=logger,
+                                                 progress_every_steps=spec.get('progress_every_steps', 1440),
+                                                 progress_every_seconds=spec.get('progress_every_seconds', 60.0),
+                                                 session_profiler=session_profiler,
+                                                 session_governor=session_governor)
+            path_results = export_session_record(cosim_session, record_each, dir_output, logger, kpi=kpi,
+                                                 fingerprint=spec.get('fingerprint'),
+                                                 resample=spec.get('max_steps_per_decision') is not None,
+                                                 codec=spec['result_codec'],
+                                                 row_group_size=spec['result_row_group_size'],
+                                                 float32_sensors=spec['result_float32_sensors'])
+        finally:
+            cosim_session.tear_down()
+    finally:
+        session_governor.stop()
+    return path_results
+
+
+def run_worker(queue_url, dir_results, dir_output=None, worker_id=None, lease_seconds=300.0, heartbeat_seconds=60.0,
+               poll_seconds=10.0, max_attempts=3, exit_when_idle=False):
+    """
+    Stateless worker: claims jobs until the queue is empty (if exit_when_idle) or forever.
+    Results are written to dir_output (local) and uploaded to dir_results (shared by the coordinator), unless both are the same.
+    """
+    job_queue = get_job_queue(queue_url)
+    worker_id = worker_id if worker_id is not None else socket.gethostname() + ':' + str(os.getpid())
+    dir_output = dir_output if dir_output is not None else dir_results
+    logger = get_session_logger('worker ' + worker_id)
+    while True:
+        job = job_queue.claim(worker_id, lease_seconds, max_attempts)
+        if job is None:
+            if exit_when_idle:
+                logger.info('No job left, exiting')
+                return
+            time.sleep(poll_seconds)
+            continue
+
+        job_id, spec = job
+        logger.info(f'Job claimed: {job_id}')
+        try:
+            with LeaseKeeper(job_queue, job_id, worker_id, lease_seconds, heartbeat_seconds) as lease_keeper:
+                path_results = run_session_job(spec, dir_output, lease_keeper=lease_keeper)
+            if os.path.abspath(dir_output) != os.path.abspath(dir_results):
+                shutil.move(get_kpi_path(path_results), os.path.join(dir_results, os.path.basename(get_kpi_path(path_results))))
+                path_results = shutil.move(path_results, os.path.join(dir_results, os.path.basename(path_results)))
+            if job_queue.complete(job_id, worker_id, {'path_results': path_results, 'worker_id': worker_id,
+                                                      'kpi': read_kpi_summary(path_results)['total']}):
+                logger.info(f'Job done: {job_id}')
+            else:
+                logger.warning(f'Job done, but not leased to this worker anymore: {job_id} (result discarded)')
+        except Exception as e:
+            logger.exception(f'Job failed: {job_id}')
+            job_queue.fail(job_id, worker_id, repr(e), max_attempts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distributed batch runner of CoSimAlfalfa')
+    parser.add_argument('command', choices=['worker', 'status'])
+    parser.add_argument('--queue', required=True, help="URL of the job queue, e.g., 'sqlite:////shared/cosim_jobs.sqlite'")
+    parser.add_argument('--dir-results', default='.', help='folder of the results shared with the coordinator')
+    parser.add_argument('--dir-output', default=None, help='local folder of the results before upload (default: --dir-results)')
+    parser.add_argument('--lease-seconds', type=float, default=300.0)
+    parser.add_argument('--heartbeat-seconds', type=float, default=60.0)
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--exit-when-idle', action='store_true')
+    parser.add_argument('--log-file', default=None, help='log file of the worker (JSON lines), in addition to the console')
+    args = parser.parse_args()
+
+    logger_root = logging.getLogger(LOGGER_ROOT)
+    logger_root.setLevel(logging.INFO)
+    handler_console = logging.StreamHandler(sys.stdout)
+    handler_console.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(session)s: %(message)s', defaults={'session': '-'}))
+    logger_root.addHandler(handler_console)
+    if args.log_file is not None:
+        handler_file = logging.FileHandler(args.log_file, mode='a')
+        handler_file.setFormatter(JsonLinesFormatter())
+        logger_root.addHandler(handler_file)
+    if args.command == 'worker':
+        run_worker(queue_url=args.queue,
+                   dir_results=args.dir_results,
+                   dir_output=args.dir_output,
+                   lease_seconds=args.lease_seconds,
+                   heartbeat_seconds=args.heartbeat_seconds,
+                   max_attempts=args.max_attempts,
+                   exit_when_idle=args.exit_when_idle)
+    else:
+        print(pd.DataFrame(get_job_queue(args.queue).jobs()).to_string())
@@ -0,0 +1,196 @@
+import bisect
+import hashlib
+import multiprocessing
+import threading
+import time
+
+import requests
+
+# Placement policies of the sessions
+POLICY_LEAST_LOADED = 'least_loaded'          # endpoint with the fewest active sessions (then the lowest latency)
+POLICY_CONSISTENT_HASH = 'consistent_hash'    # endpoint given by the alias on a hash ring (the same alias stays on the same endpoint)
+
+
+def hash_key(key):
+    return int(hashlib.sha1(key.encode()).hexdigest()[:16], 16)
+
+
+class EndpointLease:
+    """
+    Session placed on an endpoint of an EndpointPool (see EndpointPool.acquire()).
+    Request latencies are averaged locally and pushed to the shared state every `every_seconds`,
+    so that record_latency() can be called at every step without a round trip to the pool.
+    """
+    def __init__(self, pool, url, alias, every_seconds=10.0):
+        self.pool = pool
+        self.url = url
+        self.alias = alias
+        self.every_seconds = every_seconds
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.time_pushed = time.monotonic()
+        self.released = False
+
+    def record_latency(self, seconds):
+        self.latency_sum += seconds
+        self.latency_count += 1
+        if time.monotonic() - self.time_pushed >= self.every_seconds:
+            self.push()
+
+    def push(self):
+        if self.latency_count:
+            self.pool.update_endpoint(self.url, latency=self.latency_sum / self.latency_count)
+        self.latency_sum, self.latency_count = 0.0, 0
+        self.time_pushed = time.monotonic()
+
+    def record_failure(self, error=None):
+        # The session is lost (it is restarted on a new lease, see CoSimMain.run_with_retries())
+        self.pool.update_endpoint(self.url, failure=repr(error))
+        self.release()
+
+    def release(self):
+        if self.released:
+            return
+        self.push()
+        self.pool.update_endpoint(self.url, active=-1)
+        self.released = True
+
+
+class EndpointPool:
+    """
+    Pool of Alfalfa deployments shared by the sessions of a batch run.
+    The state of the endpoints (active sessions, latency EWMA, consecutive failures, drained flag) is kept in a
+    multiprocessing.Manager().dict(), so that the pool can be sent to joblib workers with the building model information
+    (SETTING.ENDPOINT_POOL). It is created and probed by an EndpointMonitor in the orchestrator.
+    An endpoint is drained after `drain_failures` consecutive failures (of sessions or probes), and no new session is placed on it
+    until a probe succeeds after `drain_seconds`.
+    """
+    def __init__(self, endpoints, lock, policy=POLICY_LEAST_LOADED, drain_failures=3, drain_seconds=300.0, ewma_alpha=0.2,
+                 virtual_nodes=64):
+        self.endpoints = endpoints  # url --> state, shared by the processes
+        self.lock = lock
+        self.policy = policy
+        self.drain_failures = drain_failures
+        self.drain_seconds = drain_seconds
+        self.ewma_alpha = ewma_alpha
+        # Hash ring of the consistent hash policy: each endpoint has `virtual_nodes` points, so that sessions are spread evenly
+        self.ring = sorted((hash_key(url + '#' + str(index)), url) for url in sorted(endpoints.keys()) for index in range(virtual_nodes))
+        self.ring_keys = [key for key, _ in self.ring]
+
+    @staticmethod
+    def create_state():
+        return {'active': 0, 'placed': 0, 'latency_ewma': None, 'failures': 0, 'failures_total': 0,
+                'drained': False, 'time_drained': None, 'last_error': None}
+
+    def is_available(self, state):
+        return not state['drained']
+
+    def select(self, alias, endpoints):
+        available = [url for url, state in endpoints.items() if self.is_available(state)]
+        if not available:
+            raise RuntimeError("No available Alfalfa endpoint (every endpoint is drained):", list(endpoints.keys()))
+        if self.policy == POLICY_CONSISTENT_HASH:
+            # First available endpoint clockwise from the hash of the alias
+            index_start = bisect.bisect(self.ring_keys, hash_key(alias))
+            for index in range(len(self.ring)):
+                url = self.ring[(index_start + index) % len(self.ring)][1]
+                if url in available:
+                    return url
+        elif self.policy == POLICY_LEAST_LOADED:
+            return min(available, key=lambda url: (endpoints[url]['active'],
+                                                   endpoints[url]['latency_ewma'] if endpoints[url]['latency_ewma'] is not None else 0.0))
+        raise ValueError("Not valid policy:", self.policy, "(available policies:", [POLICY_LEAST_LOADED, POLICY_CONSISTENT_HASH], ")")
+
+    def acquire(self, alias, every_seconds=10.0, url_preferred=None):
+        # Place a session on an endpoint (url_preferred: e.g., endpoint of a site to reattach to, used if available)
+        with self.lock:
+            endpoints = dict(self.endpoints)
+            if url_preferred in endpoints and self.is_available(endpoints[url_preferred]):
+                url = url_preferred
+            else:
+                url = self.select(alias, endpoints)
+            state = endpoints[url]
+            state['active'] += 1
+            state['placed'] += 1
+            self.endpoints[url] = state
+        return EndpointLease(self, url, alias, every_seconds=every_seconds)
+
+    def update_endpoint(self, url, active=0, latency=None, failure=None, success=False):
+        # failure: error of a session or a probe (counted towards draining) / success: successful probe
+        with self.lock:
+            state = self.endpoints[url]
+            state['active'] = max(state['active'] + active, 0)
+            if latency is not None:
+                state['latency_ewma'] = latency if state['latency_ewma'] is None else \
+                                        self.ewma_alpha * latency + (1 - self.ewma_alpha) * state['latency_ewma']
+            if failure is not None:
+                state['failures'] += 1
+                state['failures_total'] += 1
+                state['last_error'] = failure
+                if state['failures'] >= self.drain_failures and not state['drained']:
+                    state['drained'] = True
+                    state['time_drained'] = time.time()
+            if success:
+                state['failures'] = 0
+                # A drained endpoint is restored by the first successful probe after `drain_seconds`
+                if state['drained'] and time.time() - state['time_drained'] >= self.drain_seconds:
+                    state['drained'] = False
+                    state['time_drained'] = None
+            self.endpoints[url] = state
+        return state
+
+    def snapshot(self):
+        return {url: dict(state) for url, state in self.endpoints.items()}
+
+
+class EndpointMonitor:
+    """
+    Owner of an EndpointPool in the orchestrator: creates the shared state and probes every endpoint every `probe_seconds`
+    (HTTP GET of the endpoint URL, timed into the latency EWMA).
+    """
+    def __init__(self, urls, policy=POLICY_LEAST_LOADED, probe_seconds=30.0, probe_timeout=2.0, drain_failures=3,
+                 drain_seconds=300.0, ewma_alpha=0.2, debug=False):
+        self.urls = list(urls)
+        self.probe_seconds = probe_seconds
+        self.probe_timeout = probe_timeout
+        self.debug = debug
+        self.manager = multiprocessing.Manager()
+        self.pool = EndpointPool(self.manager.dict({url: EndpointPool.create_state() for url in self.urls}),
+                                 self.manager.Lock(),
+                                 policy=policy,
+                                 drain_failures=drain_failures,
+                                 drain_seconds=drain_seconds,
+                                 ewma_alpha=ewma_alpha)
+        self.thread = None
+        self.event_stop = threading.Event()
+
+    def probe(self, url):
+        time_request = time.perf_counter()
+        try:
+            requests.get(url, timeout=self.probe_timeout).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            state = self.pool.update_endpoint(url, failure=repr(e))
+            if self.debug: print(f"Probe of {url} FAILED ({state['failures']} consecutive failures, drained: {state['drained']}): {e}")
+            return False
+        self.pool.update_endpoint(url, latency=time.perf_counter() - time_request, success=True)
+        return True
+
+    def probe_all(self):
+        return {url: self.probe(url) for url in self.urls}
+
+    def run(self):
+        while not self.event_stop.wait(self.probe_seconds):
+            self.probe_all()
+
+    def start(self):
+        self.probe_all()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.event_stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.manager.shutdown()
+        return
@@ -0,0 +1,158 @@
+import functools
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from CoSimDict import DATA, CONTROL
+from CoSimGroup import CoSimGroup
+from CoSimKPI import KPI_ENERGY_CHANNELS, JOULES_PER_KWH
+
+# Observation points: keys of the output steps ('{zone}' is replaced by the first conditioned zone of each session)
+OBSERVATION_POINTS_DEFAULT = ['{zone} ' + DATA.ZONE_MEAN_TEMP,
+                              '{zone} ' + DATA.ZONE_RELATIVE_HUMIDITY,
+                              DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE,
+                              DATA.HEATING_SETPOINT_BASE,
+                              DATA.COOLING_SETPOINT_BASE,
+                              DATA.HEATING_COIL_RUNTIME_FRACTION,
+                              DATA.COOLING_COIL_RUNTIME_FRACTION]
+# Actions: one row per session, [heating setpoint, cooling setpoint] (degC, NaN: the setpoint is not changed)
+ACTION_POINTS = [CONTROL.HEATING_SETPOINT_TO_ALFALFA, CONTROL.COOLING_SETPOINT_TO_ALFALFA]
+
+
+def reward_energy_frustration(energy_kwh, frustration, observations, weight_energy=1.0, weight_frustration=1.0):
+    # Default reward: negative weighted sum of the HVAC energy of the step and of the thermal frustration of the occupants
+    return -(weight_energy * energy_kwh + weight_frustration * frustration)
+
+
+def compile_point_map(cosim_session, observation_points):
+    # Keys of the output step of a session for each observation point
+    return [point.format(zone=cosim_session.conditioned_zones[0]) for point in observation_points]
+
+
+class CoSimVectorEnv:
+    """
+    Vectorized environment over K CoSimCore sessions, with the reset()/step() conventions of gymnasium's VectorEnv:
+      - reset() --> (observations (K, P), infos)
+      - step(actions (K, 2)) --> (observations (K, P), rewards (K,), terminated (K,), truncated (K,), infos)
+    The sites are written and advanced together, one batched request per backend (see CoSimGroup.proceed_simulation()), and the
+    outputs are read with the batched read of each backend: with the surrogate backend, a step of every site is one NumPy pass.
+    Sites cannot be rewound, so reset() replaces the sessions with new ones from `create_sessions` (fast with a warm site pool, see CoSimSitePool.py).
+
+    :param create_sessions: function returning the list of (not initialized) CoSimCore sessions of an episode
+    :param observation_points: keys of the output steps observed (OBSERVATION_POINTS_DEFAULT if None)
+    :param reward_function: function of (energy_kwh (K,), frustration (K,), observations (K, P)) returning the rewards (K,)
+    :param occupant_overrides: if True, a shared occupant model (see CoSimGroup) observes each home, and its overrides replace the actions
+    :param steps_per_action: simulation steps advanced per step() with the same action
+    :param episode_steps: number of step() per episode before truncation (until the end time of the sessions if None)
+    """
+    def __init__(self, create_sessions, observation_points=None, reward_function=None, occupant_overrides=False,
+                 steps_per_action=1, episode_steps=None, debug=False):
+        self.create_sessions = create_sessions
+        self.observation_points = observation_points if observation_points is not None else OBSERVATION_POINTS_DEFAULT
+        self.reward_function = reward_function if reward_function is not None else reward_energy_frustration
+        self.occupant_overrides = occupant_overrides
+        self.steps_per_action = steps_per_action
+        self.episode_steps = episode_steps
+        self.debug = debug
+        self.group = None
+        self.point_maps = None
+        self.sessions_per_backend = None
+        self.list_output_step = None
+        self.index_step = 0
+
+    @property
+    def num_envs(self):
+        return len(self.group.cosim_sessions) if self.group is not None else None
+
+    def reset(self):
+        if self.group is not None:
+            self.group.tear_down()
+        self.group = CoSimGroup(self.create_sessions(), debug=self.debug)
+        if self.occupant_overrides:
+            self.group.initialize()
+        else:
+            # Sessions are initialized with threads, without occupant model (the actions replace the controller)
+            self.group.cosim_sessions = Parallel(n_jobs=len(self.group.cosim_sessions), prefer='threads')\
+                                                (delayed(cosim_session.initialize)\
+                                                        (shared_occupant_model=True) for cosim_session in self.group.cosim_sessions)
+        # Sites are advanced by site id: two sessions sharing a site would advance it several times per step
+        model_ids = [cosim_session.model_id for cosim_session in self.group.cosim_sessions]
+        assert len(set(model_ids)) == len(model_ids), f'Sessions initialized with the same site: {model_ids}'
+        self.point_maps = [compile_point_map(cosim_session, self.observation_points) for cosim_session in self.group.cosim_sessions]
+        # Indices of the sessions of each backend (read together)
+        self.sessions_per_backend = dict()
+        for index_session, cosim_session in enumerate(self.group.cosim_sessions):
+            self.sessions_per_backend.setdefault((cosim_session.backend_name, cosim_session.backend.host), (cosim_session.backend, []))[1].append(index_session)
+        self.index_step = 0
+        self.list_output_step = self.read_outputs()
+        return self.get_observations(), self.get_infos()
+
+    def read_outputs(self):
+        list_output_step = [None] * len(self.group.cosim_sessions)
+        for backend, list_index in self.sessions_per_backend.values():
+            site_ids = [self.group.cosim_sessions[index_session].model_id for index_session in list_index]
+            for index_session, output_step, time_sim in zip(list_index, backend.read_outputs(site_ids), backend.read_sim_times(site_ids)):
+                output_step[DATA.TIME_SIM] = time_sim
+                list_output_step[index_session] = output_step
+        return list_output_step
+
+    def get_observations(self):
+        return np.array([[output_step[key] for key in point_map] for output_step, point_map in zip(self.list_output_step, self.point_maps)],
+                        dtype=float)
+
+    def get_infos(self, energy_kwh=None, frustration=None, overrides=None):
+        return {DATA.TIME_SIM: [output_step[DATA.TIME_SIM] for output_step in self.list_output_step],
+                'energy_kwh': energy_kwh,
+                'frustration': frustration,
+                'overrides': overrides}
+
+    def apply_occupants(self, actions):
+        # The occupants observe the current state of their home, and their overrides replace the actions
+        frustration = np.zeros(len(actions))
+        overrides = np.zeros(len(actions), dtype=bool)
+        self.group.o_occupant_model.step(ip_data_env=self.group.gather_inputs(self.list_output_step),
+                                         T_var_names=['T_in', 'T_stp_cool', 'T_stp_heat', 'T_out'])
+        for index_session, agents in enumerate(self.group.agents_per_home):
+            for occupant in agents:
+                frustration[index_session] = max(frustration[index_session], occupant.output['Thermal Frustration'])
+                if occupant.output['Habitual override'] or occupant.output['Discomfort override']:
+                    actions[index_session] = [occupant.output['T_stp_heat'], occupant.output['T_stp_cool']]
+                    overrides[index_session] = True
+        return actions, frustration, overrides
+
+    def step(self, actions):
+        actions = np.array(actions, dtype=float).reshape(len(self.group.cosim_sessions), len(ACTION_POINTS))
+        if self.occupant_overrides:
+            actions, frustration, overrides = self.apply_occupants(actions)
+        else:
+            frustration, overrides = np.zeros(len(actions)), np.zeros(len(actions), dtype=bool)
+
+        valid = ~np.isnan(actions)
+        list_control_input = [{'u': {point: value for point, value, valid_point in zip(ACTION_POINTS, action.tolist(), valid_action) if valid_point}}
+                              for action, valid_action in zip(actions, valid)]
+        energy_kwh = np.zeros(len(actions))
+        for _ in range(self.steps_per_action):
+            self.group.proceed_simulation(list_control_input)
+            self.list_output_step = self.read_outputs()
+            energy_kwh += np.array([[output_step.get(channel, 0.0) for channel in KPI_ENERGY_CHANNELS] for output_step in self.list_output_step],
+                                   dtype=float).sum(axis=1) / JOULES_PER_KWH
+        self.index_step += 1
+
+        observations = self.get_observations()
+        rewards = np.asarray(self.reward_function(energy_kwh, frustration, observations), dtype=float)
+        terminated = np.zeros(len(actions), dtype=bool)
+        truncated = np.array([output_step[DATA.TIME_SIM] >= cosim_session.time_end
+                              for output_step, cosim_session in zip(self.list_output_step, self.group.cosim_sessions)])
+        if self.episode_steps is not None and self.index_step >= self.episode_steps:
+            truncated[:] = True
+        return observations, rewards, terminated, truncated, self.get_infos(energy_kwh, frustration, overrides)
+
+    def close(self):
+        if self.group is not None:
+            self.group.tear_down()
+            self.group = None
+        return
+
+
+def make_reward_function(weight_energy=1.0, weight_frustration=1.0):
+    return functools.partial(reward_energy_frustration, weight_energy=weight_energy, weight_frustration=weight_frustration)
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from CoSimDict import DATA
+
+# Channels which change a few times per day: recorded as change events (time_sim, channel, value) in record[DATA.EVENTS]
+# instead of one value per step in record[DATA.STATUS] (see update_record())
+EVENT_CHANNELS = [DATA.HEATING_SETPOINT_BASE, DATA.HEATING_SETPOINT_DEADBAND_APPLIED, DATA.HEATING_SETPOINT_DEADBAND_UP, DATA.HEATING_SETPOINT_DEADBAND_DOWN,
+                  DATA.COOLING_SETPOINT_BASE, DATA.COOLING_SETPOINT_DEADBAND_APPLIED, DATA.COOLING_SETPOINT_DEADBAND_UP, DATA.COOLING_SETPOINT_DEADBAND_DOWN,
+                  DATA.THERMOSTAT_SCHEDULE, DATA.THERMOSTAT_MODE,
+                  DATA.OCCUPANT_MOTION, DATA.OCCUPANT_HABITUAL_OVERRIDE, DATA.OCCUPANT_DISCOMFORT_OVERRIDE]
+EVENT_CHANNEL = 'channel'
+EVENT_VALUE = 'value'
+# Last value of each channel (not stored): a value is only recorded when it differs from the last one
+EVENT_LAST = 'last'
+
+
+def get_events_template():
+    return {DATA.TIME_SIM: [], EVENT_CHANNEL: [], EVENT_VALUE: [], EVENT_LAST: dict()}
+
+
+def normalize_value(value):
+    # NumPy scalars as Python values, so that the events can be compared and serialized (e.g., by the dcc.Store of the GUI)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def is_same_value(value, value_last):
+    if isinstance(value, float) and isinstance(value_last, float) and np.isnan(value) and np.isnan(value_last):
+        return True
+    return value == value_last
+
+
+def append_changes(events, time_sim, values):
+    # values: channel --> value of the step; only the channels whose value changed are appended
+    last = events[EVENT_LAST]
+    for channel, value in values.items():
+        value = normalize_value(value)
+        if channel in last and is_same_value(value, last[channel]):
+            continue
+        events[DATA.TIME_SIM].append(time_sim)
+        events[EVENT_CHANNEL].append(channel)
+        events[EVENT_VALUE].append(value)
+        last[channel] = value
+    return events
+
+
+def extend_events(events, events_new):
+    # Append the events of a worker (e.g., the GUI steps of a callback, whose record starts with the last step again), skipping repeated values
+    for time_sim, channel, value in zip(events_new[DATA.TIME_SIM], events_new[EVENT_CHANNEL], events_new[EVENT_VALUE]):
+        append_changes(events, time_sim, {channel: value})
+    return events
+
+
+def events_to_frame(events):
+    # Events of a record as a DataFrame (time_sim, channel, value), sorted by time
+    events_data = pd.DataFrame({DATA.TIME_SIM: pd.to_datetime(pd.Series(events[DATA.TIME_SIM], dtype=object)),
+                                EVENT_CHANNEL: pd.Series(events[EVENT_CHANNEL], dtype=object),
+                                EVENT_VALUE: pd.Series(events[EVENT_VALUE], dtype=object)})
+    return events_data.sort_values(DATA.TIME_SIM, kind='stable').reset_index(drop=True)
+
+
+def dense_to_events(record_data, channels=None):
+    # Events of the dense columns of a results DataFrame (e.g., results files written before the event stream), as events_to_frame()
+    list_events_data = []
+    for channel in (channels if channels is not None else EVENT_CHANNELS):
+        if channel not in record_data.columns:
+            continue
+        values = record_data[channel]
+        changed = values.ne(values.shift()) & ~(values.isna() & values.shift().isna())
+        changed.iloc[:1] = True
+        list_events_data.append(pd.DataFrame({DATA.TIME_SIM: pd.to_datetime(record_data[DATA.TIME_SIM][changed]),
+                                              EVENT_CHANNEL: channel,
+                                              EVENT_VALUE: values[changed].astype(object)}))
+    if not list_events_data:
+        return events_to_frame(get_events_template())
+    return pd.concat(list_events_data).sort_values(DATA.TIME_SIM, kind='stable').reset_index(drop=True)
+
+
+def split_events(record_data, channels=None):
+    # (dense results without the event channels, their events): the layout of the results files written by write_results(events=...)
+    events_data = dense_to_events(record_data, channels)
+    return record_data.drop(columns=[channel for channel in (channels if channels is not None else EVENT_CHANNELS)
+                                     if channel in record_data.columns]), events_data
+
+
+def expand_events(events_data, time_sim, channels=None):
+    """
+    Dense columns of the event channels at the times of `time_sim` (e.g., the time_sim column of the sensor table): each channel
+    holds the value of its last event at or before each time (None before its first event).
+    :param events_data: DataFrame of events_to_frame() or read_events(), or events of a record
+    """
+    if isinstance(events_data, dict):
+        events_data = events_to_frame(events_data)
+    time_sim = pd.to_datetime(pd.Series(time_sim)).to_numpy()
+    expanded = dict()
+    for channel in (channels if channels is not None else EVENT_CHANNELS):
+        events_channel = events_data[events_data[EVENT_CHANNEL] == channel]
+        values = np.empty(len(time_sim), dtype=object)
+        if events_channel.empty:
+            expanded[channel] = values
+            continue
+        index_event = np.searchsorted(events_channel[DATA.TIME_SIM].to_numpy(), time_sim, side='right') - 1
+        values[index_event >= 0] = events_channel[EVENT_VALUE].to_numpy()[index_event[index_event >= 0]]
+        expanded[channel] = values
+    return pd.DataFrame(expanded)
+
+
+def get_override_events(events_data, channels=(DATA.OCCUPANT_HABITUAL_OVERRIDE, DATA.OCCUPANT_DISCOMFORT_OVERRIDE)):
+    # Overrides of the occupants (events setting an override flag), with the heating and cooling setpoints at that time
+    if isinstance(events_data, dict):
+        events_data = events_to_frame(events_data)
+    overrides = events_data[events_data[EVENT_CHANNEL].isin(channels) & (events_data[EVENT_VALUE] == True)].reset_index(drop=True)
+    setpoints = expand_events(events_data, overrides[DATA.TIME_SIM], channels=[DATA.HEATING_SETPOINT_BASE, DATA.COOLING_SETPOINT_BASE])
+    return pd.concat([overrides[[DATA.TIME_SIM, EVENT_CHANNEL]], setpoints], axis=1)
+
+
+def get_channel_steps(events_data, channel, time_end=None, skip_none=False):
+    """
+    (times, values) of the events of a channel, for a step plot (e.g., plotly line_shape='hv'), with the last value held until `time_end`.
+    :param skip_none: if True, None values (e.g., thermostat schedule before the first control step) are not plotted
+    """
+    if isinstance(events_data, dict):
+        events_data = events_to_frame(events_data)
+    events_channel = events_data[events_data[EVENT_CHANNEL] == channel]
+    times, values = list(events_channel[DATA.TIME_SIM]), list(events_channel[EVENT_VALUE])
+    if skip_none:
+        times, values = [time for time, value in zip(times, values) if value is not None and value != 'None'], \
+                        [value for value in values if value is not None and value != 'None']
+    if values and time_end is not None and pd.Timestamp(time_end) > times[-1]:
+        times.append(pd.Timestamp(time_end))
+        values.append(values[-1])
+    return times, values
@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import time
+
+from joblib import parallel_backend
+from threadpoolctl import threadpool_limits
+
+# Thread pools of the native libraries (BLAS, OpenMP, ...) read these variables when they are loaded
+THREAD_ENV_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                        'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+BYTES_PER_MB = 1024 ** 2
+BYTES_PER_GB = 1024 ** 3
+
+
+def get_available_cpus():
+    # Cores the orchestrator may run on (e.g., restricted by the container or taskset)
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpu_sets(cpus, num_workers, threads_per_worker):
+    # Cores of each worker slot: consecutive sets of `threads_per_worker` cores, shared round-robin when the workers outnumber them
+    num_sets = max(len(cpus) // threads_per_worker, 1)
+    return [cpus[(index % num_sets) * threads_per_worker:(index % num_sets + 1) * threads_per_worker] or cpus
+            for index in range(num_workers)]
+
+
+class ProcessUsage:
+    # CPU time and resident memory of the current process (psutil if installed, otherwise the standard library: peak RSS only)
+    def __init__(self):
+        try:
+            import psutil
+            self.process = psutil.Process()
+        except ImportError:
+            self.process = None
+
+    def read(self):
+        if self.process is not None:
+            cpu_times = self.process.cpu_times()
+            return {'cpu_seconds': cpu_times.user + cpu_times.system,
+                    'rss_mb': self.process.memory_info().rss / BYTES_PER_MB,
+                    'num_threads': self.process.num_threads()}
+        import resource
+        # ru_maxrss: kilobytes on Linux (bytes on macOS)
+        return {'cpu_seconds': time.process_time(),
+                'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                'num_threads': None}
+
+
+class ResourceBudget:
+    """
+    Budget of the session workers, sent to the joblib workers with the sessions (see SessionGovernor):
+    BLAS/OpenMP threads, cores (one set per worker slot if `cpu_sets` is given) and address space ceiling of each worker process.
+    The worker slots are claimed by pid in a multiprocessing.Manager().dict() (see ResourceGovernor).
+    """
+    def __init__(self, slots, lock, threads, cpu_sets=None, memory_limit_bytes=None, sample_seconds=30.0):
+        self.slots = slots
+        self.lock = lock
+        self.threads = threads
+        self.cpu_sets = cpu_sets
+        self.memory_limit_bytes = memory_limit_bytes
+        self.sample_seconds = sample_seconds
+
+    def claim_slot(self):
+        # Slot of this worker process: the first slot which is free, or held by a process which is not running anymore
+        pid = os.getpid()
+        with self.lock:
+            slots = dict(self.slots)
+            for index_slot, pid_slot in sorted(slots.items()):
+                if pid_slot == pid:
+                    return index_slot
+            for index_slot in range(len(self.cpu_sets) if self.cpu_sets is not None else len(slots) + 1):
+                if index_slot not in slots or not is_running(slots[index_slot]):
+                    self.slots[index_slot] = pid
+                    return index_slot
+        return None
+
+    def apply_process(self):
+        # Limits of the worker process, kept for the sessions which run next in the same process
+        for name in THREAD_ENV_VARIABLES:
+            os.environ[name] = str(self.threads)
+        index_slot = self.claim_slot()
+        cpus = None
+        if self.cpu_sets is not None and index_slot is not None and hasattr(os, 'sched_setaffinity'):
+            cpus = self.cpu_sets[index_slot % len(self.cpu_sets)]
+            os.sched_setaffinity(0, cpus)
+        if self.memory_limit_bytes is not None:
+            import resource
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            limit = self.memory_limit_bytes if hard == resource.RLIM_INFINITY else min(self.memory_limit_bytes, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+        return index_slot, cpus
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SessionGovernor:
+    """
+    Resources of a session (or group) in its worker: start() applies the budget of the worker before the models are loaded
+    (thread pools of the libraries already loaded are limited with threadpoolctl), on_step() samples the CPU and memory usage every
+    `sample_seconds`, and the usage is sent with the status of the session to the run monitor (see MonitorReporter.record_resources()).
+    Without budget (None), the usage is still sampled, but no limit is applied.
+    """
+    def __init__(self, budget, alias, list_reporter=(), logger=None):
+        self.budget = budget
+        self.alias = alias
+        self.list_reporter = list_reporter
+        self.logger = logger
+        self.sample_seconds = budget.sample_seconds if budget is not None else 30.0
+        self.process_usage = ProcessUsage()
+        self.limits = None
+        self.cpus = None
+        self.usage_start = None
+        self.usage_last = None
+        self.time_start = None
+        self.time_last = None
+        self.usage = None
+
+    def start(self):
+        if self.budget is not None:
+            index_slot, self.cpus = self.budget.apply_process()
+            self.limits = threadpool_limits(limits=self.budget.threads)
+            if self.logger is not None:
+                self.logger.info(f'Worker slot {index_slot}: {self.budget.threads} threads, cores: {self.cpus if self.cpus is not None else "any"}',
+                                 extra={'slot': index_slot, 'threads': self.budget.threads, 'cpus': self.cpus})
+        self.usage_start = self.usage_last = self.process_usage.read()
+        self.time_start = self.time_last = time.monotonic()
+        return self
+
+    def on_step(self):
+        if time.monotonic() - self.time_last >= self.sample_seconds:
+            self.sample()
+
+    def sample(self):
+        usage = self.process_usage.read()
+        now = time.monotonic()
+        self.usage = {'cpu_percent': 100 * (usage['cpu_seconds'] - self.usage_last['cpu_seconds']) / max(now - self.time_last, 1e-9),
+                      'cpu_seconds': usage['cpu_seconds'] - self.usage_start['cpu_seconds'],
+                      'rss_mb': usage['rss_mb'],
+                      'num_threads': usage['num_threads'],
+                      'threads_budget': self.budget.threads if self.budget is not None else None,
+                      'cpus': self.cpus}
+        self.usage_last, self.time_last = usage, now
+        for reporter in self.list_reporter:
+            reporter.record_resources(self.usage)
+        if self.budget is not None and self.budget.memory_limit_bytes is not None and self.logger is not None and \
+                usage['rss_mb'] * BYTES_PER_MB > 0.9 * self.budget.memory_limit_bytes:
+            self.logger.warning(f"Memory usage close to the ceiling of the worker: {usage['rss_mb']:.0f} MB", extra={'usage': self.usage})
+        return self.usage
+
+    def stop(self):
+        usage = self.sample()
+        # Average over the whole session
+        usage['cpu_percent'] = 100 * usage['cpu_seconds'] / max(time.monotonic() - self.time_start, 1e-9)
+        if self.logger is not None:
+            self.logger.info(f"Resource usage: {usage['cpu_percent']:.0f}% CPU, {usage['rss_mb']:.0f} MB RSS", extra={'usage': usage})
+        if self.limits is not None:
+            self.limits.restore_original_limits()
+            self.limits = None
+        return usage
+
+
+class ResourceGovernor:
+    """
+    Resource budget of the session workers of the orchestrator, so that dense packing of sessions on a host is predictable:
+    each of the `num_workers` joblib workers gets `threads_per_worker` BLAS/OpenMP threads (the cores available divided by the
+    workers if None), optionally its own set of cores (`pin_cpus`), and an address space ceiling (`memory_limit_gb`, RLIMIT_AS).
+    Parallel calls of the sessions run within parallel_backend(), so that the loky workers start with the thread limits.
+    """
+    def __init__(self, num_workers, threads_per_worker=None, pin_cpus=False, memory_limit_gb=None, sample_seconds=30.0):
+        cpus = get_available_cpus()
+        self.threads_per_worker = threads_per_worker if threads_per_worker is not None else max(len(cpus) // max(num_workers, 1), 1)
+        self.manager = multiprocessing.Manager()
+        self.budget = ResourceBudget(self.manager.dict(),
+                                     self.manager.Lock(),
+                                     threads=self.threads_per_worker,
+                                     cpu_sets=plan_cpu_sets(cpus, num_workers, self.threads_per_worker) if pin_cpus else None,
+                                     memory_limit_bytes=int(memory_limit_gb * BYTES_PER_GB) if memory_limit_gb is not None else None,
+                                     sample_seconds=sample_seconds)
+
+    def parallel_backend(self):
+        return parallel_backend('loky', inner_max_num_threads=self.threads_per_worker)
+
+    def stop(self):
+        slots = dict(self.budget.slots)
+        self.manager.shutdown()
+        return slots
@@ -0,0 +1,177 @@
+from CoSimUtils import initialize_control_information, is_convertable_to_float, BatchDeadbandController
+
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from CoSimCore import CoSimCore
+from CoSimDict import DATA, CONTROL
+
+class CoSimGroup:
+    """
+    Group of CoSimCore sessions (one Alfalfa site and one thermostat per session) driven by a single occupant model.
+    The occupant model is created with N_homes == number of sessions and is stepped once per tick for every home:
+    the inputs of each home are gathered from its own site as arrays, and the output of the occupants of each home
+    is scattered back as the input of its own site.
+    """
+    def __init__(self,
+                 cosim_sessions: list[CoSimCore],
+                 debug=False):
+        self.cosim_sessions = cosim_sessions
+        self.debug = debug
+        self.o_occupant_model = None
+        self.agents_per_home = None
+        self.deadband_controller = None
+
+    def initialize(self):
+        # Sessions are initialized with threads, as they should stay in this process to share the occupant model
+        self.cosim_sessions = Parallel(n_jobs=len(self.cosim_sessions), prefer='threads')\
+                                      (delayed(cosim_session.initialize)\
+                                              (shared_occupant_model=True) for cosim_session in self.cosim_sessions)
+
+        # One occupant model for every home of the group (settings of the first session are used)
+        self.o_occupant_model = self.cosim_sessions[0].create_occupant_model(num_homes=len(self.cosim_sessions))
+
+        # Agents are created home by home, with N_occupants_in_home agents per home
+        num_occupants = self.cosim_sessions[0].o_num_occupants
+        self.agents_per_home = [[] for _ in self.cosim_sessions]
+        for index_agent, occupant in enumerate(self.o_occupant_model.schedule.agents):
+            self.agents_per_home[index_agent // num_occupants].append(occupant)
+        if self.debug: print(f"\t--> Occupant model shared by {len(self.cosim_sessions)} homes (aliases: {[cosim_session.alias for cosim_session in self.cosim_sessions]})")
+        return self
+
+    def retrieve_outputs(self, list_control_information: list = None):
+        if list_control_information is None:
+            list_control_information = [None] * len(self.cosim_sessions)
+        return [cosim_session.retrieve_outputs(control_information=control_information)
+                for cosim_session, control_information in zip(self.cosim_sessions, list_control_information)]
+
+    def gather_inputs(self, list_output_step):
+        # Per-home inputs of the occupant model as arrays (index == home == session)
+        list_zone_state = [cosim_session.get_zone_state(output_step)
+                           for cosim_session, output_step in zip(self.cosim_sessions, list_output_step)]
+        list_state = [cosim_session.get_state(output_step)
+                      for cosim_session, output_step in zip(self.cosim_sessions, list_output_step)]
+        ip_data_env = {'T_in': np.array([zone_state[0] for zone_state in list_zone_state], dtype=float),
+                       'T_stp_cool': np.array([state[DATA.COOLING_SETPOINT_BASE] for state in list_state], dtype=float),
+                       'T_stp_heat': np.array([state[DATA.HEATING_SETPOINT_BASE] for state in list_state], dtype=float),
+                       'hum': np.array([zone_state[1] for zone_state in list_zone_state], dtype=float),
+                       'T_out': np.array([state[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE] for state in list_state], dtype=float),
+                       'mo': None,
+                       'equip_run_heat': np.array([state[DATA.HEATING_COIL_RUNTIME_FRACTION] for state in list_state], dtype=float) != 0,
+                       'equip_run_cool': np.array([state[DATA.COOLING_COIL_RUNTIME_FRACTION] for state in list_state], dtype=float) != 0}
+        return ip_data_env
+
+    def compute_control(self, control_mode, list_output_step, setpoints_manual=None, schedule_info=None, debug=False):
+        # Every site of the group is stepped together, so they share the same simulation time
+        time_sim = list_output_step[0][DATA.TIME_SIM]
+
+        # Manual setpoints: deadband control of every conditioned zone of every session in one pass
+        if control_mode == CONTROL.SETPOINTS:
+            return self.compute_control_setpoints(list_output_step, setpoints_manual)
+
+        # Controllers without occupant model are computed per session
+        if control_mode not in [CONTROL.OCCUPANT_MODEL, CONTROL.SCHEDULE_AND_OCCUPANT_MODEL]:
+            list_control = [cosim_session.compute_control(time_sim=output_step[DATA.TIME_SIM],
+                                                          control_mode=control_mode,
+                                                          setpoints_manual=setpoints_manual,
+                                                          schedule_info=schedule_info,
+                                                          output_step=output_step,
+                                                          debug=debug)
+                            for cosim_session, output_step in zip(self.cosim_sessions, list_output_step)]
+            return [control[0] for control in list_control], [control[1] for control in list_control]
+
+        ip_data_env = self.gather_inputs(list_output_step)
+        if control_mode == CONTROL.OCCUPANT_MODEL:
+            self.o_occupant_model.step(ip_data_env=ip_data_env, T_var_names=['T_in', 'T_stp_cool', 'T_stp_heat', 'T_out'])
+        else:
+            ip_data_env['DateTime'] = time_sim
+            self.o_occupant_model.step(ip_data_env=ip_data_env)
+
+        list_control_input, list_control_information = [], []
+        for cosim_session, agents in zip(self.cosim_sessions, self.agents_per_home):
+            control_input = {'u': {}}
+            control_information = initialize_control_information()
+            for occupant in agents:
+                if control_mode == CONTROL.OCCUPANT_MODEL:
+                    control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = occupant.output['T_stp_heat']
+                    control_input['u'][CONTROL.COOLING_SETPOINT_TO_ALFALFA] = occupant.output['T_stp_cool']
+                    control_information[DATA.HEATING_SETPOINT_NEW] = occupant.output['T_stp_heat']
+                    control_information[DATA.COOLING_SETPOINT_NEW] = occupant.output['T_stp_cool']
+                else:
+                    control_input, control_information = cosim_session.apply_occupant_output(occupant_output=occupant.output,
+                                                                                             datetime_time_sim=time_sim,
+                                                                                             control_information=control_information)
+            list_control_input.append(control_input)
+            list_control_information.append(control_information)
+
+            if debug:
+                print(f"[{cosim_session.alias}] For control_mode: [{control_mode}] at time: {time_sim}"
+                      f"\n\t-Control input is: {control_input}"
+                      f"\n\t-Control information is: {control_information}")
+        return list_control_input, list_control_information
+
+    def compute_control_setpoints(self, list_output_step, setpoints_manual):
+        # Zone temperatures of every conditioned zone of every session, flattened
+        list_zone_temperatures = [cosim_session.get_zone_temperatures(output_step)
+                                  for cosim_session, output_step in zip(self.cosim_sessions, list_output_step)]
+        zone_mean_temperature = np.concatenate(list_zone_temperatures)
+
+        # The hysteresis state of each zone starts from the setpoints of its site
+        if self.deadband_controller is None:
+            self.deadband_controller = BatchDeadbandController(
+                setpoint_heating_initial=np.concatenate([[output_step[DATA.HEATING_SETPOINT_BASE]] * len(zone_temperatures)
+                                                         for output_step, zone_temperatures in zip(list_output_step, list_zone_temperatures)]),
+                setpoint_cooling_initial=np.concatenate([[output_step[DATA.COOLING_SETPOINT_BASE]] * len(zone_temperatures)
+                                                         for output_step, zone_temperatures in zip(list_output_step, list_zone_temperatures)]))
+
+        apply_heating = is_convertable_to_float(setpoints_manual[DATA.HEATING_SETPOINT_NEW])
+        apply_cooling = is_convertable_to_float(setpoints_manual[DATA.COOLING_SETPOINT_NEW])
+        setpoints = {key: (float(value) if is_convertable_to_float(value) else np.nan) for key, value in setpoints_manual.items()}
+        setpoint_heating, setpoint_cooling = self.deadband_controller.compute(zone_mean_temperature=zone_mean_temperature,
+                                                                              setpoints=setpoints)
+
+        # Each site has a single thermostat input, which follows the first conditioned zone of the session
+        list_control_input, list_control_information = [], []
+        index_zone = 0
+        for zone_temperatures in list_zone_temperatures:
+            control_input = {'u': {}}
+            if apply_heating:
+                control_input['u'][CONTROL.HEATING_SETPOINT_TO_ALFALFA] = float(setpoint_heating[index_zone])
+            if apply_cooling:
+                control_input['u'][CONTROL.COOLING_SETPOINT_TO_ALFALFA] = float(setpoint_cooling[index_zone])
+            list_control_input.append(control_input)
+            list_control_information.append(setpoints_manual)
+            index_zone += len(zone_temperatures)
+        return list_control_input, list_control_information
+
+    def proceed_simulation(self, list_control_input):
+        # Sessions on the same deployment (backend and host, e.g., the same Alfalfa endpoint of a pool) are written and advanced together
+        sessions_per_backend = dict()
+        for cosim_session, control_input in zip(self.cosim_sessions, list_control_input):
+            backend, site_ids, list_inputs, list_session = \
+                sessions_per_backend.setdefault((cosim_session.backend_name, cosim_session.backend.host), (cosim_session.backend, [], [], []))
+            site_ids.append(cosim_session.model_id)
+            list_inputs.append(control_input['u'])
+            list_session.append(cosim_session)
+        for backend, site_ids, list_inputs, list_session in sessions_per_backend.values():
+            time_request = time.perf_counter()
+            try:
+                backend.write_inputs(site_ids, list_inputs)
+                # Every site of the same Alfalfa deployment is advanced with a single request (if the backend supports it)
+                backend.advance(site_ids)
+            except Exception as e:
+                # A single failure of the endpoint (the sessions of the group are restarted together)
+                if list_session[0].endpoint is not None: list_session[0].endpoint.record_failure(e)
+                for cosim_session in list_session[1:]:
+                    if cosim_session.endpoint is not None: cosim_session.endpoint.release()
+                raise
+            for cosim_session in list_session:
+                if cosim_session.endpoint is not None: cosim_session.endpoint.record_latency(time.perf_counter() - time_request)
+        return
+
+    def tear_down(self):
+        for cosim_session in self.cosim_sessions:
+            cosim_session.tear_down()
+        return
@@ -0,0 +1,182 @@
+import collections
+import json
+import os
+
+import pandas as pd
+
+from CoSimDict import DATA
+
+# Energy channels summed by the accumulators (same units as the records, i.e., J per step for EnergyPlus outputs)
+KPI_ENERGY_CHANNELS = [DATA.COOLING_COIL_ELECTRICITY_ENERGY,
+                       DATA.HEATING_COIL_ELECTRICITY_ENERGY,
+                       DATA.HEATING_COIL_FUEL_ENERGY,
+                       DATA.FAN_ELECTRICITY_ENERGY]
+# Cumulative meters of the energy channels, if reported by the building model (see CoSimCore.retrieve_outputs())
+KPI_ENERGY_CUMULATIVE = {channel: channel + ' ' + DATA.ENERGY_CUMULATIVE for channel in KPI_ENERGY_CHANNELS}
+JOULES_PER_KWH = 3.6e6
+
+# Rollup periods: key of the period from the simulation time
+KPI_PERIODS = {'hourly': lambda time_sim: (time_sim.year, time_sim.month, time_sim.day, time_sim.hour),
+               'daily': lambda time_sim: (time_sim.year, time_sim.month, time_sim.day),
+               'monthly': lambda time_sim: (time_sim.year, time_sim.month)}
+KPI_PERIOD_FORMATS = {'hourly': '{:04d}-{:02d}-{:02d} {:02d}:00', 'daily': '{:04d}-{:02d}-{:02d}', 'monthly': '{:04d}-{:02d}'}
+
+
+class KPIBucket:
+    # Sums, extrema and counts of one period (or of the whole run)
+    def __init__(self, key=None):
+        self.key = key
+        self.steps = 0
+        self.hours = 0.0
+        self.energy = [0.0] * len(KPI_ENERGY_CHANNELS)
+        self.habitual_overrides = 0
+        self.discomfort_overrides = 0
+        self.frustration_sum = 0.0
+        self.frustration_max = 0.0
+        self.unmet_heating_hours = 0.0
+        self.unmet_cooling_hours = 0.0
+        self.heating_deviation_degree_hours = 0.0
+        self.cooling_deviation_degree_hours = 0.0
+        self.zone_temperature_sum = 0.0
+        self.zone_temperature_min = float('inf')
+        self.zone_temperature_max = float('-inf')
+        self.outdoor_temperature_sum = 0.0
+
+    def add(self, hours, energy, habitual_override, discomfort_override, frustration, unmet_heating, unmet_cooling,
+            heating_deviation, cooling_deviation, zone_temperature, outdoor_temperature):
+        self.steps += 1
+        self.hours += hours
+        for index, value in enumerate(energy):
+            self.energy[index] += value
+        self.habitual_overrides += habitual_override
+        self.discomfort_overrides += discomfort_override
+        self.frustration_sum += frustration
+        self.frustration_max = max(self.frustration_max, frustration)
+        self.unmet_heating_hours += hours * unmet_heating
+        self.unmet_cooling_hours += hours * unmet_cooling
+        self.heating_deviation_degree_hours += hours * heating_deviation
+        self.cooling_deviation_degree_hours += hours * cooling_deviation
+        self.zone_temperature_sum += zone_temperature
+        self.zone_temperature_min = min(self.zone_temperature_min, zone_temperature)
+        self.zone_temperature_max = max(self.zone_temperature_max, zone_temperature)
+        self.outdoor_temperature_sum += outdoor_temperature
+
+    def to_dict(self):
+        steps = max(self.steps, 1)
+        kpi = {'steps': self.steps, 'hours': self.hours}
+        for channel, value in zip(KPI_ENERGY_CHANNELS, self.energy):
+            kpi[channel + ' [kWh]'] = value / JOULES_PER_KWH
+        kpi.update({'HVAC Energy [kWh]': sum(self.energy) / JOULES_PER_KWH,
+                    'Habitual Overrides [steps]': self.habitual_overrides,
+                    'Discomfort Overrides [steps]': self.discomfort_overrides,
+                    'Thermal Frustration Mean': self.frustration_sum / steps,
+                    'Thermal Frustration Max': self.frustration_max,
+                    'Unmet Heating [h]': self.unmet_heating_hours,
+                    'Unmet Cooling [h]': self.unmet_cooling_hours,
+                    'Heating Setpoint Deviation [degC.h]': self.heating_deviation_degree_hours,
+                    'Cooling Setpoint Deviation [degC.h]': self.cooling_deviation_degree_hours,
+                    'Zone Temperature Mean [degC]': self.zone_temperature_sum / steps if self.steps else None,
+                    'Zone Temperature Min [degC]': self.zone_temperature_min if self.steps else None,
+                    'Zone Temperature Max [degC]': self.zone_temperature_max if self.steps else None,
+                    'Outdoor Temperature Mean [degC]': self.outdoor_temperature_sum / steps if self.steps else None})
+        return kpi
+
+
+class KPIAccumulator:
+    """
+    Streaming KPIs of a session, fed with each output_step by update_record(): HVAC energy, override counts, thermal frustration,
+    unmet hours and setpoint deviation (degree-hours below the applied heating setpoint / above the applied cooling setpoint).
+    Totals are kept with hourly, daily and monthly rollups; only the last `periods_kept` closed periods of each rollup are kept,
+    so that the memory does not grow with the length of the run.
+    """
+    def __init__(self, name, conditioned_zones, time_step_size=1, unmet_tolerance=0.2, periods_kept=None):
+        # time_step_size: minutes per step / unmet_tolerance: degC beyond the applied setpoints counted as unmet (as EnergyPlus)
+        # periods_kept: number of closed periods kept per rollup (e.g., {'hourly': 48, 'daily': 400, 'monthly': 240})
+        periods_kept = {'hourly': 48, 'daily': 400, 'monthly': 240} if periods_kept is None else periods_kept
+        self.name = name
+        self.conditioned_zones = conditioned_zones
+        self.hours_per_step = time_step_size / 60.0
+        self.unmet_tolerance = unmet_tolerance
+        self.total = KPIBucket('total')
+        self.current = {period: None for period in KPI_PERIODS}
+        self.closed = {period: collections.deque(maxlen=periods_kept.get(period)) for period in KPI_PERIODS}
+        self.time_first = None
+        self.time_last = None
+
+    def update(self, output_step, steps=1):
+        # steps: number of steps represented by output_step (e.g., adaptive stepping or fast-forward with an output interval)
+        # Energy channels are the mean per step over these steps (see CoSimCore.retrieve_outputs())
+        time_sim = output_step[DATA.TIME_SIM]
+        zone_temperature = sum(output_step[zone_name + ' ' + DATA.ZONE_MEAN_TEMP] for zone_name in self.conditioned_zones) / len(self.conditioned_zones)
+        # Setpoints applied to the building model (after the deadband)
+        heating_setpoint = output_step[DATA.HEATING_SETPOINT_BASE]
+        cooling_setpoint = output_step[DATA.COOLING_SETPOINT_BASE]
+        heating_deviation = max(heating_setpoint - zone_temperature, 0.0)
+        cooling_deviation = max(zone_temperature - cooling_setpoint, 0.0)
+        values = (self.hours_per_step * steps,
+                  [float(output_step.get(channel, 0.0)) * steps for channel in KPI_ENERGY_CHANNELS],
+                  bool(output_step[DATA.OCCUPANT_HABITUAL_OVERRIDE]),
+                  bool(output_step[DATA.OCCUPANT_DISCOMFORT_OVERRIDE]),
+                  float(output_step[DATA.OCCUPANT_THERMAL_FRUSTRATION]),
+                  heating_deviation > self.unmet_tolerance,
+                  cooling_deviation > self.unmet_tolerance,
+                  heating_deviation,
+                  cooling_deviation,
+                  zone_temperature,
+                  float(output_step[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE]))
+
+        self.total.add(*values)
+        for period, get_key in KPI_PERIODS.items():
+            key = get_key(time_sim)
+            bucket = self.current[period]
+            if bucket is None or bucket.key != key:
+                if bucket is not None:
+                    self.closed[period].append(bucket)
+                bucket = self.current[period] = KPIBucket(key)
+            bucket.add(*values)
+        if self.time_first is None:
+            self.time_first = time_sim
+        self.time_last = time_sim
+
+    def totals(self):
+        # Live KPIs (e.g., for the run monitor and the GUI)
+        return self.total.to_dict()
+
+    def rollup(self, period):
+        # DataFrame of the kept periods of a rollup, including the current (partial) period
+        buckets = list(self.closed[period]) + ([self.current[period]] if self.current[period] is not None else [])
+        return pd.DataFrame([{'period': KPI_PERIOD_FORMATS[period].format(*bucket.key), **bucket.to_dict()} for bucket in buckets])
+
+    def summary(self, periods=('daily', 'monthly')):
+        return {'name': self.name,
+                'time_first': str(self.time_first),
+                'time_last': str(self.time_last),
+                'total': self.totals(),
+                **{period: self.rollup(period).to_dict('records') for period in periods}}
+
+    def write_summary(self, path_results):
+        # Written next to the results file: '<results file name>_kpi.json'
+        path_summary = get_kpi_path(path_results)
+        with open(path_summary + '.tmp', 'w') as file:
+            json.dump(self.summary(), file, default=str)
+        os.replace(path_summary + '.tmp', path_summary)
+        return path_summary
+
+
+def get_kpi_path(path_results):
+    return os.path.splitext(path_results)[0] + '_kpi.json'
+
+
+def read_kpi_summary(path_results):
+    with open(get_kpi_path(path_results)) as file:
+        return json.load(file)
+
+
+def read_kpi_totals(list_path_results):
+    # Totals of many runs as a DataFrame (one row per run), reading the summary files only
+    list_row = []
+    for path_results in list_path_results:
+        summary = read_kpi_summary(path_results)
+        list_row.append({'name': summary['name'], 'path_results': path_results, 'time_first': summary['time_first'],
+                         'time_last': summary['time_last'], **summary['total']})
+    return pd.DataFrame(list_row)
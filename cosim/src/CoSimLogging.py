@@ -0,0 +1,116 @@
+import logging
+import logging.handlers
+import multiprocessing
+import json
+import time
+import sys
+from datetime import datetime
+
+# Every logger of the framework is a child of this logger (e.g., 'cosim.session.<alias>', 'cosim.thermostat')
+LOGGER_ROOT = 'cosim'
+
+# Attributes of logging.LogRecord, which are not written as extra fields
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)).keys()) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per line, including the session alias and any `extra` field given to the logger
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'process': record.processName,
+                 'session': getattr(record, 'session', None),
+                 'message': record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _run_log_writer(log_queue, path_log, console_level):
+    # Writer process: the only process writing to the log file and the console
+    handler_file = logging.FileHandler(path_log, mode='a')
+    handler_file.setFormatter(JsonLinesFormatter())
+    handler_console = logging.StreamHandler(sys.stdout)
+    handler_console.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(session)s: %(message)s', defaults={'session': '-'}))
+    handler_console.setLevel(console_level)
+    while True:
+        record = log_queue.get()
+        if record is None:
+            break
+        handler_file.handle(record)
+        if record.levelno >= handler_console.level:
+            handler_console.handle(record)
+    handler_file.close()
+
+
+def start_log_writer(path_log, console_level='INFO'):
+    """
+    Start the writer process of the log file (JSON lines).
+    :return: (log_queue, process), where log_queue can be passed to joblib workers (see configure_logging())
+    """
+    # A managed queue is used, as it can be pickled and sent to the workers of joblib
+    manager = multiprocessing.Manager()
+    log_queue = manager.Queue(-1)
+    process = multiprocessing.Process(target=_run_log_writer, args=(log_queue, path_log, console_level), daemon=True)
+    process.start()
+    # Keep a reference to the manager, which should live as long as the queue is used
+    process.manager = manager
+    return log_queue, process
+
+
+def stop_log_writer(log_queue, process):
+    log_queue.put(None)
+    process.join()
+    process.manager.shutdown()
+    return
+
+
+def configure_logging(log_queue, level='INFO'):
+    # Send every log record of this process to the writer process (can be called again in a re-used worker)
+    # `level` applies to the loggers without their own level (e.g., 'cosim.thermostat'), session loggers have their own level
+    logger = logging.getLogger(LOGGER_ROOT)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+class SessionLoggerAdapter(logging.LoggerAdapter):
+    # Same as logging.LoggerAdapter, but `extra` given to each call is merged with the session information instead of being dropped
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return msg, kwargs
+
+
+def get_session_logger(alias, level='INFO'):
+    # Logger of a session: its level can be set per session, and every record carries the alias of the session
+    logger = logging.getLogger(LOGGER_ROOT + '.session.' + alias.replace('.', '_'))
+    logger.setLevel(level)
+    return SessionLoggerAdapter(logger, {'session': alias})
+
+
+class ProgressLogger:
+    """
+    Rate-limited progress lines: a line is logged every `every_steps` steps or every `every_seconds` seconds, whichever comes first.
+    """
+    def __init__(self, logger, steps_total=None, every_steps=1440, every_seconds=60.0):
+        self.logger = logger
+        self.steps_total = steps_total
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.step_logged = 0
+        self.time_logged = time.monotonic()
+
+    def update(self, steps_done, time_sim=None):
+        if steps_done - self.step_logged < self.every_steps and time.monotonic() - self.time_logged < self.every_seconds:
+            return
+        self.logger.info(f'Step {steps_done}' + (f'/{self.steps_total}' if self.steps_total else '') + (f' (time_sim: {time_sim})' if time_sim else ''),
+                         extra={'steps_done': steps_done, 'time_sim': time_sim})
+        self.step_logged = steps_done
+        self.time_logged = time.monotonic()
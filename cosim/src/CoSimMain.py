@@ -1,102 +1,312 @@
 print('Running CoSimMain.py')
 # Import utilities
-import datetime, os, uuid, time
+import contextlib, datetime, os, time
 import pandas as pd
 import numpy as np
 from joblib import Parallel, delayed
 
 # Import CoSim scripts
 from CoSimCore import CoSimCore
+from CoSimGroup import CoSimGroup
 from CoSimDict import DATA, SETTING, CONTROL
 from CoSimUtils import get_record_template, update_record
+from CoSimSession import create_kpi, run_session_steps, export_session_record
+from CoSimCache import ResultCache, get_run_fingerprint
+from CoSimProfiler import SessionProfiler, install_signal_handler
+from CoSimPartition import partition_horizon, get_segment_steps, get_segment_alias, get_segment_input, run_prepass, apply_seed, stitch_segments, \
+                           SEEDING_PREPASS
+from CoSimLogging import start_log_writer, stop_log_writer, configure_logging, get_session_logger, ProgressLogger
+from CoSimMonitor import RunMonitor, STATE_INITIALIZING, STATE_RUNNING, STATE_EXPORTING
+from CoSimDistributed import get_job_queue, create_job_spec, Coordinator
+from CoSimEndpoints import EndpointMonitor
+from CoSimTuner import ConcurrencyController, ConcurrencySlot, read_calibration
+from CoSimGovernor import ResourceGovernor, SessionGovernor
+from CoSimManifest import reap_orphaned_sites
 
 # Import occupant model
 from occupant_model.src.model import OccupantModel
 from thermostat import thermostat
-import requests, socket, time, timeit, sys, socket
+import requests, socket, time, timeit, socket
 
 # Import eppy to read idf's deadband settings
 from eppy.modeleditor import IDF
  
 time.sleep(2)
 
-class Logger(object):
-    def __init__(self, filename="Default.log"):
-        self.terminal = sys.stdout
-        self.log = open(filename, "a")
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        # this flush method is needed for python 3 compatibility.
-        # this handles the flush command by doing nothing.
-        pass
-
-def run_each_session(index_input, input_each, steps_to_proceed):
-    # Initialization of CoSimCore
-    print(f'=Initializing cosim-session')
-    cosim_session = CoSimCore(alias='Model' + str(index_input+1) + ': ' + input_each[SETTING.BUILDING_MODEL_INFORMATION][SETTING.NAME_BUILDING_MODEL],
-                              building_model_information=input_each[SETTING.BUILDING_MODEL_INFORMATION],
-                              simulation_information=input_each[SETTING.SIMULATION_INFORMATION],
-                              occupant_model_information=input_each[SETTING.OCCUPANT_MODEL_INFORMATION],
-                              thermostat_model_information=input_each[SETTING.THERMOSTAT_MODEL_INFORMATION],
-                              test_default_model=False,
-                              debug=debug)
+def get_alias(index_input, input_each):
+    return 'Model' + str(index_input+1) + ': ' + input_each[SETTING.BUILDING_MODEL_INFORMATION][SETTING.NAME_BUILDING_MODEL]
+
+def create_session(index_input, input_each, alias=None):
+    return CoSimCore(alias=alias if alias is not None else get_alias(index_input, input_each),
+                     building_model_information=input_each[SETTING.BUILDING_MODEL_INFORMATION],
+                     simulation_information=input_each[SETTING.SIMULATION_INFORMATION],
+                     occupant_model_information=input_each[SETTING.OCCUPANT_MODEL_INFORMATION],
+                     thermostat_model_information=input_each[SETTING.THERMOSTAT_MODEL_INFORMATION],
+                     test_default_model=False,
+                     debug=debug)
+
+def replace_advanced_site(cosim_session, index_input, input_each, shared_occupant_model=False):
+    # A site reattached after a restart of this script (see CoSimManifest.py) is only kept if it was not advanced yet:
+    # the records of the steps it simulated were lost with the previous run, so that it is replaced by a new site
+    if not cosim_session.reattached or pd.Timestamp(cosim_session.time_sim) <= pd.Timestamp(cosim_session.time_start):
+        return cosim_session
+    get_logger(cosim_session.alias).warning(f'Site {cosim_session.model_id} reattached at {cosim_session.time_sim}: replaced by a new site',
+                                            extra={'site_id': cosim_session.model_id, 'time_sim': cosim_session.time_sim})
+    cosim_session.tear_down()
+    return create_session(index_input, input_each, alias=cosim_session.alias).initialize(shared_occupant_model=shared_occupant_model)
+
+def get_logger(alias):
+    # Records of this process are sent to the writer process of the log file
+    configure_logging(log_queue)
+    return get_session_logger(alias, level=log_levels_session.get(alias, log_level_default))
+
+def get_run_settings(index_input, steps_to_proceed, num_homes=1, segment=None):
+    # Settings of the run which change its results (see CoSimCache.get_run_fingerprint())
+    # segment: segment of the horizon (see CoSimPartition.py), whose start time is in the settings of the session
+    return {'replicate': index_input,   # the occupant model is stochastic: each model of the batch is a distinct sample
+            'steps': int(np.floor(float(steps_to_proceed))),
+            'control_mode': current_control_mode,
+            'setpoints_manual': setpoint_manual_test,
+            'steps_warm_up': steps_warm_up,
+            'fast_forward_output_interval': fast_forward_output_interval if current_control_mode == CONTROL.PASSTHROUGH else None,
+            'max_steps_per_decision': max_steps_per_decision if adaptive_stepping else None,
+            'result_float32_sensors': result_float32_sensors,
+            'num_homes_per_group': num_homes,
+            'segment_seeding': segment_seeding if segment is not None else None,
+            'steps_overlap': segment['steps_overlap'] if segment is not None else None}
+
+def lookup_result(index_input, input_each, steps_to_proceed, num_homes=1, segment=None):
+    # (fingerprint of the run, path of its cached results file or None)
+    fingerprint = get_run_fingerprint(input_each, get_run_settings(index_input, steps_to_proceed, num_homes, segment=segment))
+    return fingerprint, result_cache.lookup(fingerprint) if result_cache is not None else None
+
+def export_record(cosim_session, record_each, logger, kpi=None, fingerprint=None):
+    # Records of adaptive steps are resampled to the uniform grid of time_step_size
+    return export_session_record(cosim_session, record_each, dir_output, logger, kpi=kpi, fingerprint=fingerprint,
+                                 resample=adaptive_stepping,
+                                 codec=result_codec,
+                                 row_group_size=result_row_group_size,
+                                 float32_sensors=result_float32_sensors,
+                                 result_cache=result_cache)
+
+def run_with_retries(run, args, list_reporter, alias, **kwargs):
+    # A failed run is restarted from the beginning (with new Alfalfa sites) up to `max_retries_session` times
+    logger = get_logger(alias)
+    for attempt in range(max_retries_session + 1):
+        try:
+            result = run(*args, list_reporter, **kwargs)
+            for reporter in list_reporter:
+                reporter.record_done()
+            return result
+        except Exception as e:
+            if attempt < max_retries_session:
+                logger.exception(f'Run failed (attempt {attempt + 1}/{max_retries_session + 1}), retrying...')
+                for reporter in list_reporter:
+                    reporter.record_retry(e)
+            else:
+                logger.exception(f'Run failed (attempt {attempt + 1}/{max_retries_session + 1})')
+                for reporter in list_reporter:
+                    reporter.record_failure(e)
+                raise
+
+def run_each_session(index_input, input_each, steps_to_proceed, list_reporter, segment=None):
+    # segment: if given, only this segment of the horizon is simulated, from the start of its overlap (see CoSimPartition.py)
+    reporter = list_reporter[0]
+    alias = get_alias(index_input, input_each)
+    steps_fast_forward = steps_warm_up
+    if segment is not None:
+        alias = get_segment_alias(alias, segment)
+        input_each = get_segment_input(input_each, segment)
+        steps_fast_forward += get_segment_steps(segment, segment_seeding)[0]
+    # Runs already done with the same settings are not simulated again
+    fingerprint, path_cached = lookup_result(index_input, input_each, steps_to_proceed, segment=segment)
+    if path_cached is not None:
+        get_logger(alias).info(f'Cached result: {path_cached}', extra={'path': path_cached, 'fingerprint': fingerprint})
+        reporter.update(int(np.floor(float(steps_to_proceed))))
+        return path_cached
+
+    reporter.set_state(STATE_INITIALIZING)
+    # Thread, core and memory budget of the worker, applied before the models are loaded (see CoSimGovernor.py)
+    session_governor = SessionGovernor(resource_budget, alias, list_reporter, logger=get_logger(alias)).start()
+    try:
+        # Initialization of CoSimCore
+        cosim_session = create_session(index_input, input_each, alias=alias)
+        logger = get_logger(cosim_session.alias)
+        logger.info(f'Initializing cosim-session (pid: {os.getpid()})', extra={'pid': os.getpid()})
+        cosim_session = replace_advanced_site(cosim_session.initialize(), index_input, input_each)
+        try:
+            logger.info(f'Initialization complete (site_id: {cosim_session.model_id})', extra={'site_id': cosim_session.model_id})
+            if segment is not None and segment.get('path_seed') is not None:
+                # Occupant and thermostat models of the pre-pass at the start of the segment
+                apply_seed(cosim_session, segment['path_seed'])
+                logger.info(f"Seeded from: {segment['path_seed']}", extra={'path': segment['path_seed']})
+
+            # Profiling of a window of steps, from the settings or on request with SIGUSR1 (see CoSimProfiler.py)
+            if profile_on_signal:
+                install_signal_handler()
+            session_profiler = SessionProfiler(alias=cosim_session.alias,
+                                               dir_output=dir_output,
+                                               step_start=profile_sessions.get(cosim_session.alias),
+                                               steps_window=profile_steps,
+                                               interval_seconds=profile_interval_seconds,
+                                               logger=logger)
+            # Slot of the session among the sessions stepping at once, with adaptive concurrency (see CoSimTuner.py)
+            concurrency_slot = ConcurrencySlot(concurrency_limiter, cosim_session.alias, window_steps=concurrency_window_steps, logger=logger)
+            record_each, kpi = run_session_steps(cosim_session, steps_to_proceed,
+                                                 control_mode=current_control_mode,
+                                                 setpoints_manual=setpoint_manual_test,
+                                                 steps_warm_up=steps_fast_forward,
+                                                 fast_forward_output_interval=fast_forward_output_interval,
+                                                 max_steps_per_decision=max_steps_per_decision if adaptive_stepping else None,
+                                                 record_events=record_events,
+                                                 time_start=time_start,
+                                                 time_end=time_end,
+                                                 reporter=reporter,
+                                                 logger=logger,
+                                                 progress_every_steps=progress_every_steps,
+                                                 progress_every_seconds=progress_every_seconds,
+                                                 session_profiler=session_profiler,
+                                                 concurrency_slot=concurrency_slot,
+                                                 session_governor=session_governor,
+                                                 debug=debug)
+
+            # Export the simulation result
+            reporter.set_state(STATE_EXPORTING)
+            path_results = export_record(cosim_session, record_each, logger, kpi=kpi, fingerprint=fingerprint)
+        finally:
+            # Tear down, also when the session fails: its retry starts with a new site
+            logger.info(f'Tearing down the model (site_id: {cosim_session.model_id})...')
+            cosim_session.tear_down()
+            logger.info('Tear down complete!')
+    finally:
+        session_governor.stop()
+    return path_results
+
+def run_prepass_each(index_input, input_each, list_segment):
+    # Coarse pre-pass of the whole horizon (on the surrogate model if given), saving the seeds of the segments (see CoSimPartition.run_prepass())
+    alias = get_alias(index_input, input_each) + ' (pre-pass)'
+    logger = get_logger(alias)
+    if segment_prepass_surrogate_model is not None:
+        input_each = {**input_each, SETTING.BUILDING_MODEL_INFORMATION: {**input_each[SETTING.BUILDING_MODEL_INFORMATION],
+                                                                        SETTING.BACKEND: 'surrogate',
+                                                                        SETTING.PATH_SURROGATE_MODEL: segment_prepass_surrogate_model}}
+    cosim_session = create_session(index_input, input_each, alias=alias)
+    logger.info(f'Initializing cosim-session (pid: {os.getpid()})', extra={'pid': os.getpid()})
     cosim_session.initialize()
-    print(f'\t--> Complete (alias: {cosim_session.alias} / site_id: {cosim_session.model_id})\n')
-    
-    # Run part (1): Initialize the record
-    print(f'=Running simulation (alias: {cosim_session.alias} / site_id: {cosim_session.model_id})...')
-    output_step = cosim_session.retrieve_outputs()
-    time_sim_input = output_step[DATA.TIME_SIM]
-    record_each = get_record_template(name=cosim_session.alias,
-                                    time_start=time_start,
-                                    time_end=time_end,
-                                    conditioned_zones=cosim_session.conditioned_zones,
-                                    unconditioned_zones=cosim_session.unconditioned_zones,
-                                    is_initial_record=True,
-                                    output_step=output_step)
-    
-    # Run part (2): Run the simulations
-    for index_step in range(int(np.floor(float(steps_to_proceed)))):
-        print(f'\t--> Step {index_step + 1} (alias: {cosim_session.alias})')
-        control_input, control_information = \
-            cosim_session.compute_control(time_sim=time_sim_input,
-                                          control_mode=current_control_mode,
-                                          setpoints_manual=setpoint_manual_test,
-                                          schedule_info=None,
-                                          output_step=output_step)
-
-        cosim_session.proceed_simulation(control_input=control_input,
-                                         control_information=control_information)
-
-        output_step = cosim_session.retrieve_outputs(control_information=control_information)
-        time_sim_input = output_step[DATA.TIME_SIM]
-        update_record(output_step=output_step,
-                      record=record_each,
-                      conditioned_zones=cosim_session.conditioned_zones,
-                      unconditioned_zones=cosim_session.unconditioned_zones)
-
-    # Export the simulation result
-    print(f'\n=Exporting results (alias: {cosim_session.alias} / site_id: {cosim_session.model_id})...')
-    uuid_prefix = str(uuid.uuid4())
-    # model_prefix = cosim_session.alias.split(':')[0]
-    model_name = record_each[DATA.SETTING]['model_name'][0].replace(": ","_")
-    alpha_value = "a" + str(occupant_model_information[SETTING.TFT_ALPHA]).replace(".","")+ "_"
-    dir_output_file = os.path.join(dir_output, model_name + '_' + uuid_prefix + '_' +  alpha_value +'.gzip')
-    record_data = pd.DataFrame.from_dict({**record_each[DATA.INPUT], **record_each[DATA.STATUS]})
-    record_data.to_parquet(dir_output_file,compression='gzip')
-    print(f"\t--> File path (alias: {cosim_session.alias}): {dir_output_file}")
-    print(f"\t--> Data exported (alias: {cosim_session.alias}) to: {dir_output}")    
-
-    # Tear down
-    print(f'\n=Tearing down the model (alias: {cosim_session.alias} / site_id: {cosim_session.model_id})...')
-    cosim_session.alfalfa_client.stop(
-        cosim_session.model_id     # site_id
-    )
-    print(f'\t--> Tear down complete (alias: {cosim_session.alias})!\n')    
+    dir_seed = os.path.join(dir_output, 'segment_seeds', get_run_fingerprint(input_each, get_run_settings(index_input, steps_to_run))[:16])
+    paths_seed = run_prepass(cosim_session, list_segment, dir_seed,
+                             control_mode=current_control_mode,
+                             setpoints_manual=setpoint_manual_test,
+                             logger=logger)
+    cosim_session.tear_down()
+    return paths_seed
+
+def stitch_each(index_input, input_each, list_segment, list_path_results):
+    # Continuous results file of a segmented run, with the report of the discontinuities at the boundaries of the segments
+    logger = get_logger(get_alias(index_input, input_each))
+    fingerprint = get_run_fingerprint(input_each, {**get_run_settings(index_input, steps_to_run),
+                                                   'segments': [(segment['time_start'], segment['steps_overlap']) for segment in list_segment],
+                                                   'segment_seeding': segment_seeding})
+    model_name = get_alias(index_input, input_each).replace(": ", "_")
+    path_output = os.path.join(dir_output, model_name + '_' + fingerprint[:16] + '_stitched.parquet')
+    path_results, report = stitch_segments(list_path_results, list_segment, path_output,
+                                           codec=result_codec,
+                                           row_group_size=result_row_group_size,
+                                           float32_sensors=result_float32_sensors)
+    flagged = report[report['flagged']] if not report.empty else report
+    logger.info(f'Segments stitched to: {path_results} ({len(flagged)} discontinuities flagged)',
+                extra={'path': path_results, 'flagged': flagged.to_dict('records')})
+    return path_results
+
+
+def run_each_group(index_group, list_input_group, steps_to_proceed, list_reporter):
+    # A single occupant model steps every home of the group, where each home is simulated by its own Alfalfa site
+    logger = get_logger(f'Group{index_group + 1}')
+    # The group is only skipped if every home is cached, as the homes share the occupant model
+    list_fingerprint, list_path_cached = zip(*[lookup_result(index_input, input_each, steps_to_proceed, num_homes=len(list_input_group))
+                                               for index_input, input_each in list_input_group])
+    if all(path_cached is not None for path_cached in list_path_cached):
+        logger.info(f'Cached results: {list(list_path_cached)}', extra={'paths': list(list_path_cached)})
+        for reporter in list_reporter:
+            reporter.update(int(np.floor(float(steps_to_proceed))))
+        return
+
+    for reporter in list_reporter:
+        reporter.set_state(STATE_INITIALIZING)
+    session_governor = SessionGovernor(resource_budget, f'Group{index_group + 1}', list_reporter, logger=logger).start()
+    try:
+        logger.info(f'Initializing cosim-group ({len(list_input_group)} homes, pid: {os.getpid()})', extra={'pid': os.getpid()})
+        cosim_group = CoSimGroup(cosim_sessions=[create_session(index_input, input_each) for index_input, input_each in list_input_group],
+                                 debug=debug)
+        cosim_group.initialize()
+        cosim_group.cosim_sessions = [replace_advanced_site(cosim_session, index_input, input_each, shared_occupant_model=True)
+                                      for cosim_session, (index_input, input_each) in zip(cosim_group.cosim_sessions, list_input_group)]
+        try:
+            logger.info(f'Initialization complete (aliases: {[cosim_session.alias for cosim_session in cosim_group.cosim_sessions]})')
+
+            # Run part (1): Initialize the records
+            list_output_step = cosim_group.retrieve_outputs()
+            list_record = [get_record_template(name=cosim_session.alias,
+                                               time_start=time_start,
+                                               time_end=time_end,
+                                               conditioned_zones=cosim_session.conditioned_zones,
+                                               unconditioned_zones=cosim_session.unconditioned_zones,
+                                               is_initial_record=True,
+                                               output_step=output_step,
+                                               events=record_events)
+                           for cosim_session, output_step in zip(cosim_group.cosim_sessions, list_output_step)]
+            list_kpi = [create_kpi(cosim_session) for cosim_session in cosim_group.cosim_sessions]
+            for reporter in list_reporter:
+                reporter.set_state(STATE_RUNNING)
+
+            # Run part (2): Run the simulations
+            progress = ProgressLogger(logger, steps_total=int(np.floor(float(steps_to_proceed))),
+                                      every_steps=progress_every_steps, every_seconds=progress_every_seconds)
+            if profile_on_signal:
+                install_signal_handler()
+            session_profiler = SessionProfiler(alias=f'Group{index_group + 1}',
+                                               dir_output=dir_output,
+                                               step_start=profile_sessions.get(f'Group{index_group + 1}'),
+                                               steps_window=profile_steps,
+                                               interval_seconds=profile_interval_seconds,
+                                               logger=logger)
+            concurrency_slot = ConcurrencySlot(concurrency_limiter, f'Group{index_group + 1}', window_steps=concurrency_window_steps, logger=logger)
+            with session_profiler, concurrency_slot:
+                for index_step in range(int(np.floor(float(steps_to_proceed)))):
+                    session_profiler.on_step(index_step)
+                    list_control_input, list_control_information = \
+                        cosim_group.compute_control(control_mode=current_control_mode,
+                                                    list_output_step=list_output_step,
+                                                    setpoints_manual=setpoint_manual_test,
+                                                    schedule_info=None)
+
+                    cosim_group.proceed_simulation(list_control_input=list_control_input)
+
+                    list_output_step = cosim_group.retrieve_outputs(list_control_information=list_control_information)
+                    for cosim_session, output_step, record_each, kpi in zip(cosim_group.cosim_sessions, list_output_step, list_record, list_kpi):
+                        update_record(output_step=output_step,
+                                      record=record_each,
+                                      conditioned_zones=cosim_session.conditioned_zones,
+                                      unconditioned_zones=cosim_session.unconditioned_zones,
+                                      kpi=kpi)
+                    progress.update(index_step + 1, list_output_step[0][DATA.TIME_SIM])
+                    for reporter, kpi in zip(list_reporter, list_kpi):
+                        reporter.update(index_step + 1, list_output_step[0][DATA.TIME_SIM], kpi=kpi)
+                    concurrency_slot.step()
+                    session_governor.on_step()
+
+            # Export the simulation results
+            for reporter in list_reporter:
+                reporter.set_state(STATE_EXPORTING)
+            for cosim_session, record_each, kpi, fingerprint in zip(cosim_group.cosim_sessions, list_record, list_kpi, list_fingerprint):
+                export_record(cosim_session, record_each, get_logger(cosim_session.alias), kpi=kpi, fingerprint=fingerprint)
+        finally:
+            # Tear down, also when a session fails: the retry of the group starts with new sites
+            logger.info('Tearing down the models...')
+            cosim_group.tear_down()
+            logger.info('Tear down complete!')
+    finally:
+        session_governor.stop()
     return
 
 
@@ -114,27 +324,73 @@ if __name__ == "__main__":
         dir_workspace = os.path.dirname(os.path.dirname(__file__))
         name_output_dir = 'ip_op/output'
         dir_output = os.path.join(dir_workspace, name_output_dir)    
-    dir_output_log_filename = os.path.join(dir_output, "logfile_{}.log".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
-    
-    
-    # Create a logger that writes to the console and a log file
-    sys.stdout = Logger(dir_output_log_filename)
-    
-    # This alfalfa_url is used to test locally
-    if local_test:
-        alfalfa_url = 'http://localhost'
+    dir_output_log_filename = os.path.join(dir_output, "logfile_{}.jsonl".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
 
-    # Otherwise, resolve the IP address of another container by its name
-    else:
-        web_ip_address = socket.gethostbyname('web')
-        alfalfa_url = 'http://' + web_ip_address + ':80' 
+    ## Logging settings (see CoSimLogging.py)
+    # Every process sends its records to a single writer process, which writes the log file (JSON lines) and the console
+    log_level_default = 'INFO'          # level of every session: 'DEBUG' also logs every control decision
+    log_levels_session = {}             # level of specific sessions, by alias (e.g., {'Model_0': 'DEBUG'})
+    progress_every_steps = 1440         # progress lines are logged every n steps...
+    progress_every_seconds = 60.0       # ...or every n seconds, whichever comes first
+    log_queue, log_process = start_log_writer(dir_output_log_filename, console_level='INFO')
+    logger = get_logger('main')
+
+    ## Run monitor settings (see CoSimMonitor.py)
+    # Status of every session (sim time, steps done, steps/s, ETA, retries, last error), served at http://<host>:<port>/ (HTML)
+    # and /status.json, and rewritten to a JSON status file, so that slow or stalled sessions can be spotted early
+    monitor_host = '0.0.0.0' if not local_test else '127.0.0.1'
+    monitor_port = 8051                 # None: no HTTP status page
+    monitor_interval_seconds = 10.0     # period of the status file
+    monitor_stall_seconds = 300.0       # sessions without report for this period are flagged as stalled
+    max_retries_session = 1             # a failed session (or group) is restarted up to n times
+    monitor = RunMonitor(path_status=os.path.join(dir_output, "status_{}.json".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))),
+                         host=monitor_host,
+                         port=monitor_port,
+                         interval_seconds=monitor_interval_seconds,
+                         stall_seconds=monitor_stall_seconds).start()
+    if monitor_port is not None:
+        logger.info(f'Run monitor: http://{monitor_host}:{monitor_port}/')
     
+    ## Simulation backend (see CoSimBackend.py)
+    # 'alfalfa': EnergyPlus models on Alfalfa / 'surrogate': saved surrogate model (see CoSimSurrogate.py) / 'trace': playback of a results file
+    simulation_backend = 'alfalfa'
+    path_surrogate_model = None     # used by 'surrogate'
+    path_trace = None               # used by 'trace'
 
-    try:
-        page = requests.get(alfalfa_url, timeout=1)
-        print(f'Connection: ESTABLISHED --> alfalfa_url: {alfalfa_url}')
-    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError):
-        print(f'Connection: FAILED')
+    ## Pool of Alfalfa deployments (see CoSimEndpoints.py)
+    # If several URLs are given (e.g., several Alfalfa stacks side by side), each session is placed on one of them by `endpoint_policy`,
+    # and endpoints failing `endpoint_drain_failures` times in a row are drained (no new session) until a probe succeeds again
+    alfalfa_urls = None                 # e.g., ['http://web1:80', 'http://web2:80']
+    endpoint_policy = 'least_loaded'    # 'least_loaded' or 'consistent_hash'
+    endpoint_probe_seconds = 30.0       # period of the health probes
+    endpoint_drain_failures = 3
+    endpoint_drain_seconds = 300.0      # minimum time before a drained endpoint is probed back
+
+    alfalfa_url = None
+    endpoint_monitor = None
+    if simulation_backend == 'alfalfa' and alfalfa_urls:
+        endpoint_monitor = EndpointMonitor(alfalfa_urls,
+                                           policy=endpoint_policy,
+                                           probe_seconds=endpoint_probe_seconds,
+                                           drain_failures=endpoint_drain_failures,
+                                           drain_seconds=endpoint_drain_seconds).start()
+        for url, state in endpoint_monitor.pool.snapshot().items():
+            logger.info(f"Endpoint: {url} (latency: {state['latency_ewma']}, failures: {state['failures']})", extra={'endpoint': url})
+    elif simulation_backend == 'alfalfa':
+        # This alfalfa_url is used to test locally
+        if local_test:
+            alfalfa_url = 'http://localhost'
+
+        # Otherwise, resolve the IP address of another container by its name
+        else:
+            web_ip_address = socket.gethostbyname('web')
+            alfalfa_url = 'http://' + web_ip_address + ':80' 
+
+        try:
+            page = requests.get(alfalfa_url, timeout=1)
+            logger.info(f'Connection: ESTABLISHED --> alfalfa_url: {alfalfa_url}')
+        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError):
+            logger.error(f'Connection: FAILED --> alfalfa_url: {alfalfa_url}')
 
     ## Simulation settings
     debug = True                # set this True to print additional information to the console
@@ -150,6 +406,22 @@ if __name__ == "__main__":
     #current_control_mode = CONTROL.PASSTHROUGH
     #current_control_mode = CONTROL.SETPOINTS
 
+    # Open-loop fast-forward (see CoSimCore.fast_forward())
+    steps_warm_up = 0                   # steps fast-forwarded before recording starts
+    fast_forward_output_interval = 1    # outputs recorded every n steps, when the control mode is fast-forwarded (CONTROL.PASSTHROUGH)
+
+    # Results files (see CoSimStorage.py)
+    result_codec = 'zstd'               # among 'zstd', 'lz4', 'snappy', 'gzip'
+    result_row_group_size = 131072      # rows per row group
+    result_float32_sensors = False      # if True, sensor channels are stored as float32
+    # If True, setpoints, deadbands, thermostat schedule/mode and occupant flags are recorded as change events (see CoSimEvents.py),
+    # written to '<results file>_events.parquet' instead of one value per step (read_results() expands them)
+    record_events = True
+
+    # Event-driven adaptive stepping (see CoSimStepping.AdaptiveStepPolicy)
+    adaptive_stepping = False           # if True, several steps are advanced per control decision while the controller is quiescent
+    max_steps_per_decision = 15
+
     # Manual setpoints, if CONTROL.SETPOINTS is chosen
     setpoint_manual_test = {DATA.HEATING_SETPOINT_NEW: 20,
                             DATA.HEATING_SETPOINT_DEADBAND_UP: 1.5,
@@ -172,7 +444,84 @@ if __name__ == "__main__":
     num_models = 30 # Total number of tasks to be done
     num_parallel_process = 10 # Tasks to be done simultaneously
 
-    print(f"Running {num_models} models with {num_parallel_process} parallel processes")
+    # Concurrency of the sessions (see CoSimTuner.py)
+    # Calibration of the deployment, e.g., 'python CoSimTuner.py --host http://localhost --model <building model> --output <file>':
+    # if given, num_parallel_process is the concurrency recommended by the calibration file (highest throughput within the latency limit)
+    concurrency_calibration = None      # e.g., os.path.join(dir_output, 'concurrency_calibration.json')
+    # If True, the sessions stepping at once are limited at runtime: the limit is decreased when the step latency degrades
+    # (above the latency target of the calibration, or twice the lowest latency), and increased back up to num_parallel_process
+    adaptive_concurrency = False
+    concurrency_window_steps = 60       # steps per latency window of a session
+    concurrency_cooldown_seconds = 60.0 # minimum time between two changes of the limit
+    calibration = read_calibration(concurrency_calibration) if concurrency_calibration is not None else None
+    if calibration is not None:
+        num_parallel_process = calibration['recommended']
+        logger.info(f"Concurrency calibrated: {num_parallel_process} (p95 latency target: {calibration['latency_target']} s)",
+                    extra={'calibration': calibration['results']})
+    concurrency_controller = ConcurrencyController(num_parallel_process,
+                                                   latency_target=calibration['latency_target'] if calibration is not None else None,
+                                                   cooldown_seconds=concurrency_cooldown_seconds) if adaptive_concurrency else None
+    concurrency_limiter = concurrency_controller.limiter if concurrency_controller is not None else None
+
+    # Resources of the session workers (see CoSimGovernor.py): each worker gets a share of the BLAS/OpenMP threads of the host, so that
+    # the workers do not oversubscribe the cores, and its CPU and memory usage is reported to the run monitor
+    govern_resources = True
+    worker_threads = None               # threads per worker (cores available / num_parallel_process if None)
+    worker_pin_cpus = False             # if True, each worker runs on its own set of `worker_threads` cores
+    worker_memory_limit_gb = None       # address space ceiling of each worker (RLIMIT_AS; includes reserved memory, so keep a margin)
+    resource_sample_seconds = 30.0      # period of the usage samples
+    resource_governor = ResourceGovernor(num_parallel_process,
+                                         threads_per_worker=worker_threads,
+                                         pin_cpus=worker_pin_cpus,
+                                         memory_limit_gb=worker_memory_limit_gb,
+                                         sample_seconds=resource_sample_seconds) if govern_resources else None
+    resource_budget = resource_governor.budget if resource_governor is not None else None
+    if resource_governor is not None:
+        logger.info(f'Threads per worker: {resource_governor.threads_per_worker}')
+
+    # Number of homes stepped by a single occupant model (each home is still simulated by its own Alfalfa site)
+    # If > 1, each parallel task is a group of homes: e.g., 'num_models == 30' and 'num_homes_per_group == 10' --> 3 groups
+    num_homes_per_group = 1
+
+    # Profiling (see CoSimProfiler.py): collapsed stacks of a window of steps written to '<alias>_profile_<steps>.collapsed'
+    profile_sessions = {}               # first step profiled, by alias (e.g., {'Model1: green_husky_v96': 0} or {'Group1': 0})
+    profile_on_signal = True            # if True, `kill -USR1 <pid>` profiles the next window of the sessions of a process (pid in the log)
+    profile_steps = 1440                # steps per window
+    profile_interval_seconds = 0.005    # sampling period
+
+    # Result cache (see CoSimCache.py): runs with the same fingerprint (building model files, settings, occupant model files,
+    # control settings, replicate index and code version) as a cached results file are not simulated again
+    use_result_cache = True
+    result_cache_max_age_days = None    # cached results unused for n days are evicted (never if None)
+    result_cache_max_size_gb = None     # least recently used results are evicted beyond this total size (never if None)
+    result_cache = ResultCache(os.path.join(dir_output, 'result_cache.sqlite'),
+                               max_age_days=result_cache_max_age_days,
+                               max_size_gb=result_cache_max_size_gb) if use_result_cache else None
+    if result_cache is not None:
+        evicted = result_cache.evict()
+        if evicted:
+            logger.info(f'{len(evicted)} cached results evicted', extra={'paths': evicted})
+
+    # Horizon partitioning (see CoSimPartition.py)
+    # If set, the horizon of each model is split into segments simulated in parallel, each one starting `segment_overlap_steps` before
+    # its first recorded step, and the segments are stitched into one results file with a report of the discontinuities at the boundaries
+    horizon_segments = None             # e.g., 'monthly', 'weekly' or a number of segments of equal length
+    segment_overlap_steps = 1440 * 7    # warm-up of each segment (except the first one)
+    segment_seeding = 'warm_up'         # 'warm_up' (closed-loop), 'steady_state' (open-loop, initial occupant/thermostat state) or 'prepass'
+    segment_prepass_surrogate_model = None  # 'prepass': surrogate model (see CoSimSurrogate.py) of the coarse pre-pass (same backend if None)
+
+    # Distributed batch run (see CoSimDistributed.py)
+    # If set, the sessions are published as jobs to this queue and run by workers on any node, instead of the local processes:
+    #   python CoSimDistributed.py worker --queue <distributed_queue_url> --dir-results <dir_output>
+    distributed_queue_url = None        # e.g., 'sqlite:////shared/cosim_jobs.sqlite' (on a volume shared by the nodes)
+    distributed_poll_seconds = 30.0     # period of the status checks of the coordinator
+
+    # Session manifest (see CoSimManifest.py): the sites of the sessions are recorded in this folder, so that after a restart of this
+    # script (e.g., killed), the sites which were not advanced yet are reattached instead of submitted and warmed up again, and the sites
+    # left running by the previous run are stopped (those of other orchestrators sharing the folder are left running)
+    path_session_manifest = os.path.join(dir_output, 'session_manifest') if distributed_queue_url is None else None
+
+    logger.info(f"Running {num_models} models with {num_parallel_process} parallel processes")
     ## Create building model information: pair of 'model_name' and 'conditioned_zone_name'
     # model_name: location of the building model, under 'idf_files' folder
     # conditioned_zone_names: list of the names of conditioned zone (Note: not tested with multi-zone case)
@@ -212,11 +561,16 @@ if __name__ == "__main__":
         # building model and simulation information
         building_model_information = {
             SETTING.ALFALFA_URL: alfalfa_url,
+            SETTING.ENDPOINT_POOL: endpoint_monitor.pool if endpoint_monitor is not None else None,
+            SETTING.BACKEND: simulation_backend,
+            SETTING.PATH_SURROGATE_MODEL: path_surrogate_model,
+            SETTING.PATH_TRACE: path_trace,
             SETTING.NAME_BUILDING_MODEL: model_name,
             SETTING.PATH_BUILDING_MODEL: os.path.join('ip_op', 'idf_files', model_name) if not local_test else \
                                          os.path.join(dir_ipop, 'idf_files', model_name),
             SETTING.CONDITIONED_ZONES: conditioned_zones,
             SETTING.UNCONDITIONED_ZONES: unconditioned_zones,
+            SETTING.PATH_SESSION_MANIFEST: path_session_manifest,
         }
         simulation_information = {
             SETTING.TIME_START: time_start,
@@ -254,16 +608,106 @@ if __name__ == "__main__":
                            })
     
 
-    if num_parallel_process > 1:
-        Parallel(n_jobs=num_parallel_process)\
-                (delayed(run_each_session)\
-                        (index_input, input_each, steps_to_run) for (index_input, input_each) in enumerate(list_input))
-    else:
-        for index_input, input_each in enumerate(list_input):
-            run_each_session(index_input=index_input,
-                             input_each=input_each,
-                             steps_to_proceed=steps_to_run)
+    if path_session_manifest is not None:
+        for entry in reap_orphaned_sites(path_session_manifest, [get_alias(index_input, input_each) for index_input, input_each in enumerate(list_input)]):
+            logger.info(f"Orphaned site stopped: {entry['site_id']} ({entry['alias']})", extra={'entry': entry})
+
+    # One reporter per session (per segment for partitioned runs)
+    list_reporter = [monitor.reporter(get_alias(index_input, input_each), steps_total=steps_to_run)
+                     for (index_input, input_each) in enumerate(list_input)] if horizon_segments is None or distributed_queue_url is not None else None
+
+    with resource_governor.parallel_backend() if resource_governor is not None else contextlib.nullcontext():
+        if distributed_queue_url is not None:
+            coordinator = Coordinator(get_job_queue(distributed_queue_url), logger=logger)
+            # Runs already done with the same settings are not published again (see lookup_result())
+            list_task = []
+            for (index_input, input_each), reporter in zip(enumerate(list_input), list_reporter):
+                fingerprint, path_cached = lookup_result(index_input, input_each, steps_to_run)
+                if path_cached is not None:
+                    logger.info(f'Cached result: {path_cached}', extra={'path': path_cached, 'fingerprint': fingerprint})
+                    reporter.update(int(np.floor(float(steps_to_run))))
+                    reporter.record_done()
+                else:
+                    list_task.append((index_input, input_each, fingerprint, reporter))
+            list_job_id = coordinator.publish([create_job_spec(alias=get_alias(index_input, input_each),
+                                                               input_each=input_each,
+                                                               steps=steps_to_run,
+                                                               control_mode=current_control_mode,
+                                                               setpoints_manual=setpoint_manual_test,
+                                                               steps_warm_up=steps_warm_up,
+                                                               fast_forward_output_interval=fast_forward_output_interval,
+                                                               max_steps_per_decision=max_steps_per_decision if adaptive_stepping else None,
+                                                               fingerprint=fingerprint,
+                                                               result_codec=result_codec,
+                                                               result_row_group_size=result_row_group_size,
+                                                               result_float32_sensors=result_float32_sensors,
+                                                               record_events=record_events,
+                                                               progress_every_steps=progress_every_steps,
+                                                               progress_every_seconds=progress_every_seconds,
+                                                               profile_step_start=profile_sessions.get(get_alias(index_input, input_each)),
+                                                               profile_steps=profile_steps,
+                                                               profile_interval_seconds=profile_interval_seconds)
+                                               for index_input, input_each, fingerprint, _ in list_task])
+            results = coordinator.wait(list_job_id, poll_seconds=distributed_poll_seconds,
+                                       reporters={job_id: reporter for job_id, (_, _, _, reporter) in zip(list_job_id, list_task)})
+            if result_cache is not None:
+                for job_id, (index_input, input_each, fingerprint, _) in zip(list_job_id, list_task):
+                    if job_id in results:
+                        result_cache.store(fingerprint, results[job_id]['path_results'], description={'alias': get_alias(index_input, input_each)})
+            logger.info(f'{len(results)}/{len(list_job_id)} jobs done', extra={'results': results})
+        elif horizon_segments is not None:
+            list_segment = partition_horizon(time_start, time_start + datetime.timedelta(minutes=time_step_size * steps_to_run),
+                                             segments=horizon_segments,
+                                             steps_overlap=segment_overlap_steps,
+                                             time_step_size=time_step_size)
+            logger.info(f'Horizon split into {len(list_segment)} segments ({segment_seeding} seeding)', extra={'segments': list_segment})
+            if segment_seeding == SEEDING_PREPASS:
+                list_paths_seed = Parallel(n_jobs=min(num_parallel_process, len(list_input)))\
+                                          (delayed(run_prepass_each)(index_input, input_each, list_segment)
+                                           for (index_input, input_each) in enumerate(list_input))
+            else:
+                list_paths_seed = [dict() for _ in list_input]
+            list_task = [(index_input, input_each, {**segment, 'path_seed': paths_seed.get(segment['index'])})
+                         for (index_input, input_each), paths_seed in zip(enumerate(list_input), list_paths_seed) for segment in list_segment]
+            list_reporter = [monitor.reporter(get_segment_alias(get_alias(index_input, input_each), segment),
+                                              steps_total=get_segment_steps(segment, segment_seeding)[1])
+                             for index_input, input_each, segment in list_task]
+            list_path_results = Parallel(n_jobs=num_parallel_process)\
+                                        (delayed(run_with_retries)\
+                                                (run_each_session, (index_input, input_each, get_segment_steps(segment, segment_seeding)[1]), [reporter],
+                                                 get_segment_alias(get_alias(index_input, input_each), segment), segment=segment)
+                                         for (index_input, input_each, segment), reporter in zip(list_task, list_reporter))
+            for index_input, input_each in enumerate(list_input):
+                stitch_each(index_input, input_each, list_segment,
+                            list_path_results[index_input * len(list_segment):(index_input + 1) * len(list_segment)])
+        elif num_homes_per_group > 1:
+            list_input_indexed = list(enumerate(list_input))
+            list_group = [list_input_indexed[index:index + num_homes_per_group] for index in range(0, len(list_input_indexed), num_homes_per_group)]
+            Parallel(n_jobs=min(num_parallel_process, len(list_group)))\
+                    (delayed(run_with_retries)\
+                            (run_each_group, (index_group, list_input_group, steps_to_run),
+                             [list_reporter[index_input] for index_input, _ in list_input_group], f'Group{index_group + 1}')
+                     for (index_group, list_input_group) in enumerate(list_group))
+        elif num_parallel_process > 1:
+            Parallel(n_jobs=num_parallel_process)\
+                    (delayed(run_with_retries)\
+                            (run_each_session, (index_input, input_each, steps_to_run), [list_reporter[index_input]], get_alias(index_input, input_each))
+                     for (index_input, input_each) in enumerate(list_input))
+        else:
+            for index_input, input_each in enumerate(list_input):
+                run_with_retries(run=run_each_session,
+                                 args=(index_input, input_each, steps_to_run),
+                                 list_reporter=[list_reporter[index_input]],
+                                 alias=get_alias(index_input, input_each))
 
-    print("\n\n=Every simulation terminated!")
     stop = timeit.default_timer()
-    print(f'\t--> Total Time: {stop - start} seconds')
+    logger.info(f'Every simulation terminated! Total Time: {stop - start} seconds', extra={'time_total': stop - start})
+    if endpoint_monitor is not None:
+        logger.info('Endpoints at the end of the run', extra={'endpoints': endpoint_monitor.pool.snapshot()})
+        endpoint_monitor.stop()
+    if concurrency_controller is not None:
+        logger.info('Concurrency at the end of the run', extra={'concurrency': concurrency_controller.stop()})
+    if resource_governor is not None:
+        resource_governor.stop()
+    monitor.stop()
+    stop_log_writer(log_queue, log_process)
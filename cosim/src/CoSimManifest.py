@@ -0,0 +1,129 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+
+from CoSimBackend import create_backend
+from CoSimCache import hash_path, normalize_setting
+from CoSimGovernor import is_running
+
+# Minimum interval between the updates of the simulation time of a session in its manifest (see CoSimCore.retrieve_outputs())
+MANIFEST_UPDATE_SECONDS = 10.0
+# Status of a site which can be reattached (started with the external clock, waiting for advance requests)
+STATUS_REATTACHABLE = ['running']
+# Entries not updated for this period are orphaned, whatever their owner (e.g., orchestrator of another host which died)
+MANIFEST_STALE_SECONDS = 24 * 3600.0
+
+
+def get_config_hash(backend_name, model_path, time_start, time_end, time_step_size, time_scale, external_clock):
+    # Hash of the configuration of a site: a site is only reattached by a session with the same building model and simulation settings
+    config = {'backend': backend_name,
+              'model': hash_path(model_path),
+              'simulation': normalize_setting(None, [time_start, time_end, time_step_size, time_scale, external_clock])}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class SessionManifest:
+    """
+    Sites submitted by the sessions of an orchestrator (GUI or main script), one JSON file per alias in `dir_manifest`:
+    alias, backend, host, site id, simulation time, configuration hash and owner (host name and pid).
+    After a restart, CoSimCore.initialize() reattaches to the site of its alias instead of submitting and warming up the model again,
+    and reap_orphaned_sites() stops the sites of the aliases which are not used anymore.
+    """
+    def __init__(self, dir_manifest):
+        self.dir_manifest = dir_manifest
+        os.makedirs(dir_manifest, exist_ok=True)
+
+    def get_path(self, alias):
+        # Aliases such as 'Model1: green_husky' are not valid file names on every platform
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', alias)
+        return os.path.join(self.dir_manifest, name + '_' + hashlib.sha1(alias.encode()).hexdigest()[:8] + '.json')
+
+    def read(self, alias):
+        try:
+            with open(self.get_path(alias)) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write(self, alias, backend_name, host, site_id, time_sim, config_hash):
+        entry = {'alias': alias,
+                 'backend': backend_name,
+                 'host': host,
+                 'site_id': site_id,
+                 'time_sim': str(time_sim),
+                 'config_hash': config_hash,
+                 'owner': get_owner(),
+                 'time_updated': time.time()}
+        path = self.get_path(alias)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(entry, file, default=str)
+        os.replace(path + '.tmp', path)
+        return entry
+
+    def remove(self, alias):
+        try:
+            os.remove(self.get_path(alias))
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        list_entry = []
+        for path in sorted(glob.glob(os.path.join(self.dir_manifest, '*.json'))):
+            try:
+                with open(path) as file:
+                    list_entry.append(json.load(file))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return list_entry
+
+
+def get_owner():
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+def is_orphaned(entry, stale_seconds=MANIFEST_STALE_SECONDS):
+    # Entry written by a process of this host which is not running anymore (or by this process), or not updated for `stale_seconds`
+    if time.time() - float(entry.get('time_updated') or 0.0) > stale_seconds:
+        return True
+    host, _, pid = str(entry.get('owner') or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        # Owner on another host: running or not, it cannot be checked from here
+        return False
+    return int(pid) == os.getpid() or not is_running(int(pid))
+
+
+def stop_site(entry, debug=False):
+    # Stop the site of a manifest entry (e.g., left running by an orchestrator which died), so that it does not keep a worker of Alfalfa
+    try:
+        backend = create_backend(entry['backend'], host=entry['host'])
+        if backend.in_process:
+            # Sites of in-process backends do not survive their process
+            return False
+        backend.stop(entry['site_id'])
+    except Exception as e:
+        if debug: print(f"[{entry['alias']}] Could not stop site {entry['site_id']} at {entry['host']}: {e}")
+        return False
+    if debug: print(f"[{entry['alias']}] Stopped site {entry['site_id']} at {entry['host']}")
+    return True
+
+
+def reap_orphaned_sites(dir_manifest, aliases_owned, stale_seconds=MANIFEST_STALE_SECONDS, debug=False):
+    """
+    Stop the orphaned sites of the manifest (see is_orphaned()) whose alias is not among `aliases_owned` (sessions of this orchestrator),
+    and remove their entries. The sites of other orchestrators sharing the manifest folder are left running, and the sites of the
+    owned aliases are left to CoSimCore.initialize(), which reattaches to them or replaces them.
+    :return: list of the reaped entries
+    """
+    manifest = SessionManifest(dir_manifest)
+    list_reaped = []
+    for entry in manifest.entries():
+        if entry['alias'] in aliases_owned or not is_orphaned(entry, stale_seconds):
+            continue
+        stop_site(entry, debug=debug)
+        manifest.remove(entry['alias'])
+        list_reaped.append(entry)
+    return list_reaped
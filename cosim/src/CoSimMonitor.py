@@ -0,0 +1,236 @@
+import collections
+import html
+import json
+import multiprocessing
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# States of a session reported to the monitor
+STATE_PENDING = 'pending'
+STATE_INITIALIZING = 'initializing'
+STATE_RUNNING = 'running'
+STATE_EXPORTING = 'exporting'
+STATE_RETRYING = 'retrying'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+class MonitorReporter:
+    """
+    Reports the progress of one session to the RunMonitor of the orchestrator.
+    It can be sent to joblib workers: updates are computed locally and pushed to the shared status every `every_seconds`,
+    so that calling update() at every step does not add a round trip to the step loop.
+    """
+    def __init__(self, sessions, alias, steps_total=None, every_seconds=5.0, window_seconds=60.0):
+        self.sessions = sessions    # dictionary shared by the monitor (multiprocessing.Manager().dict())
+        self.alias = alias
+        self.steps_total = steps_total
+        self.every_seconds = every_seconds
+        self.window_seconds = window_seconds
+        self.status = {'alias': alias,
+                       'state': STATE_PENDING,
+                       'steps_done': 0,
+                       'steps_total': steps_total,
+                       'time_sim': None,
+                       'steps_per_second': None,
+                       'eta_seconds': None,
+                       'retries': 0,
+                       'last_error': None,
+                       'time_started': None,
+                       'time_updated': time.time(),
+                       'kpi': None,
+                       'resources': None}
+        self.samples = collections.deque()  # (monotonic time, steps_done) within the rolling window
+        self.time_pushed = 0.0
+
+    def push(self):
+        self.status['time_updated'] = time.time()
+        self.sessions[self.alias] = dict(self.status)
+        self.time_pushed = time.monotonic()
+
+    def set_state(self, state):
+        if state == STATE_INITIALIZING and self.status['time_started'] is None:
+            self.status['time_started'] = time.time()
+        if state == STATE_RUNNING:
+            self.samples.clear()
+        self.status['state'] = state
+        self.push()
+
+    def update(self, steps_done, time_sim=None, kpi=None):
+        # Rolling steps/second over the last `window_seconds`
+        # kpi: streaming KPIs of the session (see CoSimKPI.KPIAccumulator), whose totals are pushed with the status
+        now = time.monotonic()
+        self.samples.append((now, steps_done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+        self.status['steps_done'] = steps_done
+        if time_sim is not None:
+            self.status['time_sim'] = str(time_sim)
+        if now - self.time_pushed < self.every_seconds:
+            return
+
+        (time_first, steps_first) = self.samples[0]
+        if now > time_first and steps_done > steps_first:
+            steps_per_second = (steps_done - steps_first) / (now - time_first)
+            self.status['steps_per_second'] = steps_per_second
+            if self.steps_total:
+                self.status['eta_seconds'] = max(self.steps_total - steps_done, 0) / steps_per_second
+        if kpi is not None:
+            self.status['kpi'] = kpi.totals()
+        self.push()
+
+    def record_resources(self, usage):
+        # CPU and memory usage of the worker of the session (see CoSimGovernor.SessionGovernor), pushed with the next update
+        self.status['resources'] = usage
+
+    def record_retry(self, error):
+        self.status['retries'] += 1
+        self.status['last_error'] = repr(error)
+        self.set_state(STATE_RETRYING)
+
+    def record_failure(self, error):
+        self.status['last_error'] = repr(error)
+        self.set_state(STATE_FAILED)
+
+    def record_done(self):
+        self.status['eta_seconds'] = 0
+        self.set_state(STATE_DONE)
+
+
+class RunMonitor:
+    """
+    Status of every session of a batch run: simulation time, steps done, rolling steps/second, ETA, retry counts and last error.
+    The status is served as JSON (/status.json) and HTML (/) on a local HTTP port, and periodically rewritten to a JSON file.
+    Sessions are flagged as stalled when they have not reported for `stall_seconds`.
+    """
+    def __init__(self,
+                 path_status=None,
+                 host='127.0.0.1',
+                 port=None,
+                 interval_seconds=10.0,
+                 stall_seconds=300.0):
+        # path_status: path of the status file (not written if None)
+        # port: port of the HTTP status page (not served if None)
+        self.path_status = path_status
+        self.host = host
+        self.port = port
+        self.interval_seconds = interval_seconds
+        self.stall_seconds = stall_seconds
+        self.manager = multiprocessing.Manager()
+        self.sessions = self.manager.dict()
+        self.time_started = time.time()
+        self.server = None
+        self.thread_writer = None
+        self.event_stop = threading.Event()
+
+    def reporter(self, alias, steps_total=None, every_seconds=5.0):
+        reporter = MonitorReporter(self.sessions, alias, steps_total=steps_total, every_seconds=every_seconds)
+        reporter.push()
+        return reporter
+
+    def snapshot(self):
+        now = time.time()
+        sessions = [dict(status) for status in self.sessions.values()]
+        for status in sessions:
+            status['stalled'] = status['state'] in [STATE_INITIALIZING, STATE_RUNNING] and \
+                                now - status['time_updated'] > self.stall_seconds
+            status['seconds_since_update'] = now - status['time_updated']
+        running = [status for status in sessions if status['state'] == STATE_RUNNING]
+        eta = [status['eta_seconds'] for status in running if status['eta_seconds'] is not None]
+        return {'time': now,
+                'time_elapsed': now - self.time_started,
+                'num_sessions': len(sessions),
+                'num_done': sum(status['state'] == STATE_DONE for status in sessions),
+                'num_failed': sum(status['state'] == STATE_FAILED for status in sessions),
+                'num_stalled': sum(status['stalled'] for status in sessions),
+                'steps_per_second': sum(status['steps_per_second'] or 0 for status in running),
+                'eta_seconds_running': max(eta) if eta else None,
+                'sessions': sorted(sessions, key=lambda status: status['alias'])}
+
+    def write_status(self):
+        # Written to a temporary file first, so that readers never see a partial file
+        path_temporary = self.path_status + '.tmp'
+        with open(path_temporary, 'w') as file:
+            json.dump(self.snapshot(), file, indent=1, default=str)
+        os.replace(path_temporary, self.path_status)
+
+    def run_writer(self):
+        while not self.event_stop.wait(self.interval_seconds):
+            self.write_status()
+
+    def start(self):
+        if self.path_status is not None:
+            self.thread_writer = threading.Thread(target=self.run_writer, daemon=True)
+            self.thread_writer.start()
+        if self.port is not None:
+            self.server = ThreadingHTTPServer((self.host, self.port), get_request_handler(self))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.event_stop.set()
+        if self.thread_writer is not None:
+            self.thread_writer.join()
+        if self.path_status is not None:
+            self.write_status()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.manager.shutdown()
+        return
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return str(int(seconds) // 3600) + 'h ' + str(int(seconds) % 3600 // 60).zfill(2) + 'm ' + str(int(seconds) % 60).zfill(2) + 's'
+
+
+def render_status_html(snapshot, refresh_seconds=10):
+    columns = ['alias', 'state', 'time_sim', 'steps_done', 'steps_total', 'steps_per_second', 'eta', 'hvac_energy_kwh', 'overrides',
+               'cpu_percent', 'rss_mb', 'retries', 'last_error', 'seconds_since_update']
+    rows = []
+    for status in snapshot['sessions']:
+        kpi = status.get('kpi') or {}
+        resources = status.get('resources') or {}
+        status = {**status,
+                  'hvac_energy_kwh': f"{kpi['HVAC Energy [kWh]']:.1f}" if kpi else '-',
+                  'overrides': kpi['Habitual Overrides [steps]'] + kpi['Discomfort Overrides [steps]'] if kpi else '-',
+                  'cpu_percent': f"{resources['cpu_percent']:.0f}" if resources else '-',
+                  'rss_mb': f"{resources['rss_mb']:.0f}" if resources else '-',
+                  'eta': format_seconds(status['eta_seconds']),
+                  'steps_per_second': '-' if status['steps_per_second'] is None else f"{status['steps_per_second']:.1f}",
+                  'seconds_since_update': f"{status['seconds_since_update']:.0f}"}
+        style = ' style="background-color:#f8d7da"' if status['stalled'] or status['state'] == STATE_FAILED else ''
+        rows.append(f'<tr{style}>' + ''.join(f'<td>{html.escape(str(status[column]))}</td>' for column in columns) + '</tr>')
+    return (f'<html><head><meta http-equiv="refresh" content="{max(int(refresh_seconds), 1)}"><title>CoSim run monitor</title></head><body>'
+            f"<h3>{snapshot['num_done']}/{snapshot['num_sessions']} done, {snapshot['num_failed']} failed, {snapshot['num_stalled']} stalled"
+            f" / {snapshot['steps_per_second']:.1f} steps/s / elapsed: {format_seconds(snapshot['time_elapsed'])}"
+            f" / ETA of running sessions: {format_seconds(snapshot['eta_seconds_running'])}</h3>"
+            '<table border="1" cellpadding="3"><tr>' + ''.join(f'<th>{column}</th>' for column in columns) + '</tr>'
+            + ''.join(rows) + '</table></body></html>')
+
+
+def get_request_handler(monitor: RunMonitor):
+    class StatusRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/status.json'):
+                body, content_type = json.dumps(monitor.snapshot(), default=str), 'application/json'
+            elif self.path == '/' or self.path.startswith('/status.html'):
+                body, content_type = render_status_html(monitor.snapshot(), monitor.interval_seconds), 'text/html'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Requests are not logged to the console
+            return
+    return StatusRequestHandler
@@ -0,0 +1,174 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from CoSimDict import DATA, SETTING
+from CoSimStorage import read_results, write_results, get_events_path
+from CoSimEvents import split_events
+
+# Seeding of the state of a segment at the beginning of its overlap (warm-up period before the first recorded step)
+SEEDING_WARM_UP = 'warm_up'             # closed-loop warm-up: the overlap is simulated with the controller, and trimmed when stitching
+SEEDING_STEADY_STATE = 'steady_state'   # open-loop warm-up (fast-forwarded, not recorded), occupant and thermostat models start from their initial state
+SEEDING_PREPASS = 'prepass'             # as warm_up, with the occupant and thermostat models of a coarse pre-pass (e.g., surrogate) at the start of the overlap
+SEEDINGS = [SEEDING_WARM_UP, SEEDING_STEADY_STATE, SEEDING_PREPASS]
+
+# Boundaries of the segments by period
+SEGMENT_PERIODS = {'monthly': 'MS', 'weekly': 'W-MON', 'daily': 'D'}
+
+
+def partition_horizon(time_start, time_end, segments='monthly', steps_overlap=1440, time_step_size=1):
+    """
+    Split [time_start, time_end] into segments simulated independently (e.g., one per worker).
+    :param segments: period of the segments among SEGMENT_PERIODS, or number of segments of equal length
+    :param steps_overlap: steps simulated before the first recorded step of each segment (except the first one), to warm up its state
+    :return: list of segments: index, time_start (first recorded step), time_end (end of the recorded steps),
+             time_start_sim (start of the simulation, i.e., of the overlap), steps_overlap and steps_record
+    """
+    step = pd.Timedelta(minutes=time_step_size)
+    if isinstance(segments, str):
+        boundaries = [pd.Timestamp(time_start)] + \
+                     [time_boundary for time_boundary in pd.date_range(time_start, time_end, freq=SEGMENT_PERIODS[segments])
+                      if pd.Timestamp(time_start) < time_boundary < pd.Timestamp(time_end)] + [pd.Timestamp(time_end)]
+    else:
+        steps_total = int((pd.Timestamp(time_end) - pd.Timestamp(time_start)) / step)
+        boundaries = [pd.Timestamp(time_start) + step * int(round(steps_total * index / segments)) for index in range(int(segments) + 1)]
+        boundaries = sorted(set(boundaries))
+
+    list_segment = []
+    for index, (time_segment_start, time_segment_end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        time_start_sim = max(time_segment_start - step * steps_overlap, pd.Timestamp(time_start))
+        list_segment.append({'index': index,
+                             'num_segments': len(boundaries) - 1,
+                             'time_start': time_segment_start.to_pydatetime(),
+                             'time_end': time_segment_end.to_pydatetime(),
+                             'time_start_sim': time_start_sim.to_pydatetime(),
+                             'steps_overlap': int((time_segment_start - time_start_sim) / step),
+                             'steps_record': int((time_segment_end - time_segment_start) / step)})
+    return list_segment
+
+
+def get_segment_steps(segment, seeding=SEEDING_WARM_UP):
+    # (steps fast-forwarded before recording, steps simulated and recorded) of a segment
+    if seeding == SEEDING_STEADY_STATE:
+        return segment['steps_overlap'], segment['steps_record']
+    return 0, segment['steps_overlap'] + segment['steps_record']
+
+
+def get_segment_alias(alias, segment):
+    return alias + f" (segment {segment['index'] + 1}/{segment['num_segments']})"
+
+
+def get_segment_input(input_each, segment):
+    # Settings of a session starting at the beginning of the overlap of the segment (the other settings are shared)
+    return {**input_each,
+            SETTING.SIMULATION_INFORMATION: {**input_each[SETTING.SIMULATION_INFORMATION],
+                                             SETTING.TIME_START: segment['time_start_sim']},
+            SETTING.THERMOSTAT_MODEL_INFORMATION: {**input_each[SETTING.THERMOSTAT_MODEL_INFORMATION],
+                                                   SETTING.CURRENT_DATETIME: segment['time_start_sim']}}
+
+
+def run_prepass(cosim_session, list_segment, dir_seed, control_mode, setpoints_manual=None, schedule_info=None, logger=None):
+    """
+    Coarse pre-pass over the whole horizon with an initialized session (e.g., on the surrogate backend), saving the occupant and thermostat
+    models at the start of the simulation of each segment, so that the segments start from the state of a continuous run.
+    :return: dictionary of the paths of the seeds, by index of segment
+    """
+    os.makedirs(dir_seed, exist_ok=True)
+    times_seed = {segment['index']: segment['time_start_sim'] for segment in list_segment if segment['index'] > 0}
+    paths_seed = dict()
+    output_step = cosim_session.retrieve_outputs()
+    while times_seed:
+        time_sim = output_step[DATA.TIME_SIM]
+        for index, time_seed in list(times_seed.items()):
+            if time_sim >= time_seed:
+                paths_seed[index] = os.path.join(dir_seed, f'seed_{index}.pkl')
+                with open(paths_seed[index], 'wb') as file:
+                    pickle.dump({'occupant_model': cosim_session.o_occupant_model, 'thermostat_model': cosim_session.thermostat_model}, file)
+                del times_seed[index]
+                if logger is not None: logger.info(f'Seed of segment {index + 1} saved at {time_sim}', extra={'path': paths_seed[index]})
+        if not times_seed:
+            break
+        control_input, control_information = cosim_session.compute_control(time_sim=time_sim,
+                                                                           control_mode=control_mode,
+                                                                           setpoints_manual=setpoints_manual,
+                                                                           schedule_info=schedule_info,
+                                                                           output_step=output_step,
+                                                                           debug=False)
+        cosim_session.proceed_simulation(control_input=control_input, control_information=control_information)
+        output_step = cosim_session.retrieve_outputs(control_information=control_information)
+    return paths_seed
+
+
+def apply_seed(cosim_session, path_seed):
+    # Occupant and thermostat models of the pre-pass, replacing the models created by CoSimCore.initialize()
+    with open(path_seed, 'rb') as file:
+        seed = pickle.load(file)
+    cosim_session.o_occupant_model = seed['occupant_model']
+    cosim_session.thermostat_model = seed['thermostat_model']
+    return cosim_session
+
+
+def trim_segment(record_data, segment, last=False):
+    # Recorded steps of the segment only: [time_start, time_end), or [time_start, time_end] for the last segment
+    time_sim = pd.to_datetime(record_data[DATA.TIME_SIM])
+    mask = (time_sim >= segment['time_start']) & ((time_sim <= segment['time_end']) if last else (time_sim < segment['time_end']))
+    return record_data[mask.values]
+
+
+def get_boundary_report(list_record, list_segment, steps_compare=60, ratio_flagged=3.0):
+    """
+    Discontinuities of the continuous channels at the boundaries of the segments.
+    For each boundary and channel: jump between the last step of a segment and the first step of the next one, typical step-to-step
+    change in the segment before (99th percentile), their ratio, and the RMSE between the end of the overlap of the next segment and
+    the same steps of the segment before (how well the warm-up converged; None without recorded overlap).
+    """
+    list_row = []
+    for index in range(1, len(list_segment)):
+        record_before = list_record[index - 1]
+        record_after = list_record[index]
+        time_boundary = pd.Timestamp(list_segment[index]['time_start'])
+        time_before = pd.to_datetime(record_before[DATA.TIME_SIM])
+        time_after = pd.to_datetime(record_after[DATA.TIME_SIM])
+        rows_before = record_before[(time_before < time_boundary).values]
+        rows_after = record_after[(time_after >= time_boundary).values]
+        # Overlap of the segment after, compared with the same steps of the segment before
+        overlap_after = record_after[(time_after < time_boundary).values].set_index(DATA.TIME_SIM).tail(steps_compare)
+        overlap_before = rows_before.set_index(DATA.TIME_SIM).reindex(overlap_after.index)
+        if rows_before.empty or rows_after.empty:
+            continue
+        for column in record_before.columns:
+            if column == DATA.TIME_SIM or column not in record_after.columns or not pd.api.types.is_numeric_dtype(record_before[column]) \
+                    or pd.api.types.is_bool_dtype(record_before[column]):
+                continue
+            value_before = float(rows_before[column].iloc[-1])
+            value_after = float(rows_after[column].iloc[0])
+            jump = abs(value_after - value_before)
+            typical_step = float(np.nanpercentile(np.abs(np.diff(rows_before[column].to_numpy(dtype=float))), 99)) if len(rows_before) > 1 else np.nan
+            ratio = jump / typical_step if typical_step > 0 else (np.inf if jump > 0 else 0.0)
+            overlap_rmse = float(np.sqrt(np.nanmean((overlap_after[column].to_numpy(dtype=float) - overlap_before[column].to_numpy(dtype=float)) ** 2))) \
+                           if len(overlap_after) else None
+            list_row.append({'boundary': time_boundary, 'channel': column, 'value_before': value_before, 'value_after': value_after,
+                             'jump': jump, 'typical_step': typical_step, 'ratio': ratio, 'overlap_rmse': overlap_rmse,
+                             'flagged': bool(ratio > ratio_flagged)})
+    return pd.DataFrame(list_row)
+
+
+def stitch_segments(list_path_results, list_segment, path_output, codec='zstd', row_group_size=131072, float32_sensors=False, ratio_flagged=3.0):
+    """
+    Stitch the results files of the segments (in the order of list_segment) into one continuous results file, with the report of
+    the discontinuities at the boundaries written to '<path_output without extension>_boundaries.csv'.
+    If the segments have events files (see CoSimEvents.py), the stitched file has one too.
+    :return: (path of the stitched results, boundary report)
+    """
+    list_record = [read_results(path_results) for path_results in list_path_results]
+    report = get_boundary_report(list_record, list_segment, ratio_flagged=ratio_flagged)
+    record_data = pd.concat([trim_segment(record_data, segment, last=segment is list_segment[-1])
+                             for record_data, segment in zip(list_record, list_segment)], ignore_index=True)
+    events_data = None
+    if all(os.path.isfile(get_events_path(path_results)) for path_results in list_path_results):
+        record_data, events_data = split_events(record_data)
+    write_results(record_data, path_output, codec=codec, row_group_size=row_group_size, float32_sensors=float32_sensors, events=events_data)
+    report.to_csv(os.path.splitext(path_output)[0] + '_boundaries.csv', index=False)
+    return path_output, report
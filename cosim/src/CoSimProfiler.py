@@ -0,0 +1,147 @@
+import collections
+import os
+import signal
+import sys
+import threading
+
+# Profilers of the sessions of this process, armed by the signal handler (see install_signal_handler())
+_PROFILERS = []
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread samples the Python stack of the target thread every `interval_seconds`,
+    and counts the collapsed stacks ('file:function;file:function;... count', the input format of flamegraph.pl and speedscope).
+    """
+    def __init__(self, interval_seconds=0.005, thread_id=None):
+        self.interval_seconds = interval_seconds
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.event_stop = threading.Event()
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(os.path.basename(code.co_filename) + ':' + code.co_name)
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        while not self.event_stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[self.collapse(frame)] += 1
+            self.samples += 1
+
+    def start(self):
+        self.event_stop.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.event_stop.set()
+        self.thread.join()
+        return self
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(stack + ' ' + str(count) + '\n')
+        return path
+
+    def top_functions(self, num=10):
+        # Share of the samples per function on top of the stack (self time)
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [(function, count / max(self.samples, 1)) for function, count in leaves.most_common(num)]
+
+
+class SessionProfiler:
+    """
+    Profiling of a window of `steps_window` steps of a session, called at every step with on_step().
+    The window starts at `step_start` (from the settings) or at the next step after a request (SIGUSR1, see install_signal_handler()),
+    and the collapsed stacks are written to '<alias>_profile_<first step>-<last step>.collapsed' in `dir_output`.
+    When no window is pending, on_step() only checks two flags.
+    """
+    def __init__(self, alias, dir_output, step_start=None, steps_window=1440, interval_seconds=0.005, logger=None):
+        self.alias = alias
+        self.dir_output = dir_output
+        self.step_start = step_start
+        self.steps_window = steps_window
+        self.interval_seconds = interval_seconds
+        self.logger = logger
+        self.requested = False
+        self.profiler = None
+        self.step_first = None
+        self.step_last = None
+        self.list_path = []
+
+    def request(self):
+        # Profile the next window (called by the signal handler)
+        self.requested = True
+
+    def on_step(self, index_step):
+        if self.profiler is None:
+            if not self.requested and (self.step_start is None or index_step < self.step_start):
+                return
+            self.requested = False
+            self.step_start = None
+            self.step_first = self.step_last = index_step
+            self.profiler = SamplingProfiler(interval_seconds=self.interval_seconds).start()
+            if self.logger is not None:
+                self.logger.info(f'Profiling steps {index_step}-{index_step + self.steps_window - 1}...')
+        elif index_step - self.step_first >= self.steps_window:
+            self.finish(self.step_last)
+        else:
+            self.step_last = index_step
+
+    def finish(self, index_step_last):
+        if self.profiler is None:
+            return None
+        self.profiler.stop()
+        path = os.path.join(self.dir_output, self.alias.replace(': ', '_').replace(' ', '_') +
+                            f'_profile_{self.step_first}-{index_step_last}.collapsed')
+        self.profiler.write_collapsed(path)
+        if self.logger is not None:
+            self.logger.info(f'Profile ({self.profiler.samples} samples) written to: {path}',
+                             extra={'path': path, 'top_functions': self.profiler.top_functions()})
+        self.list_path.append(path)
+        self.profiler = None
+        return path
+
+    def __enter__(self):
+        _PROFILERS.append(self)
+        return self
+
+    def __exit__(self, *args):
+        # A window still open at the end of the run is written as is
+        _PROFILERS.remove(self)
+        if self.profiler is not None:
+            self.finish(self.step_last)
+
+
+def handle_profile_signal(signum, frame):
+    for session_profiler in _PROFILERS:
+        session_profiler.request()
+
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR1', None)):
+    """
+    Install the handler requesting a profile of the sessions running in this process (e.g., `kill -USR1 <pid>`).
+    Returns False if the signal is not available (Windows) or if this is not the main thread of the process.
+    """
+    if signum is None:
+        return False
+    try:
+        if signal.getsignal(signum) is not handle_profile_signal:
+            signal.signal(signum, handle_profile_signal)
+    except ValueError:
+        return False
+    return True
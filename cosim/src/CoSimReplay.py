@@ -0,0 +1,152 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from CoSimCore import CoSimCore
+from CoSimDict import DATA, SETTING, CONTROL
+from CoSimStorage import read_results, write_results
+from CoSimUtils import record_to_output_data
+
+# Columns of the replayed decisions
+REPLAY_HEATING_SETPOINT = 'Heating Setpoint (Replay)'
+REPLAY_COOLING_SETPOINT = 'Cooling Setpoint (Replay)'
+RECORDED_HEATING_SETPOINT = 'Heating Setpoint (Recorded)'
+RECORDED_COOLING_SETPOINT = 'Cooling Setpoint (Recorded)'
+REPLAY_DIVERGED = 'Diverged'
+
+
+def record_to_output_steps(record_data):
+    # The rows of a results DataFrame as output_step dictionaries, as returned by CoSimCore.retrieve_outputs()
+    output_data, conditioned_zones, unconditioned_zones = record_to_output_data(record_data)
+    list_output_step = output_data.to_dict('records')
+    for output_step in list_output_step:
+        output_step[DATA.TIME_SIM] = pd.Timestamp(output_step[DATA.TIME_SIM]).to_pydatetime()
+    return list_output_step, conditioned_zones, unconditioned_zones
+
+
+class ControllerReplay:
+    """
+    Offline replay of a recorded run through CoSimCore.compute_control(), without building simulator.
+    The recorded output_step of each row is fed to compute_control(), and the decided setpoints are compared with the setpoints
+    applied to the building model at the next row of the original run.
+    The replay is open-loop: the building does not respond to the replayed decisions, so the divergence is measured per decision
+    against the recorded trajectory (weather, zone states and occupant/thermostat inputs of the original run).
+    """
+    def __init__(self,
+                 cosim_session: CoSimCore,
+                 control_mode,
+                 setpoints_manual=None,
+                 schedule_info=None,
+                 tolerance=0.01):
+        # cosim_session: session providing the controller (thermostat and occupant models), never initialized with Alfalfa
+        # tolerance: absolute difference of setpoints [degC] above which a decision diverges from the original run
+        self.cosim_session = cosim_session
+        self.control_mode = control_mode
+        self.setpoints_manual = setpoints_manual
+        self.schedule_info = schedule_info
+        self.tolerance = tolerance
+        self.decisions = None
+
+    def initialize(self):
+        # Only the models used by the controller are created (no Alfalfa site is submitted)
+        self.cosim_session.initialize_thermostat_model()
+        if self.control_mode in [CONTROL.OCCUPANT_MODEL, CONTROL.SCHEDULE_AND_OCCUPANT_MODEL]:
+            self.cosim_session.o_occupant_model = self.cosim_session.create_occupant_model(num_homes=self.cosim_session.o_num_homes)
+        return self
+
+    def run(self, record_data: pd.DataFrame, steps=None):
+        """
+        :param record_data: results of the original run (e.g., read_results())
+        :param steps: number of decisions to replay (every row except the last one if None)
+        :return: DataFrame of the replayed decisions and the recorded setpoints, one row per decision
+        """
+        list_output_step, conditioned_zones, unconditioned_zones = record_to_output_steps(record_data)
+        self.cosim_session.conditioned_zones = conditioned_zones
+        self.cosim_session.unconditioned_zones = unconditioned_zones
+        steps = len(list_output_step) - 1 if steps is None else min(int(steps), len(list_output_step) - 1)
+
+        decisions = {DATA.TIME_SIM: [],
+                     REPLAY_HEATING_SETPOINT: [], RECORDED_HEATING_SETPOINT: [],
+                     REPLAY_COOLING_SETPOINT: [], RECORDED_COOLING_SETPOINT: [],
+                     DATA.THERMOSTAT_SCHEDULE: [], DATA.THERMOSTAT_MODE: [],
+                     DATA.OCCUPANT_HABITUAL_OVERRIDE: [], DATA.OCCUPANT_DISCOMFORT_OVERRIDE: []}
+        time_replay_start = time.perf_counter()
+        for index_step in range(steps):
+            output_step = list_output_step[index_step]
+            control_input, control_information = \
+                self.cosim_session.compute_control(time_sim=output_step[DATA.TIME_SIM],
+                                                   control_mode=self.control_mode,
+                                                   setpoints_manual=self.setpoints_manual,
+                                                   schedule_info=self.schedule_info,
+                                                   output_step=output_step,
+                                                   debug=False)
+            # Without control input, the setpoints of the building model are kept
+            output_step_next = list_output_step[index_step + 1]
+            decisions[DATA.TIME_SIM].append(output_step[DATA.TIME_SIM])
+            decisions[REPLAY_HEATING_SETPOINT].append(control_input['u'].get(CONTROL.HEATING_SETPOINT_TO_ALFALFA, output_step[DATA.HEATING_SETPOINT_BASE]))
+            decisions[RECORDED_HEATING_SETPOINT].append(output_step_next[DATA.HEATING_SETPOINT_BASE])
+            decisions[REPLAY_COOLING_SETPOINT].append(control_input['u'].get(CONTROL.COOLING_SETPOINT_TO_ALFALFA, output_step[DATA.COOLING_SETPOINT_BASE]))
+            decisions[RECORDED_COOLING_SETPOINT].append(output_step_next[DATA.COOLING_SETPOINT_BASE])
+            for key in [DATA.THERMOSTAT_SCHEDULE, DATA.THERMOSTAT_MODE, DATA.OCCUPANT_HABITUAL_OVERRIDE, DATA.OCCUPANT_DISCOMFORT_OVERRIDE]:
+                decisions[key].append(control_information.get(key))
+        self.time_replay = time.perf_counter() - time_replay_start
+
+        decisions = pd.DataFrame(decisions)
+        for column in [REPLAY_HEATING_SETPOINT, RECORDED_HEATING_SETPOINT, REPLAY_COOLING_SETPOINT, RECORDED_COOLING_SETPOINT]:
+            decisions[column] = decisions[column].astype(float)
+        decisions[REPLAY_DIVERGED] = ((decisions[REPLAY_HEATING_SETPOINT] - decisions[RECORDED_HEATING_SETPOINT]).abs() > self.tolerance) | \
+                                     ((decisions[REPLAY_COOLING_SETPOINT] - decisions[RECORDED_COOLING_SETPOINT]).abs() > self.tolerance)
+        self.decisions = decisions
+        return decisions
+
+    def summary(self):
+        decisions = self.decisions
+        diverged = decisions[decisions[REPLAY_DIVERGED]]
+        return {'alias': self.cosim_session.alias,
+                'control_mode': self.control_mode,
+                'steps': len(decisions),
+                'steps_per_second': len(decisions) / self.time_replay if self.time_replay > 0 else np.nan,
+                'steps_diverged': len(diverged),
+                'ratio_diverged': len(diverged) / len(decisions) if len(decisions) else np.nan,
+                'time_first_divergence': diverged[DATA.TIME_SIM].iloc[0] if len(diverged) else None,
+                'heating_setpoint_max_difference': (decisions[REPLAY_HEATING_SETPOINT] - decisions[RECORDED_HEATING_SETPOINT]).abs().max(),
+                'cooling_setpoint_max_difference': (decisions[REPLAY_COOLING_SETPOINT] - decisions[RECORDED_COOLING_SETPOINT]).abs().max()}
+
+
+def replay_trace(path_results, input_each, control_mode, setpoints_manual=None, schedule_info=None, tolerance=0.01, steps=None, dir_output=None):
+    """
+    Replay one results file with the settings of a session (same format as the inputs of CoSimMain.py).
+    :param dir_output: if provided, the decisions are written to '<name of the results file>_replay.parquet' in this folder
+    :return: summary of the replay (see ControllerReplay.summary())
+    """
+    record_data = read_results(path_results)
+    cosim_session = CoSimCore(alias=os.path.splitext(os.path.basename(path_results))[0],
+                              building_model_information=input_each[SETTING.BUILDING_MODEL_INFORMATION],
+                              simulation_information=input_each[SETTING.SIMULATION_INFORMATION],
+                              occupant_model_information=input_each[SETTING.OCCUPANT_MODEL_INFORMATION],
+                              thermostat_model_information=input_each[SETTING.THERMOSTAT_MODEL_INFORMATION],
+                              test_default_model=False,
+                              debug=False)
+    controller_replay = ControllerReplay(cosim_session=cosim_session,
+                                         control_mode=control_mode,
+                                         setpoints_manual=setpoints_manual,
+                                         schedule_info=schedule_info,
+                                         tolerance=tolerance).initialize()
+    decisions = controller_replay.run(record_data, steps=steps)
+    summary = controller_replay.summary()
+    summary['path_results'] = path_results
+    if dir_output is not None:
+        summary['path_replay'] = write_results(decisions, os.path.join(dir_output, cosim_session.alias + '_replay.parquet'))
+    return summary
+
+
+def replay_traces(list_path_results, input_each, control_mode, setpoints_manual=None, schedule_info=None, tolerance=0.01, steps=None, dir_output=None, n_jobs=-1):
+    # Replay several results files in parallel, with the same controller settings
+    list_summary = Parallel(n_jobs=n_jobs)\
+                           (delayed(replay_trace)\
+                                   (path_results, input_each, control_mode, setpoints_manual, schedule_info, tolerance, steps, dir_output)
+                            for path_results in list_path_results)
+    return pd.DataFrame(list_summary)
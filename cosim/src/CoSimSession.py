@@ -0,0 +1,159 @@
+import logging
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from CoSimDict import DATA, CONTROL
+from CoSimUtils import get_record_template, update_record, resample_record
+from CoSimStepping import AdaptiveStepPolicy
+from CoSimStorage import write_results
+from CoSimKPI import KPIAccumulator
+from CoSimLogging import ProgressLogger
+from CoSimMonitor import STATE_RUNNING
+from CoSimProfiler import SessionProfiler
+from CoSimTuner import ConcurrencySlot
+
+
+def create_kpi(cosim_session):
+    return KPIAccumulator(name=cosim_session.alias,
+                          conditioned_zones=cosim_session.conditioned_zones,
+                          time_step_size=cosim_session.time_step_size)
+
+
+def run_session_steps(cosim_session, steps_to_proceed, control_mode, setpoints_manual=None, schedule_info=None, steps_warm_up=0,
+                      fast_forward_output_interval=None, max_steps_per_decision=None, record_events=False, time_start=None, time_end=None,
+                      reporter=None, logger=None, progress_every_steps=1440, progress_every_seconds=60.0,
+                      session_profiler=None, concurrency_slot=None, session_governor=None, debug=False):
+    """
+    Steps of an initialized session, shared by the local runs (see CoSimMain.run_each_session()) and the workers (see CoSimDistributed.py):
+    the warm-up is fast-forwarded (not recorded), then passthrough control is fast-forwarded (open-loop, one output every
+    `fast_forward_output_interval` steps) and any other control is run closed-loop, with several steps per control decision while the
+    controller is quiescent if `max_steps_per_decision` is given (adaptive stepping, see CoSimStepping.py).
+    reporter: receives set_state() and update() (e.g., MonitorReporter, see CoSimMonitor.py)
+    :return: (record, kpi)
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    steps_to_proceed = int(np.floor(float(steps_to_proceed)))
+
+    # Run part (0): Fast-forward the warm-up period (open-loop, not recorded)
+    if steps_warm_up > 0:
+        logger.info(f'Fast-forwarding {steps_warm_up} warm-up steps...')
+        cosim_session.fast_forward(steps=steps_warm_up,
+                                   input_trajectory=cosim_session.open_loop_trajectory(CONTROL.PASSTHROUGH),
+                                   read_energy=False)
+
+    # Run part (1): Initialize the record
+    logger.info('Running simulation...')
+    if reporter is not None:
+        reporter.set_state(STATE_RUNNING)
+    output_step = cosim_session.retrieve_outputs()
+    time_sim_input = output_step[DATA.TIME_SIM]
+    record_each = get_record_template(name=cosim_session.alias,
+                                      time_start=time_start if time_start is not None else cosim_session.time_start,
+                                      time_end=time_end if time_end is not None else cosim_session.time_end,
+                                      conditioned_zones=cosim_session.conditioned_zones,
+                                      unconditioned_zones=cosim_session.unconditioned_zones,
+                                      is_initial_record=True,
+                                      output_step=output_step,
+                                      events=record_events)
+    kpi = create_kpi(cosim_session)
+
+    # Run part (2): Run the simulations
+    # State-independent control is fast-forwarded (open-loop), recording every `fast_forward_output_interval` steps
+    if control_mode == CONTROL.PASSTHROUGH:
+        steps_output = fast_forward_output_interval if fast_forward_output_interval else steps_to_proceed
+        list_output_step = cosim_session.fast_forward(steps=steps_to_proceed,
+                                                      input_trajectory=cosim_session.open_loop_trajectory(control_mode),
+                                                      output_interval=fast_forward_output_interval)
+        for index_output, output_step in enumerate(list_output_step):
+            # Steps represented by each output (fewer for the last one)
+            update_record(output_step=output_step,
+                          record=record_each,
+                          conditioned_zones=cosim_session.conditioned_zones,
+                          unconditioned_zones=cosim_session.unconditioned_zones,
+                          kpi=kpi,
+                          steps=min(steps_output, steps_to_proceed - index_output * steps_output))
+        if reporter is not None:
+            reporter.update(steps_to_proceed, list_output_step[-1][DATA.TIME_SIM] if list_output_step else None, kpi=kpi)
+        steps_to_proceed = 0
+
+    # With adaptive stepping, several steps are advanced per control decision while the controller is quiescent
+    step_policy = AdaptiveStepPolicy(max_steps=max_steps_per_decision, debug=debug) if max_steps_per_decision is not None else None
+    progress = ProgressLogger(logger, steps_total=steps_to_proceed, every_steps=progress_every_steps, every_seconds=progress_every_seconds)
+    session_profiler = session_profiler if session_profiler is not None else SessionProfiler(alias=cosim_session.alias, dir_output=None)
+    concurrency_slot = concurrency_slot if concurrency_slot is not None else ConcurrencySlot(None, cosim_session.alias)
+    with session_profiler, concurrency_slot:
+        index_step = 0
+        while index_step < steps_to_proceed:
+            session_profiler.on_step(index_step)
+            control_input, control_information = \
+                cosim_session.compute_control(time_sim=time_sim_input,
+                                              control_mode=control_mode,
+                                              setpoints_manual=setpoints_manual,
+                                              schedule_info=schedule_info,
+                                              output_step=output_step,
+                                              debug=False)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Control input: {control_input} / control information: {control_information}', extra={'time_sim': time_sim_input})
+
+            steps_decision = 1
+            if step_policy is not None:
+                steps_decision = min(step_policy.next_steps(cosim_session=cosim_session,
+                                                            control_mode=control_mode,
+                                                            output_step=output_step,
+                                                            control_information=control_information),
+                                     steps_to_proceed - index_step)
+            cosim_session.proceed_simulation(control_input=control_input,
+                                             control_information=control_information,
+                                             steps=steps_decision)
+            index_step += steps_decision
+
+            output_step = cosim_session.retrieve_outputs(control_information=control_information)
+            time_sim_input = output_step[DATA.TIME_SIM]
+            update_record(output_step=output_step,
+                          record=record_each,
+                          conditioned_zones=cosim_session.conditioned_zones,
+                          unconditioned_zones=cosim_session.unconditioned_zones,
+                          kpi=kpi,
+                          steps=steps_decision)
+            progress.update(index_step, time_sim_input)
+            if reporter is not None:
+                reporter.update(index_step, time_sim_input, kpi=kpi)
+            concurrency_slot.step(steps_decision)
+            if session_governor is not None:
+                session_governor.on_step()
+    return record_each, kpi
+
+
+def export_session_record(cosim_session, record_each, dir_output, logger, kpi=None, fingerprint=None, resample=False,
+                          codec='zstd', row_group_size=131072, float32_sensors=False, result_cache=None):
+    """
+    Write the results file of a session in dir_output, with the summary of its KPIs next to it (see CoSimKPI.py).
+    Results are named by the fingerprint of the run, if known, so that they can be found again (see CoSimCache.py).
+    resample: records of adaptive steps are resampled to the uniform grid of time_step_size
+    :return: path of the results file
+    """
+    logger.info(f'Exporting results (site_id: {cosim_session.model_id})...')
+    uuid_prefix = fingerprint[:16] if fingerprint is not None else str(uuid.uuid4())
+    model_name = record_each[DATA.SETTING]['model_name'][0].replace(": ","_")
+    alpha_value = "a" + str(cosim_session.o_TFT_alpha).replace(".","")+ "_"
+    dir_output_file = os.path.join(dir_output, model_name + '_' + uuid_prefix + '_' +  alpha_value +'.parquet')
+    if resample:
+        record_data = resample_record(record_each, time_step_size=cosim_session.time_step_size)
+    else:
+        record_data = pd.DataFrame.from_dict({**record_each[DATA.INPUT], **record_each[DATA.STATUS]})
+    write_results(record_data, dir_output_file,
+                  codec=codec,
+                  row_group_size=row_group_size,
+                  float32_sensors=float32_sensors,
+                  events=record_each.get(DATA.EVENTS))
+    logger.info(f'Data exported to: {dir_output_file}', extra={'path': dir_output_file})
+    if kpi is not None:
+        # Summary of the KPIs next to the results file (see CoSimKPI.read_kpi_totals())
+        path_kpi = kpi.write_summary(dir_output_file)
+        logger.info(f'KPIs exported to: {path_kpi}', extra={'path': path_kpi, 'kpi': kpi.totals()})
+    if fingerprint is not None and result_cache is not None:
+        result_cache.store(fingerprint, dir_output_file, description={'alias': cosim_session.alias})
+    return dir_output_file
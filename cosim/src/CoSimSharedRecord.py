@@ -0,0 +1,127 @@
+import glob
+import os
+import tempfile
+import time
+import uuid
+
+from CoSimDict import DATA
+from CoSimEvents import extend_events
+
+# Files of the shared records are created in shared memory (tmpfs) if available
+DIR_SHARED_DEFAULT = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+PREFIX_SHARED = 'cosim_record_'
+# Categories of a record carried by the shared buffers (DATA.SETTING is only in the initial record)
+RECORD_CATEGORIES = [DATA.INPUT, DATA.STATUS]
+SEPARATOR_CATEGORY = '/'
+# Key of the attached tables in a record extended with shared rows (see extend_record())
+KEY_SHARED = 'shared'
+
+
+def share_record(record, dir_shared=None):
+    """
+    Write the rows of a record (DATA.INPUT and DATA.STATUS, e.g., the new steps computed by a joblib worker) to an Arrow IPC file
+    in shared memory, and return a small descriptor to be returned by the worker instead of the record itself.
+    The parent process memory-maps the file with attach_record(), and extend_record() keeps the mapped table as is: the values are
+    only converted (column by column) when the rows are read with get_record_frame().
+    Columns which cannot be converted to Arrow (e.g., mixed types) and the change events (DATA.EVENTS, a few per day) are carried
+    in the descriptor as they are.
+    Without pyarrow, the record itself is returned (pickled by joblib, as before).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return record
+
+    arrays, names, inline = [], [], dict()
+    for category in RECORD_CATEGORIES:
+        for key, values in record.get(category, {}).items():
+            try:
+                arrays.append(pa.array(values))
+                names.append(category + SEPARATOR_CATEGORY + key)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+                inline[category + SEPARATOR_CATEGORY + key] = values
+    table = pa.Table.from_arrays(arrays, names=names)
+
+    path = os.path.join(dir_shared if dir_shared is not None else DIR_SHARED_DEFAULT, PREFIX_SHARED + str(uuid.uuid4()) + '.arrow')
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return {'name': path,
+            'offset': 0,
+            'length': os.path.getsize(path),
+            'num_rows': table.num_rows,
+            'schema': [(field.name, str(field.type)) for field in table.schema],
+            'inline': inline,
+            DATA.EVENTS: record.get(DATA.EVENTS)}
+
+
+def is_shared_record(shared):
+    return isinstance(shared, dict) and 'name' in shared and 'inline' in shared
+
+
+def attach_record(shared):
+    """
+    Memory-map the buffers of a descriptor returned by share_record().
+    :return: (pyarrow.Table whose buffers point to the shared memory, inline columns)
+    The file is unlinked once mapped: the mapping stays valid as long as the table is referenced.
+    """
+    import pyarrow as pa
+    source = pa.memory_map(shared['name'], 'r')
+    table = pa.ipc.open_file(source).read_all()
+    os.unlink(shared['name'])
+    return table, shared['inline']
+
+
+def extend_record(record, shared):
+    # Append the rows of a worker (descriptor of share_record() or record as is) to the record of the main process
+    # Shared rows are kept as the attached tables in record[KEY_SHARED], in order: read the rows with get_record_frame()
+    if shared.get(DATA.EVENTS) is not None:
+        extend_events(record[DATA.EVENTS], shared[DATA.EVENTS])
+    if not is_shared_record(shared):
+        for category in RECORD_CATEGORIES:
+            for key in shared.get(category, {}):
+                record[category][key].extend(shared[category][key])
+        return record
+    record.setdefault(KEY_SHARED, []).append(attach_record(shared))
+    return record
+
+
+def table_to_frame(table, inline, categories=RECORD_CATEGORIES):
+    # Columns of `categories` of an attached table (and of its inline columns) as a DataFrame, named as in the results files
+    names = [name for name in table.column_names if name.split(SEPARATOR_CATEGORY, 1)[0] in categories]
+    record_data = table.select(names).rename_columns([name.split(SEPARATOR_CATEGORY, 1)[1] for name in names]).to_pandas()
+    for name, values in inline.items():
+        category, key = name.split(SEPARATOR_CATEGORY, 1)
+        if category in categories:
+            record_data[key] = values
+    return record_data
+
+
+def record_from_shared(shared):
+    # Shared rows as a DataFrame (columns of DATA.INPUT and DATA.STATUS, as the results files), built from the mapped buffers
+    import pandas as pd
+    if not is_shared_record(shared):
+        return pd.DataFrame.from_dict({**shared[DATA.INPUT], **shared[DATA.STATUS]})
+    return table_to_frame(*attach_record(shared))
+
+
+def get_record_frame(record, categories=RECORD_CATEGORIES):
+    # Rows of a record extended with extend_record() as a DataFrame: the rows held as lists, then the attached tables of the workers
+    import pandas as pd
+    record_data = pd.DataFrame.from_dict({key: values for category in categories for key, values in record[category].items()})
+    if not record.get(KEY_SHARED):
+        return record_data
+    list_frame = [table_to_frame(table, inline, categories=categories) for table, inline in record[KEY_SHARED]]
+    return pd.concat([record_data] + list_frame, ignore_index=True)[record_data.columns]
+
+
+def cleanup_shared_records(dir_shared=None, max_age_seconds=3600.0):
+    # Remove the files of shared records never attached (e.g., a worker whose parent failed)
+    time_now = time.time()
+    for path in glob.glob(os.path.join(dir_shared if dir_shared is not None else DIR_SHARED_DEFAULT, PREFIX_SHARED + '*.arrow')):
+        try:
+            if time_now - os.path.getmtime(path) > max_age_seconds:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return
@@ -0,0 +1,209 @@
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from CoSimBackend import create_backend, BACKENDS
+from CoSimManifest import get_config_hash, stop_site
+
+# Warm sites are files '<dir_pool>/<config hash>/<site>.json', leased by renaming them (atomic, so that every site is leased once)
+SUFFIX_WARM = '.json'
+SUFFIX_CLAIMED = '.claimed'
+
+
+def get_site_path(dir_pool, config_hash, site_id):
+    return os.path.join(dir_pool, config_hash, str(site_id).replace(os.sep, '_').replace('#', '_') + SUFFIX_WARM)
+
+
+def list_warm_sites(dir_pool, config_hash):
+    # Paths of the warm sites of a configuration, oldest first
+    return sorted(glob.glob(os.path.join(dir_pool, config_hash, '*' + SUFFIX_WARM)), key=lambda path: os.path.getmtime(path))
+
+
+def claim_site(path):
+    # Entry of the warm site of `path`, or None if another process claimed it first
+    path_claimed = path + '.' + str(os.getpid()) + SUFFIX_CLAIMED
+    try:
+        os.rename(path, path_claimed)
+    except FileNotFoundError:
+        return None
+    with open(path_claimed) as file:
+        entry = json.load(file)
+    os.remove(path_claimed)
+    return entry
+
+
+def lease_warm_site(dir_pool, config_hash, host=None):
+    """
+    Lease a warm site (submitted and started at the start time of the configuration) of the pool, for CoSimCore.initialize().
+    :param host: if given, only the sites of this host are leased (otherwise, e.g., with an endpoint pool, any host)
+    :return: entry of the site (alias, backend, host, site_id, config_hash, time_started), or None if no warm site is available
+    """
+    if dir_pool is None or not os.path.isdir(os.path.join(dir_pool, config_hash)):
+        return None
+    for path in list_warm_sites(dir_pool, config_hash):
+        if host is not None:
+            try:
+                with open(path) as file:
+                    if json.load(file)['host'] != host:
+                        continue
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        entry = claim_site(path)
+        if entry is not None:
+            return entry
+    return None
+
+
+class SitePool:
+    """
+    Pool of warm sites: for each registered building model, keeps `size` sites submitted and started (external clock) at its start time,
+    so that CoSimCore.initialize() leases one instead of waiting for submit --> "ready" --> start (SETTING.PATH_SITE_POOL).
+    A background thread replenishes the pool every `replenish_seconds`, and sites left idle for `ttl_seconds` are stopped and replaced
+    (Alfalfa keeps a worker busy for each started site). The pool can be run by its own process, e.g., next to Alfalfa:
+        python CoSimSitePool.py --dir-pool <dir> --host http://localhost --model <path of the building model> --size 4 --time-start ... --time-end ...
+    """
+    def __init__(self, dir_pool, ttl_seconds=3600.0, replenish_seconds=5.0, max_submissions=4, logger=None):
+        self.dir_pool = dir_pool
+        self.ttl_seconds = ttl_seconds
+        self.replenish_seconds = replenish_seconds
+        self.logger = logger
+        self.models = dict()    # config hash --> settings of the sites and size
+        self.pending = dict()   # config hash --> number of sites being submitted
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_submissions)
+        self.thread = None
+        self.event_stop = threading.Event()
+        os.makedirs(dir_pool, exist_ok=True)
+
+    def register(self, model_path, time_start, time_end, time_step_size=1, time_scale=1, external_clock=True,
+                 backend_name='alfalfa', host='http://localhost', size=1):
+        # Same configuration hash as the sessions (CoSimCore.config_hash), so that a session only leases a site of its configuration
+        if BACKENDS[backend_name].in_process:
+            raise ValueError("Sites of in-process backends cannot be shared by processes:", backend_name)
+        config_hash = get_config_hash(backend_name, model_path, time_start, time_end, time_step_size, time_scale, external_clock)
+        with self.lock:
+            self.models[config_hash] = {'model_path': model_path, 'time_start': time_start, 'time_end': time_end, 'time_scale': time_scale,
+                                        'external_clock': external_clock, 'backend_name': backend_name, 'host': host, 'size': size}
+            self.pending.setdefault(config_hash, 0)
+        os.makedirs(os.path.join(self.dir_pool, config_hash), exist_ok=True)
+        return config_hash
+
+    def resize(self, config_hash, size):
+        # Surplus sites are stopped at the next replenishment (size 0: the model is not kept warm anymore)
+        with self.lock:
+            self.models[config_hash]['size'] = size
+
+    def submit_site(self, config_hash, model):
+        try:
+            backend = create_backend(model['backend_name'], host=model['host'])
+            alias = 'site_pool_' + config_hash[:8] + '_' + str(time.time_ns())
+            site_id = backend.submit(model['model_path'], alias)
+            backend.start(site_id, model['time_start'], model['time_end'], model['time_scale'], model['external_clock'])
+            entry = {'alias': alias, 'backend': model['backend_name'], 'host': model['host'], 'site_id': site_id,
+                     'config_hash': config_hash, 'time_started': time.time()}
+            path = get_site_path(self.dir_pool, config_hash, site_id)
+            with open(path + '.tmp', 'w') as file:
+                json.dump(entry, file, default=str)
+            os.replace(path + '.tmp', path)
+            if self.logger is not None: self.logger.info(f'Warm site {site_id} ready ({model["model_path"]})')
+        except Exception as e:
+            if self.logger is not None: self.logger.error(f'Submission of a warm site failed ({model["model_path"]}): {e!r}')
+        finally:
+            with self.lock:
+                self.pending[config_hash] -= 1
+
+    def replenish(self):
+        # One pass: stop the expired and surplus sites, and submit the missing ones
+        with self.lock:
+            models = dict(self.models)
+        for config_hash, model in models.items():
+            list_path = list_warm_sites(self.dir_pool, config_hash)
+            for index_path, path in enumerate(list_path):
+                expired = time.time() - os.path.getmtime(path) > self.ttl_seconds
+                surplus = len(list_path) - index_path > model['size']
+                if expired or surplus:
+                    entry = claim_site(path)
+                    if entry is not None:
+                        stop_site(entry)
+                        if self.logger is not None: self.logger.info(f'Warm site {entry["site_id"]} stopped ({"expired" if expired else "surplus"})')
+            with self.lock:
+                missing = model['size'] - len(list_warm_sites(self.dir_pool, config_hash)) - self.pending[config_hash]
+                self.pending[config_hash] += max(missing, 0)
+            for _ in range(missing):
+                self.executor.submit(self.submit_site, config_hash, model)
+
+    def snapshot(self):
+        with self.lock:
+            return {config_hash: {'model_path': model['model_path'], 'size': model['size'], 'pending': self.pending[config_hash],
+                                  'warm': len(list_warm_sites(self.dir_pool, config_hash))}
+                    for config_hash, model in self.models.items()}
+
+    def run(self):
+        while not self.event_stop.is_set():
+            try:
+                self.replenish()
+            except Exception as e:
+                if self.logger is not None: self.logger.error(f'Replenishment of the site pool failed: {e!r}')
+            self.event_stop.wait(self.replenish_seconds)
+
+    def start(self):
+        self.event_stop.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, stop_sites=True):
+        # stop_sites: stop the warm sites which were not leased (otherwise, they are kept for the next run of the pool)
+        self.event_stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
+        if stop_sites:
+            for config_hash in self.models:
+                for path in list_warm_sites(self.dir_pool, config_hash):
+                    entry = claim_site(path)
+                    if entry is not None:
+                        stop_site(entry)
+        return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pool of warm Alfalfa sites of CoSimAlfalfa')
+    parser.add_argument('--dir-pool', required=True, help='folder of the pool (SETTING.PATH_SITE_POOL of the sessions)')
+    parser.add_argument('--host', default='http://localhost', help='URL of Alfalfa')
+    parser.add_argument('--model', action='append', required=True, help='path of a building model (repeat for several models)')
+    parser.add_argument('--size', type=int, default=1, help='warm sites kept per model')
+    parser.add_argument('--time-start', required=True, help="e.g., '2019-01-01 00:00:00'")
+    parser.add_argument('--time-end', required=True, help="e.g., '2019-12-31 00:00:00'")
+    parser.add_argument('--time-step-size', type=int, default=1)
+    parser.add_argument('--time-scale', type=int, default=1)
+    parser.add_argument('--ttl-seconds', type=float, default=3600.0)
+    parser.add_argument('--replenish-seconds', type=float, default=5.0)
+    parser.add_argument('--keep-sites', action='store_true', help='keep the warm sites running when the pool exits')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s [%(levelname)s] %(message)s')
+    site_pool = SitePool(args.dir_pool, ttl_seconds=args.ttl_seconds, replenish_seconds=args.replenish_seconds,
+                         logger=logging.getLogger('cosim.site_pool'))
+    for model_path in args.model:
+        site_pool.register(model_path,
+                           time_start=datetime.datetime.fromisoformat(args.time_start),
+                           time_end=datetime.datetime.fromisoformat(args.time_end),
+                           time_step_size=args.time_step_size,
+                           time_scale=args.time_scale,
+                           host=args.host,
+                           size=args.size)
+    site_pool.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(site_pool.snapshot()))
+    except KeyboardInterrupt:
+        site_pool.stop(stop_sites=not args.keep_sites)
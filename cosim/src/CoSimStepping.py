@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from CoSimDict import DATA, CONTROL
+from CoSimUtils import is_convertable_to_float, get_schedule_setpoints
+
+class AdaptiveStepPolicy:
+    """
+    Decides how many simulation steps to advance per control decision.
+    The controller is quiescent (several steps per decision) when no event can happen within the next steps:
+      - no thermostat schedule transition (e.g., 06:00/22:00 of the default program) and no schedule row change,
+      - the zone temperature is far from the deadband edges, given its recent rate of change.
+    Near events or deadband edges, the policy drops back to one step per decision.
+    Occupant models declare the number of quiescent steps with an optional `steps_until_event()` method; otherwise, the occupants
+    are quiescent while no override is pending in their outputs (previous step and current decision) and their motion does not change,
+    and the steps are bounded by the deadband edges and the thermostat schedule transitions.
+    """
+    def __init__(self,
+                 max_steps=15,
+                 event_margin=1,
+                 temperature_rate_min=0.01,
+                 debug=False):
+        # max_steps: maximum number of steps advanced per control decision
+        # event_margin: steps kept before an event, so that the controller is evaluated at 1-step resolution around it
+        # temperature_rate_min: lower bound of the rate of change of zone temperature [degC/step] used to reach a deadband edge
+        self.max_steps = max_steps
+        self.event_margin = event_margin
+        self.temperature_rate_min = temperature_rate_min
+        self.debug = debug
+        self.previous = dict()  # alias --> (zone_mean_temperature, steps)
+
+    def steps_to_deadband_edge(self, zone_mean_temperature, setpoints, rate):
+        steps = self.max_steps
+        for setpoint_new, deadband_up, deadband_down in [(DATA.HEATING_SETPOINT_NEW, DATA.HEATING_SETPOINT_DEADBAND_UP, DATA.HEATING_SETPOINT_DEADBAND_DOWN),
+                                                         (DATA.COOLING_SETPOINT_NEW, DATA.COOLING_SETPOINT_DEADBAND_UP, DATA.COOLING_SETPOINT_DEADBAND_DOWN)]:
+            if not is_convertable_to_float(setpoints.get(setpoint_new)):
+                continue
+            # Without deadband (e.g., setpoints of the thermostat model), the edges are the setpoint
+            edge_up = float(setpoints[setpoint_new]) + (float(setpoints[deadband_up]) if is_convertable_to_float(setpoints.get(deadband_up)) else 0.0)
+            edge_down = float(setpoints[setpoint_new]) - (float(setpoints[deadband_down]) if is_convertable_to_float(setpoints.get(deadband_down)) else 0.0)
+            distance = min(abs(zone_mean_temperature - edge_up), abs(zone_mean_temperature - edge_down))
+            steps = min(steps, int(distance / rate) - self.event_margin)
+        return steps
+
+    def is_occupant_quiescent(self, output_step, control_information):
+        # No override pending in the outputs of the occupants, and no arrival or departure
+        for occupant_output in [output_step, control_information]:
+            if occupant_output.get(DATA.OCCUPANT_HABITUAL_OVERRIDE) or occupant_output.get(DATA.OCCUPANT_DISCOMFORT_OVERRIDE):
+                return False
+        return bool(output_step.get(DATA.OCCUPANT_MOTION)) == bool(control_information.get(DATA.OCCUPANT_MOTION))
+
+    def steps_to_transition(self, time_sim, time_transition, time_step_size):
+        if time_transition is None:
+            return self.max_steps
+        return int((time_transition - time_sim) / timedelta(minutes=time_step_size)) - self.event_margin
+
+    def steps_to_schedule_change(self, cosim_session, time_sim, schedule_info):
+        # Number of steps for which the schedule row (setpoints and deadbands) stays the same
+        schedule_lookup = cosim_session.get_schedule_lookup(schedule_info)
+        setpoints_current = get_schedule_setpoints(schedule_lookup, time_sim)
+        for steps in range(1, self.max_steps + 1):
+            setpoints_next = get_schedule_setpoints(schedule_lookup, time_sim + timedelta(minutes=steps * cosim_session.time_step_size))
+            if setpoints_next is not None and setpoints_next != setpoints_current:
+                return steps - self.event_margin
+        return self.max_steps
+
+    def next_steps(self, cosim_session, control_mode, output_step, control_information, schedule_info=None):
+        """
+        :return: number of steps to advance with the inputs of the current control decision (>= 1)
+        """
+        time_sim = output_step[DATA.TIME_SIM]
+        zone_mean_temperature, _ = cosim_session.get_zone_state(output_step)
+
+        # Rate of change of the zone temperature since the previous decision
+        rate = self.temperature_rate_min
+        if cosim_session.alias in self.previous:
+            zone_mean_temperature_previous, steps_previous = self.previous[cosim_session.alias]
+            rate = max(rate, abs(zone_mean_temperature - zone_mean_temperature_previous) / steps_previous)
+
+        if control_mode == CONTROL.PASSTHROUGH:
+            steps = self.max_steps
+        elif control_mode == CONTROL.SETPOINTS:
+            steps = self.steps_to_deadband_edge(zone_mean_temperature, control_information, rate)
+        elif control_mode == CONTROL.SCHEDULE:
+            steps = min(self.steps_to_deadband_edge(zone_mean_temperature, control_information, rate),
+                        self.steps_to_schedule_change(cosim_session, time_sim, schedule_info))
+        elif control_mode in [CONTROL.OCCUPANT_MODEL, CONTROL.SCHEDULE_AND_OCCUPANT_MODEL]:
+            steps_until_event = getattr(cosim_session.o_occupant_model, 'steps_until_event', None)
+            if steps_until_event is not None:
+                steps = steps_until_event()
+            elif self.is_occupant_quiescent(output_step, control_information):
+                steps = self.steps_to_deadband_edge(zone_mean_temperature, control_information, rate)
+            else:
+                steps = 1
+            if control_mode == CONTROL.SCHEDULE_AND_OCCUPANT_MODEL:
+                steps = min(steps, self.steps_to_transition(time_sim,
+                                                            cosim_session.thermostat_model.next_transition_datetime(),
+                                                            cosim_session.time_step_size))
+        else:
+            raise ValueError("Control mode not implemented. Provided mode is:", control_mode)
+
+        steps = int(max(1, min(self.max_steps, steps)))
+        self.previous[cosim_session.alias] = (zone_mean_temperature, steps)
+        if self.debug and steps > 1: print(f"[{cosim_session.alias}] Quiescent at {time_sim}: advancing {steps} steps")
+        return steps
@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from CoSimDict import DATA
+from CoSimEvents import EVENT_CHANNELS, EVENT_CHANNEL, EVENT_VALUE, events_to_frame, expand_events
+
+# Schema of the results files (columns of DATA.INPUT and DATA.STATUS of a record)
+# Strings repeated at every step: stored as dictionary-encoded categoricals
+RESULT_COLUMNS_CATEGORICAL = [DATA.THERMOSTAT_SCHEDULE, DATA.THERMOSTAT_MODE]
+# Flags: stored as booleans (bit-packed by Parquet)
+RESULT_COLUMNS_BOOLEAN = [DATA.OCCUPANT_MOTION, DATA.OCCUPANT_HABITUAL_OVERRIDE, DATA.OCCUPANT_DISCOMFORT_OVERRIDE]
+# Timestamps
+RESULT_COLUMNS_TIMESTAMP = [DATA.TIME_SIM]
+# Channels kept as float64 (setpoints, deadbands and energy, which are summed over the run)
+RESULT_COLUMNS_FLOAT64 = [DATA.HEATING_SETPOINT_BASE, DATA.HEATING_SETPOINT_DEADBAND_APPLIED, DATA.HEATING_SETPOINT_DEADBAND_UP, DATA.HEATING_SETPOINT_DEADBAND_DOWN,
+                          DATA.COOLING_SETPOINT_BASE, DATA.COOLING_SETPOINT_DEADBAND_APPLIED, DATA.COOLING_SETPOINT_DEADBAND_UP, DATA.COOLING_SETPOINT_DEADBAND_DOWN,
+                          DATA.COOLING_COIL_ELECTRICITY_ENERGY, DATA.FAN_ELECTRICITY_ENERGY, DATA.HEATING_COIL_FUEL_ENERGY, DATA.HEATING_COIL_ELECTRICITY_ENERGY]
+# Every other numeric column is a sensor channel (zone temperature/humidity, outdoor temperature, runtime fractions, flow rates, ...),
+# which can be downcast to float32
+
+RESULT_CODECS = ['zstd', 'lz4', 'snappy', 'gzip', 'brotli', None]
+
+# Change events of the event channels (see CoSimEvents.py), stored next to the results file: numeric and boolean values in
+# EVENT_VALUE (float64), the other values (e.g., thermostat schedule and mode) in EVENT_LABEL
+SUFFIX_EVENTS = '_events.parquet'
+EVENT_LABEL = 'label'
+
+
+def apply_result_schema(record_data: pd.DataFrame, float32_sensors=False):
+    # Cast the columns of a results DataFrame (e.g., pd.DataFrame.from_dict({**record[DATA.INPUT], **record[DATA.STATUS]})) to the results schema
+    record_data = record_data.copy()
+    for column in record_data.columns:
+        if column in RESULT_COLUMNS_TIMESTAMP:
+            record_data[column] = pd.to_datetime(record_data[column])
+        elif column in RESULT_COLUMNS_CATEGORICAL:
+            record_data[column] = record_data[column].astype(str).astype('category')
+        elif column in RESULT_COLUMNS_BOOLEAN:
+            record_data[column] = record_data[column].fillna(False).astype(bool)
+        elif pd.api.types.is_numeric_dtype(record_data[column]) or record_data[column].dtype == object:
+            record_data[column] = pd.to_numeric(record_data[column], errors='coerce')
+            if float32_sensors and column not in RESULT_COLUMNS_FLOAT64:
+                record_data[column] = record_data[column].astype('float32')
+            else:
+                record_data[column] = record_data[column].astype('float64')
+    return record_data
+
+
+def get_parquet_engine(engine='auto'):
+    # pyarrow is used if installed, otherwise fastparquet (see requirements)
+    if engine != 'auto':
+        return engine
+    try:
+        import pyarrow
+        return 'pyarrow'
+    except ImportError:
+        return 'fastparquet'
+
+
+def get_events_path(path):
+    return os.path.splitext(path)[0] + SUFFIX_EVENTS
+
+
+def is_label_value(value):
+    return value is None or isinstance(value, str)
+
+
+def write_events(events_data, path, codec='zstd', engine='auto'):
+    # events_data: DataFrame of CoSimEvents.events_to_frame(), or events of a record
+    if isinstance(events_data, dict):
+        events_data = events_to_frame(events_data)
+    is_label = [is_label_value(value) for value in events_data[EVENT_VALUE]]
+    events_stored = pd.DataFrame({DATA.TIME_SIM: pd.to_datetime(events_data[DATA.TIME_SIM]),
+                                  EVENT_CHANNEL: events_data[EVENT_CHANNEL].astype(str).astype('category'),
+                                  EVENT_VALUE: [np.nan if label else float(value) for value, label in zip(events_data[EVENT_VALUE], is_label)],
+                                  EVENT_LABEL: [value if label else None for value, label in zip(events_data[EVENT_VALUE], is_label)]})
+    events_stored.to_parquet(path, engine=get_parquet_engine(engine), compression=codec, index=False)
+    return path
+
+
+def read_events(path, engine='auto'):
+    # Events as written by write_events(), with the values of both columns in EVENT_VALUE (None if both are null)
+    events_stored = pd.read_parquet(path, engine=get_parquet_engine(engine))
+    values = events_stored[EVENT_VALUE].astype(object)
+    has_label = events_stored[EVENT_LABEL].notna()
+    values[has_label] = events_stored[EVENT_LABEL][has_label]
+    values[~has_label & events_stored[EVENT_VALUE].isna()] = None
+    return pd.DataFrame({DATA.TIME_SIM: events_stored[DATA.TIME_SIM],
+                         EVENT_CHANNEL: events_stored[EVENT_CHANNEL].astype(str),
+                         EVENT_VALUE: values})
+
+
+def write_results(record_data: pd.DataFrame, path, codec='zstd', row_group_size=131072, float32_sensors=False, engine='auto', events=None):
+    """
+    Write a results DataFrame to a Parquet file with the results schema.
+    :param codec: compression codec among RESULT_CODECS
+    :param row_group_size: number of rows per row group (smaller: faster partial reads, larger: better compression)
+    :param float32_sensors: if True, sensor channels are downcast to float32
+    :param events: change events of the event channels (record[DATA.EVENTS] or CoSimEvents.events_to_frame()), if they are not columns
+                   of record_data: written to '<path without extension>_events.parquet'
+    """
+    if codec not in RESULT_CODECS:
+        raise ValueError("Not valid codec:", codec)
+    record_data = apply_result_schema(record_data, float32_sensors=float32_sensors)
+
+    # The row group size argument depends on the parquet engine
+    engine = get_parquet_engine(engine)
+    if engine == 'fastparquet':
+        options = {'row_group_offsets': row_group_size}
+    else:
+        options = {'row_group_size': row_group_size}
+    record_data.to_parquet(path, engine=engine, compression=codec, index=False, **options)
+    if events is not None:
+        write_events(events, get_events_path(path), codec=codec, engine=engine)
+    return path
+
+
+def read_results(path, columns=None, engine='auto', with_events=True):
+    """
+    Read a results file (only the given columns, if provided).
+    :param with_events: if True and the file has an events file, the event channels are expanded to dense columns at every step,
+                        so that the results read the same as the results of a dense record
+    """
+    path_events = get_events_path(path)
+    if not with_events or not os.path.isfile(path_events):
+        return pd.read_parquet(path, columns=columns, engine=get_parquet_engine(engine))
+
+    channels = [channel for channel in EVENT_CHANNELS if columns is None or channel in columns]
+    columns_dense = None if columns is None else list(dict.fromkeys([DATA.TIME_SIM] + [column for column in columns if column not in EVENT_CHANNELS]))
+    record_data = pd.read_parquet(path, columns=columns_dense, engine=get_parquet_engine(engine))
+    if channels:
+        events_data = apply_result_schema(expand_events(read_events(path_events, engine=engine), record_data[DATA.TIME_SIM], channels=channels))
+        record_data = pd.concat([record_data.reset_index(drop=True), events_data], axis=1)
+    return record_data if columns is None else record_data[columns]
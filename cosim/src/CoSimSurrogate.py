@@ -0,0 +1,370 @@
+import os
+import pickle
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from CoSimDict import DATA, CONTROL
+from CoSimUtils import record_to_output_data, get_zone_names
+from CoSimStorage import read_results
+
+# Channels regressed on the coil runtime fractions (and their product with the outdoor temperature)
+SURROGATE_SYSTEM_CHANNELS = [DATA.COOLING_COIL_ELECTRICITY_ENERGY, DATA.FAN_ELECTRICITY_ENERGY,
+                             DATA.HEATING_COIL_ELECTRICITY_ENERGY, DATA.HEATING_COIL_FUEL_ENERGY,
+                             DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE, DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE,
+                             DATA.SYSTEM_NODE_TEMPERATURE]
+
+# Time series of the training runs (weather and scheduled setpoints) are stored per minute of a leap year, so that any year can be simulated
+MINUTES_PER_YEAR = 366 * 1440
+_DAYS_BEFORE_MONTH = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+
+def get_minute_of_year(times):
+    times = pd.DatetimeIndex(times)
+    return (_DAYS_BEFORE_MONTH[times.month - 1] + times.day - 1) * 1440 + times.hour * 60 + times.minute
+
+
+def fit_linear(features, target):
+    # Least squares fit of target ~ features @ theta (rows with NaN are ignored)
+    valid = np.isfinite(features).all(axis=1) & np.isfinite(target)
+    if not valid.any():
+        return np.zeros(features.shape[1])
+    return np.linalg.lstsq(features[valid], target[valid], rcond=None)[0]
+
+
+def get_series_of_year(minute_of_year, values):
+    # Values of every minute of the year, linearly interpolated (periodically) between the minutes of the training runs
+    valid = np.isfinite(values)
+    minute_of_year, values = np.asarray(minute_of_year)[valid], np.asarray(values, dtype=float)[valid]
+    minute_of_year, index_unique = np.unique(minute_of_year, return_index=True)
+    return np.interp(np.arange(MINUTES_PER_YEAR), minute_of_year, values[index_unique], period=MINUTES_PER_YEAR).astype(np.float32)
+
+
+class SurrogateModel:
+    """
+    Reduced-order model of one building, fitted from the results files of Alfalfa runs:
+      - conditioned zones: ARX model of temperature (previous temperature, outdoor temperature, coil runtime fractions) and humidity
+      - unconditioned zones: ARX model of temperature (previous temperature, outdoor temperature, first conditioned zone) and humidity
+      - coil runtime fractions: clipped linear regression on the setpoint error of the first conditioned zone and outdoor temperature
+      - energy, flow rates and node temperature: linear regression on the coil runtime fractions
+    The outdoor temperature and the scheduled setpoints (used without control input) are taken from the training runs by minute of year.
+    """
+    def __init__(self, name, conditioned_zones, unconditioned_zones, time_step_size=1):
+        self.name = name
+        self.conditioned_zones = conditioned_zones
+        self.unconditioned_zones = unconditioned_zones
+        self.time_step_size = time_step_size
+        self.theta_temperature = None   # (conditioned zones, 5)
+        self.theta_humidity = None      # (conditioned zones, 4)
+        self.theta_unconditioned_temperature = None     # (unconditioned zones, 4)
+        self.theta_unconditioned_humidity = None        # (unconditioned zones, 3)
+        self.theta_runtime_heating = None   # (3,)
+        self.theta_runtime_cooling = None   # (3,)
+        self.theta_system = dict()          # channel --> (5,)
+        self.outdoor_temperature = None     # (MINUTES_PER_YEAR,)
+        self.heating_setpoint_schedule = None
+        self.cooling_setpoint_schedule = None
+        self.state_initial = None
+
+    def fit(self, list_record_data):
+        """
+        :param list_record_data: results DataFrames of the building (e.g., read_results() of several Alfalfa runs)
+        """
+        features = {'temperature': [], 'humidity': [], 'unconditioned_temperature': [], 'unconditioned_humidity': [],
+                    'runtime_heating': [], 'runtime_cooling': [], 'system': []}
+        targets = {key: [] for key in features}
+        series_of_year = []
+        for record_data in list_record_data:
+            output_data, _, _ = record_to_output_data(record_data)
+            output_data = output_data.sort_values(DATA.TIME_SIM)
+            temperature = output_data[[zone_name + ' ' + DATA.ZONE_MEAN_TEMP for zone_name in self.conditioned_zones]].to_numpy(dtype=float)
+            humidity = output_data[[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY for zone_name in self.conditioned_zones]].to_numpy(dtype=float)
+            temperature_unconditioned = output_data[[zone_name + ' ' + DATA.ZONE_MEAN_TEMP for zone_name in self.unconditioned_zones]].to_numpy(dtype=float)
+            humidity_unconditioned = output_data[[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY for zone_name in self.unconditioned_zones]].to_numpy(dtype=float)
+            outdoor_temperature = output_data[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE].to_numpy(dtype=float)
+            runtime_heating = output_data[DATA.HEATING_COIL_RUNTIME_FRACTION].to_numpy(dtype=float)
+            runtime_cooling = output_data[DATA.COOLING_COIL_RUNTIME_FRACTION].to_numpy(dtype=float)
+            heating_setpoint = output_data[DATA.HEATING_SETPOINT_BASE].to_numpy(dtype=float)
+            cooling_setpoint = output_data[DATA.COOLING_SETPOINT_BASE].to_numpy(dtype=float)
+            ones = np.ones(len(output_data) - 1)
+
+            # Row k+1 is explained by the state of row k and the inputs/outputs over the step from k to k+1
+            features['temperature'].append([np.column_stack([temperature[:-1, index], outdoor_temperature[1:], runtime_heating[1:], runtime_cooling[1:], ones])
+                                            for index in range(len(self.conditioned_zones))])
+            targets['temperature'].append([temperature[1:, index] for index in range(len(self.conditioned_zones))])
+            features['humidity'].append([np.column_stack([humidity[:-1, index], outdoor_temperature[1:], runtime_cooling[1:], ones])
+                                         for index in range(len(self.conditioned_zones))])
+            targets['humidity'].append([humidity[1:, index] for index in range(len(self.conditioned_zones))])
+            features['unconditioned_temperature'].append([np.column_stack([temperature_unconditioned[:-1, index], outdoor_temperature[1:], temperature[:-1, 0], ones])
+                                                          for index in range(len(self.unconditioned_zones))])
+            targets['unconditioned_temperature'].append([temperature_unconditioned[1:, index] for index in range(len(self.unconditioned_zones))])
+            features['unconditioned_humidity'].append([np.column_stack([humidity_unconditioned[:-1, index], outdoor_temperature[1:], ones])
+                                                       for index in range(len(self.unconditioned_zones))])
+            targets['unconditioned_humidity'].append([humidity_unconditioned[1:, index] for index in range(len(self.unconditioned_zones))])
+            features['runtime_heating'].append([np.column_stack([np.maximum(heating_setpoint[1:] - temperature[:-1, 0], 0), outdoor_temperature[1:], ones])])
+            targets['runtime_heating'].append([runtime_heating[1:]])
+            features['runtime_cooling'].append([np.column_stack([np.maximum(temperature[:-1, 0] - cooling_setpoint[1:], 0), outdoor_temperature[1:], ones])])
+            targets['runtime_cooling'].append([runtime_cooling[1:]])
+            features['system'].append([get_system_features(runtime_heating, runtime_cooling, outdoor_temperature)])
+            targets['system'].append([output_data[channel].to_numpy(dtype=float) if channel in output_data else np.zeros(len(output_data))
+                                      for channel in SURROGATE_SYSTEM_CHANNELS])
+
+            series_of_year.append((get_minute_of_year(output_data[DATA.TIME_SIM]), outdoor_temperature, heating_setpoint, cooling_setpoint))
+            if self.state_initial is None:
+                self.state_initial = {'temperature': temperature[0], 'humidity': humidity[0],
+                                      'unconditioned_temperature': temperature_unconditioned[0], 'unconditioned_humidity': humidity_unconditioned[0]}
+
+        def fit_stacked(key, index_target, index_features=0):
+            # Same model fitted on the rows of every training run
+            return fit_linear(np.concatenate([features_run[index_features] for features_run in features[key]]),
+                              np.concatenate([targets_run[index_target] for targets_run in targets[key]]))
+
+        self.theta_temperature = np.array([fit_stacked('temperature', index, index) for index in range(len(self.conditioned_zones))])
+        self.theta_humidity = np.array([fit_stacked('humidity', index, index) for index in range(len(self.conditioned_zones))])
+        self.theta_unconditioned_temperature = np.array([fit_stacked('unconditioned_temperature', index, index) for index in range(len(self.unconditioned_zones))]).reshape(-1, 4)
+        self.theta_unconditioned_humidity = np.array([fit_stacked('unconditioned_humidity', index, index) for index in range(len(self.unconditioned_zones))]).reshape(-1, 3)
+        self.theta_runtime_heating = fit_stacked('runtime_heating', 0)
+        self.theta_runtime_cooling = fit_stacked('runtime_cooling', 0)
+        self.theta_system = {channel: fit_stacked('system', index) for index, channel in enumerate(SURROGATE_SYSTEM_CHANNELS)}
+
+        minute_of_year = np.concatenate([series[0] for series in series_of_year])
+        self.outdoor_temperature = get_series_of_year(minute_of_year, np.concatenate([series[1] for series in series_of_year]))
+        self.heating_setpoint_schedule = get_series_of_year(minute_of_year, np.concatenate([series[2] for series in series_of_year]))
+        self.cooling_setpoint_schedule = get_series_of_year(minute_of_year, np.concatenate([series[3] for series in series_of_year]))
+        return self
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+        return path
+
+
+def get_system_features(runtime_heating, runtime_cooling, outdoor_temperature):
+    return np.column_stack([runtime_heating, runtime_cooling, runtime_heating * outdoor_temperature, runtime_cooling * outdoor_temperature,
+                            np.ones(len(runtime_heating))])
+
+
+def fit_surrogate_model(list_path_results, name=None, time_step_size=1):
+    # Fit the surrogate of a building from the results files of its Alfalfa runs
+    list_record_data = [read_results(path_results) for path_results in list_path_results]
+    conditioned_zones, unconditioned_zones = get_zone_names(list_record_data[0])
+    if name is None:
+        name = os.path.splitext(os.path.basename(list_path_results[0]))[0]
+    return SurrogateModel(name, conditioned_zones, unconditioned_zones, time_step_size=time_step_size).fit(list_record_data)
+
+
+def load_surrogate_model(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+class SurrogateSites:
+    """
+    State of every site simulated with the same surrogate model, as arrays over sites (rows), so that the sites are advanced together.
+    """
+    def __init__(self, model: SurrogateModel):
+        self.model = model
+        self.site_ids = []
+        self.time_sim = np.array([], dtype='datetime64[m]')
+        self.temperature = np.zeros((0, len(model.conditioned_zones)))
+        self.humidity = np.zeros((0, len(model.conditioned_zones)))
+        self.unconditioned_temperature = np.zeros((0, len(model.unconditioned_zones)))
+        self.unconditioned_humidity = np.zeros((0, len(model.unconditioned_zones)))
+        self.heating_setpoint_input = np.zeros(0)   # NaN: no control input (scheduled setpoint of the training runs)
+        self.cooling_setpoint_input = np.zeros(0)
+        self.outputs = {channel: np.zeros(0) for channel in SURROGATE_SYSTEM_CHANNELS +
+                        [DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE, DATA.HEATING_SETPOINT_BASE, DATA.COOLING_SETPOINT_BASE,
+                         DATA.HEATING_COIL_RUNTIME_FRACTION, DATA.COOLING_COIL_RUNTIME_FRACTION]}
+
+    def add_site(self, site_id, time_start):
+        self.site_ids.append(site_id)
+        self.time_sim = np.append(self.time_sim, np.datetime64(time_start, 'm'))
+        self.temperature = np.vstack([self.temperature, self.model.state_initial['temperature']])
+        self.humidity = np.vstack([self.humidity, self.model.state_initial['humidity']])
+        self.unconditioned_temperature = np.vstack([self.unconditioned_temperature, self.model.state_initial['unconditioned_temperature']])
+        self.unconditioned_humidity = np.vstack([self.unconditioned_humidity, self.model.state_initial['unconditioned_humidity']])
+        self.heating_setpoint_input = np.append(self.heating_setpoint_input, np.nan)
+        self.cooling_setpoint_input = np.append(self.cooling_setpoint_input, np.nan)
+        for channel in self.outputs:
+            self.outputs[channel] = np.append(self.outputs[channel], 0.0)
+        self.compute_outputs(np.array([len(self.site_ids) - 1]), advance=False)
+        return len(self.site_ids) - 1
+
+    def compute_outputs(self, rows, advance=True):
+        # Advance the given rows by one time step (or only compute the outputs of the current state if advance == False)
+        model = self.model
+        if advance:
+            self.time_sim[rows] += np.timedelta64(model.time_step_size, 'm')
+        minute_of_year = get_minute_of_year(self.time_sim[rows])
+        outdoor_temperature = model.outdoor_temperature[minute_of_year].astype(float)
+        heating_setpoint = np.where(np.isnan(self.heating_setpoint_input[rows]), model.heating_setpoint_schedule[minute_of_year], self.heating_setpoint_input[rows])
+        cooling_setpoint = np.where(np.isnan(self.cooling_setpoint_input[rows]), model.cooling_setpoint_schedule[minute_of_year], self.cooling_setpoint_input[rows])
+
+        temperature = self.temperature[rows]
+        if advance:
+            ones = np.ones(len(rows))
+            runtime_heating = np.clip(np.column_stack([np.maximum(heating_setpoint - temperature[:, 0], 0), outdoor_temperature, ones]) @ model.theta_runtime_heating, 0, 1)
+            runtime_cooling = np.clip(np.column_stack([np.maximum(temperature[:, 0] - cooling_setpoint, 0), outdoor_temperature, ones]) @ model.theta_runtime_cooling, 0, 1)
+            theta = model.theta_temperature
+            self.temperature[rows] = temperature * theta[:, 0] + outdoor_temperature[:, None] * theta[:, 1] + \
+                                     runtime_heating[:, None] * theta[:, 2] + runtime_cooling[:, None] * theta[:, 3] + theta[:, 4]
+            theta = model.theta_humidity
+            self.humidity[rows] = np.clip(self.humidity[rows] * theta[:, 0] + outdoor_temperature[:, None] * theta[:, 1] +
+                                          runtime_cooling[:, None] * theta[:, 2] + theta[:, 3], 0, 100)
+            theta = model.theta_unconditioned_temperature
+            self.unconditioned_temperature[rows] = self.unconditioned_temperature[rows] * theta[:, 0] + outdoor_temperature[:, None] * theta[:, 1] + \
+                                                   temperature[:, :1] * theta[:, 2] + theta[:, 3]
+            theta = model.theta_unconditioned_humidity
+            self.unconditioned_humidity[rows] = np.clip(self.unconditioned_humidity[rows] * theta[:, 0] + outdoor_temperature[:, None] * theta[:, 1] + theta[:, 2], 0, 100)
+        else:
+            runtime_heating, runtime_cooling = np.zeros(len(rows)), np.zeros(len(rows))
+
+        features_system = get_system_features(runtime_heating, runtime_cooling, outdoor_temperature)
+        for channel in SURROGATE_SYSTEM_CHANNELS:
+            self.outputs[channel][rows] = features_system @ model.theta_system[channel]
+        self.outputs[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE][rows] = outdoor_temperature
+        self.outputs[DATA.HEATING_SETPOINT_BASE][rows] = heating_setpoint
+        self.outputs[DATA.COOLING_SETPOINT_BASE][rows] = cooling_setpoint
+        self.outputs[DATA.HEATING_COIL_RUNTIME_FRACTION][rows] = runtime_heating
+        self.outputs[DATA.COOLING_COIL_RUNTIME_FRACTION][rows] = runtime_cooling
+        return
+
+    def get_output_step(self, row):
+        output_step = {channel: float(values[row]) for channel, values in self.outputs.items()}
+        for index, zone_name in enumerate(self.model.conditioned_zones):
+            output_step[zone_name + ' ' + DATA.ZONE_MEAN_TEMP] = float(self.temperature[row, index])
+            output_step[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY] = float(self.humidity[row, index])
+            # The zone setpoint follows the coil in operation
+            output_step[zone_name + ' ' + DATA.ZONE_TEMPERATURE_SETPOINT] = output_step[DATA.COOLING_SETPOINT_BASE] \
+                if output_step[DATA.COOLING_COIL_RUNTIME_FRACTION] > 0 else output_step[DATA.HEATING_SETPOINT_BASE]
+        for index, zone_name in enumerate(self.model.unconditioned_zones):
+            output_step[zone_name + ' ' + DATA.ZONE_MEAN_TEMP] = float(self.unconditioned_temperature[row, index])
+            output_step[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY] = float(self.unconditioned_humidity[row, index])
+        return output_step
+
+
+class SurrogateClient:
+    """
+    In-process client with the surface of alfalfa_client.AlfalfaClient used by CoSimCore (submit, set_alias, get_alias, wait, start,
+    status, set_inputs, advance, get_outputs, get_sim_time, stop), running surrogate models instead of EnergyPlus.
+    The model path given to submit() is the path of a saved SurrogateModel (see SurrogateModel.save()).
+    Sites of the same surrogate model are advanced together as arrays, e.g., advance(site_ids) of thousands of homes is one NumPy pass.
+    """
+    def __init__(self, host=None):
+        self.host = host
+        self.models = dict()        # path --> SurrogateModel
+        self.sites = dict()         # path --> SurrogateSites
+        self.site_rows = dict()     # site_id --> (SurrogateSites, row)
+        self.site_status = dict()
+        self.aliases = dict()
+        # Sessions may be initialized by threads (e.g., CoSimGroup), while the arrays of the sites are extended
+        self.lock = threading.Lock()
+
+    def submit(self, model_path, wait_for_status=True):
+        with self.lock:
+            if model_path not in self.models:
+                self.models[model_path] = load_surrogate_model(model_path)
+                self.sites[model_path] = SurrogateSites(self.models[model_path])
+        site_id = str(uuid.uuid4())
+        self.site_rows[site_id] = (self.sites[model_path], None)
+        self.site_status[site_id] = 'ready'
+        return site_id
+
+    def set_alias(self, alias, site_id):
+        self.aliases[alias] = site_id
+
+    def get_alias(self, alias):
+        return self.aliases[alias]
+
+    def wait(self, site_id, desired_status):
+        return
+
+    def status(self, site_id):
+        return self.site_status[site_id]
+
+    def start(self, site_id, start_datetime, end_datetime=None, timescale=None, external_clock=True, realtime=False, wait_for_status=True):
+        sites, _ = self.site_rows[site_id]
+        with self.lock:
+            self.site_rows[site_id] = (sites, sites.add_site(site_id, start_datetime))
+        self.site_status[site_id] = 'running'
+
+    def set_inputs(self, site_id, inputs):
+        sites, row = self.site_rows[site_id]
+        if CONTROL.HEATING_SETPOINT_TO_ALFALFA in inputs:
+            sites.heating_setpoint_input[row] = inputs[CONTROL.HEATING_SETPOINT_TO_ALFALFA]
+        if CONTROL.COOLING_SETPOINT_TO_ALFALFA in inputs:
+            sites.cooling_setpoint_input[row] = inputs[CONTROL.COOLING_SETPOINT_TO_ALFALFA]
+
+    def advance(self, site_ids):
+        # Rows of the same model are advanced together
+        rows_per_sites = dict()
+        for site_id in site_ids:
+            sites, row = self.site_rows[site_id]
+            rows_per_sites.setdefault(id(sites), (sites, []))[1].append(row)
+        for sites, rows in rows_per_sites.values():
+            sites.compute_outputs(np.array(rows))
+
+    def get_outputs(self, site_id):
+        sites, row = self.site_rows[site_id]
+        return sites.get_output_step(row)
+
+    def get_sim_time(self, site_id):
+        sites, row = self.site_rows[site_id]
+        return sites.time_sim[row].item()
+
+    def stop(self, site_id):
+        self.site_status[site_id] = 'complete'
+
+
+def simulate_record(model: SurrogateModel, record_data):
+    """
+    Open-loop simulation of the surrogate with the setpoints applied in a results file, from the initial state of that file.
+    :return: output DataFrame of the surrogate, with the columns of record_to_output_data()
+    """
+    output_data, _, _ = record_to_output_data(record_data)
+    output_data = output_data.sort_values(DATA.TIME_SIM).reset_index(drop=True)
+    sites = SurrogateSites(model)
+    sites.add_site('held_out', pd.Timestamp(output_data[DATA.TIME_SIM].iloc[0]).to_pydatetime())
+    sites.temperature[0] = output_data[[zone_name + ' ' + DATA.ZONE_MEAN_TEMP for zone_name in model.conditioned_zones]].iloc[0].to_numpy(dtype=float)
+    sites.humidity[0] = output_data[[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY for zone_name in model.conditioned_zones]].iloc[0].to_numpy(dtype=float)
+    sites.unconditioned_temperature[0] = output_data[[zone_name + ' ' + DATA.ZONE_MEAN_TEMP for zone_name in model.unconditioned_zones]].iloc[0].to_numpy(dtype=float)
+    sites.unconditioned_humidity[0] = output_data[[zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY for zone_name in model.unconditioned_zones]].iloc[0].to_numpy(dtype=float)
+
+    list_output_step = [sites.get_output_step(0)]
+    rows = np.array([0])
+    for heating_setpoint, cooling_setpoint in zip(output_data[DATA.HEATING_SETPOINT_BASE].iloc[1:], output_data[DATA.COOLING_SETPOINT_BASE].iloc[1:]):
+        sites.heating_setpoint_input[0] = heating_setpoint
+        sites.cooling_setpoint_input[0] = cooling_setpoint
+        sites.compute_outputs(rows)
+        list_output_step.append(sites.get_output_step(0))
+    simulated_data = pd.DataFrame(list_output_step)
+    simulated_data[DATA.TIME_SIM] = output_data[DATA.TIME_SIM]
+    return simulated_data
+
+
+def accuracy_report(model: SurrogateModel, list_path_results_held_out):
+    """
+    Accuracy of the surrogate against held-out Alfalfa runs (results files not used for fitting), simulated open-loop with the recorded setpoints.
+    :return: DataFrame with one row per results file and channel (RMSE, MAE, bias and relative error of the total for energy channels)
+    """
+    rows = []
+    for path_results in list_path_results_held_out:
+        output_data, _, _ = record_to_output_data(read_results(path_results))
+        output_data = output_data.sort_values(DATA.TIME_SIM).reset_index(drop=True)
+        simulated_data = simulate_record(model, read_results(path_results))
+        channels = [zone_name + ' ' + DATA.ZONE_MEAN_TEMP for zone_name in model.conditioned_zones + model.unconditioned_zones] + \
+                   [zone_name + ' ' + DATA.ZONE_RELATIVE_HUMIDITY for zone_name in model.conditioned_zones] + \
+                   [DATA.HEATING_COIL_RUNTIME_FRACTION, DATA.COOLING_COIL_RUNTIME_FRACTION] + \
+                   [channel for channel in SURROGATE_SYSTEM_CHANNELS if channel in output_data]
+        for channel in channels:
+            error = simulated_data[channel].to_numpy(dtype=float) - output_data[channel].to_numpy(dtype=float)
+            total = output_data[channel].astype(float).sum()
+            rows.append({'path_results': path_results,
+                         'channel': channel,
+                         'rmse': float(np.sqrt(np.nanmean(error ** 2))),
+                         'mae': float(np.nanmean(np.abs(error))),
+                         'bias': float(np.nanmean(error)),
+                         'total_relative_error': float(simulated_data[channel].sum() / total - 1) if channel in SURROGATE_SYSTEM_CHANNELS and total != 0 else np.nan})
+    return pd.DataFrame(rows)
@@ -0,0 +1,280 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from CoSimCore import CoSimCore
+from CoSimDict import SETTING
+from CoSimBackend import BACKENDS
+from thermostat import thermostat
+
+
+def get_latency_percentiles(latencies):
+    latencies = np.asarray(latencies, dtype=float)
+    if latencies.size == 0:
+        return {'latency_p50': None, 'latency_p95': None, 'latency_p99': None}
+    return {'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_p99': float(np.percentile(latencies, 99))}
+
+
+def create_probe_session(index, host, model_path, backend_name='alfalfa', time_start=datetime.datetime(2019, 1, 1), time_step_size=1):
+    # Short pass-through session of the calibration (no occupant model)
+    return CoSimCore(alias=f'Probe{index + 1}',
+                     building_model_information={SETTING.ALFALFA_URL: host,
+                                                 SETTING.BACKEND: backend_name,
+                                                 SETTING.NAME_BUILDING_MODEL: 'probe',
+                                                 BACKENDS[backend_name].model_path_setting: model_path,
+                                                 SETTING.CONDITIONED_ZONES: [],
+                                                 SETTING.UNCONDITIONED_ZONES: []},
+                     simulation_information={SETTING.TIME_START: time_start,
+                                             SETTING.TIME_END: time_start + datetime.timedelta(days=1),
+                                             SETTING.TIME_STEP_SIZE: time_step_size,
+                                             SETTING.TIME_SCALE_BUILDING_SIMULATION: time_step_size,
+                                             SETTING.EXTERNAL_CLOCK: True},
+                     occupant_model_information={key: None for key in [SETTING.OCCUPANT_MODEL, SETTING.NUM_OCCUPANT, SETTING.NUM_HOME,
+                                                                       SETTING.DISCOMFORT_THEORY, SETTING.OCCUP_COMFORT_TEMPERATURE,
+                                                                       SETTING.DISCOMFORT_THEORY_THRESHOLD, SETTING.TFT_ALPHA, SETTING.TFT_BETA,
+                                                                       SETTING.PATH_OCCUPANT_MODEL_DATA]},
+                     thermostat_model_information={SETTING.THERMOSTAT_MODEL: thermostat,
+                                                   SETTING.THERMOSTAT_SCHEDULE_TYPE: 'default',
+                                                   SETTING.CURRENT_DATETIME: time_start,
+                                                   SETTING.IDF_DB: 0.0})
+
+
+def probe_concurrency(create_session, concurrency, steps=60, timeout_seconds=1800.0, logger=None):
+    """
+    Run `concurrency` short sessions at once (threads: the sessions wait for the deployment), which start stepping together once
+    every session is initialized, and measure the aggregate steps/second and the latency of the steps (advance and outputs).
+    :param create_session: function of the index of a session returning a CoSimCore (e.g., create_probe_session())
+    """
+    barrier = threading.Barrier(concurrency, timeout=timeout_seconds)
+    times_first_step = []
+
+    def run(index):
+        cosim_session = create_session(index)
+        time_request = time.perf_counter()
+        try:
+            cosim_session.initialize(shared_occupant_model=True)
+        except Exception:
+            barrier.abort()
+            raise
+        time_initialize = time.perf_counter() - time_request
+        barrier.wait()
+        times_first_step.append(time.perf_counter())
+        latencies = []
+        try:
+            for _ in range(steps):
+                time_request = time.perf_counter()
+                cosim_session.proceed_simulation(control_input={'u': {}}, control_information=None)
+                cosim_session.retrieve_outputs()
+                latencies.append(time.perf_counter() - time_request)
+        finally:
+            cosim_session.tear_down()
+        return time_initialize, latencies, time.perf_counter()
+
+    list_result, errors = [], []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run, index) for index in range(concurrency)]:
+            try:
+                list_result.append(future.result())
+            except Exception as e:
+                errors.append(repr(e))
+    latencies = [latency for _, list_latency, _ in list_result for latency in list_latency]
+    time_stepping = max(time_end for _, _, time_end in list_result) - min(times_first_step) if list_result and times_first_step else None
+    result = {'concurrency': concurrency,
+              'steps': len(latencies),
+              'steps_per_second': len(latencies) / time_stepping if time_stepping else 0.0,
+              **get_latency_percentiles(latencies),
+              'time_initialize_mean': float(np.mean([time_initialize for time_initialize, _, _ in list_result])) if list_result else None,
+              'errors': errors}
+    if logger is not None: logger.info(f"Concurrency {concurrency}: {result['steps_per_second']:.1f} steps/s, p95 latency {result['latency_p95']} s, "
+                                       f"{len(errors)} errors", extra={'probe': result})
+    return result
+
+
+def calibrate(create_session, levels=(1, 2, 4, 8, 16, 32), steps=60, latency_factor=2.0, min_gain=0.05, logger=None):
+    """
+    Probe increasing levels of concurrency until the aggregate throughput stops growing (gain < min_gain), the p95 step latency exceeds
+    latency_factor times the one of the first level, or sessions fail.
+    :return: calibration: recommended concurrency (highest throughput within the latency limit), its latency target for
+             AdaptiveConcurrency, and the results of every level
+    """
+    list_result = []
+    for concurrency in levels:
+        result = probe_concurrency(create_session, concurrency, steps=steps, logger=logger)
+        list_result.append(result)
+        if result['errors'] or result['latency_p95'] is None:
+            break
+        if result['latency_p95'] > latency_factor * list_result[0]['latency_p95']:
+            break
+        if len(list_result) > 1 and result['steps_per_second'] < (1 + min_gain) * max(result_each['steps_per_second'] for result_each in list_result[:-1]):
+            break
+
+    valid = [result for result in list_result if not result['errors'] and result['latency_p95'] is not None and
+             result['latency_p95'] <= latency_factor * list_result[0]['latency_p95']]
+    best = max(valid, key=lambda result: result['steps_per_second']) if valid else None
+    return {'recommended': best['concurrency'] if best is not None else 1,
+            'latency_target': best['latency_p95'] * latency_factor if best is not None else None,
+            'time_calibrated': time.time(),
+            'results': list_result}
+
+
+def write_calibration(path, calibration):
+    with open(path, 'w') as file:
+        json.dump(calibration, file, indent=2, default=str)
+    return path
+
+
+def read_calibration(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+class ConcurrencySlot:
+    """
+    Slot of a session in an AdaptiveConcurrency, held while the session steps (see CoSimMain.run_each_session()).
+    step() is called after every control decision: the step latencies are kept locally, and every `window_steps` steps their p95 is
+    reported, the slot is released and acquired again, so that the session waits while the limit is lower than the active sessions.
+    Without limiter (None), step() only returns.
+    """
+    def __init__(self, limiter, alias, window_steps=60, logger=None):
+        self.limiter = limiter
+        self.alias = alias
+        self.window_steps = window_steps
+        self.logger = logger
+        self.latencies = []
+        self.time_last = None
+        self.acquired = False
+
+    def acquire(self):
+        if self.limiter is None:
+            return self
+        time_wait = self.limiter.acquire()
+        self.acquired = True
+        if time_wait > 1.0 and self.logger is not None:
+            self.logger.info(f'Waited {time_wait:.1f} s for a concurrency slot')
+        self.time_last = time.perf_counter()
+        return self
+
+    def release(self, latency=None):
+        if self.limiter is None or not self.acquired:
+            return
+        self.acquired = False
+        limit_changed = self.limiter.release(latency)
+        if limit_changed is not None and self.logger is not None:
+            self.logger.info(f'Concurrency limit: {limit_changed} (p95 step latency: {latency:.3f} s)', extra={'limit': limit_changed})
+
+    def step(self, steps=1):
+        if self.limiter is None:
+            return
+        time_now = time.perf_counter()
+        self.latencies.append((time_now - self.time_last) / max(steps, 1))
+        self.time_last = time_now
+        if len(self.latencies) >= self.window_steps:
+            latency = float(np.percentile(self.latencies, 95))
+            self.latencies = []
+            self.release(latency)
+            self.acquire()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release(float(np.percentile(self.latencies, 95)) if self.latencies else None)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit of the sessions stepping at once on a deployment, adapted at runtime (AIMD): the limit is decreased by `decrease_factor` when
+    the p95 step latency reported by a session exceeds the target, and increased by 1 while it stays below, at most once per `cooldown_seconds`.
+    The target is `latency_target` (e.g., from calibrate()) or `latency_factor` times the lowest latency reported.
+    The state is kept in a multiprocessing.Manager().dict(), so that the limiter can be used by joblib workers (see ConcurrencyController).
+    """
+    def __init__(self, state, lock, poll_seconds=0.5):
+        self.state = state
+        self.lock = lock
+        self.poll_seconds = poll_seconds
+
+    @staticmethod
+    def create_state(limit_max, limit_min=1, latency_target=None, latency_factor=2.0, decrease_factor=0.75, cooldown_seconds=60.0):
+        return {'limit': limit_max, 'limit_max': limit_max, 'limit_min': limit_min, 'active': 0,
+                'latency_target': latency_target, 'latency_factor': latency_factor, 'latency_min': None,
+                'decrease_factor': decrease_factor, 'cooldown_seconds': cooldown_seconds, 'time_changed': 0.0,
+                'decreases': 0, 'increases': 0}
+
+    def acquire(self):
+        # Wait until a slot is free, and return the time waited
+        time_start = time.monotonic()
+        while True:
+            with self.lock:
+                if self.state['active'] < self.state['limit']:
+                    self.state['active'] += 1
+                    return time.monotonic() - time_start
+            time.sleep(self.poll_seconds)
+
+    def release(self, latency=None):
+        # Free a slot and adapt the limit with the latency of the window; returns the new limit if it changed
+        with self.lock:
+            state = dict(self.state)
+            state['active'] = max(state['active'] - 1, 0)
+            limit_changed = None
+            if latency is not None:
+                state['latency_min'] = latency if state['latency_min'] is None else min(state['latency_min'], latency)
+                target = state['latency_target'] if state['latency_target'] is not None else state['latency_factor'] * state['latency_min']
+                if time.time() - state['time_changed'] >= state['cooldown_seconds']:
+                    if latency > target and state['limit'] > state['limit_min']:
+                        state['limit'] = max(state['limit_min'], int(state['limit'] * state['decrease_factor']))
+                        state['decreases'] += 1
+                        limit_changed = state['limit']
+                    elif latency <= target and state['limit'] < state['limit_max']:
+                        state['limit'] += 1
+                        state['increases'] += 1
+                        limit_changed = state['limit']
+                    if limit_changed is not None:
+                        state['time_changed'] = time.time()
+            self.state.update(state)
+        return limit_changed
+
+    def snapshot(self):
+        return dict(self.state)
+
+
+class ConcurrencyController:
+    # Owner of an AdaptiveConcurrency in the orchestrator (shared state of the workers)
+    def __init__(self, limit_max, **kwargs):
+        self.manager = multiprocessing.Manager()
+        self.limiter = AdaptiveConcurrency(self.manager.dict(AdaptiveConcurrency.create_state(limit_max, **kwargs)), self.manager.Lock())
+
+    def stop(self):
+        snapshot = self.limiter.snapshot()
+        self.manager.shutdown()
+        return snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calibration of the number of concurrent sessions of an Alfalfa deployment')
+    parser.add_argument('--host', default='http://localhost', help='URL of Alfalfa')
+    parser.add_argument('--model', required=True, help='building model (or surrogate model / results file for the surrogate / trace backends)')
+    parser.add_argument('--backend', default='alfalfa', help='backend of the sessions, e.g., surrogate as a local stand-in')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='concurrency levels probed, in order')
+    parser.add_argument('--steps', type=int, default=60, help='steps per session')
+    parser.add_argument('--latency-factor', type=float, default=2.0, help='maximum p95 latency, relative to the first level')
+    parser.add_argument('--min-gain', type=float, default=0.05, help='minimum throughput gain to probe the next level')
+    parser.add_argument('--output', default='concurrency_calibration.json', help='calibration file (concurrency_calibration in CoSimMain.py)')
+    args = parser.parse_args()
+
+    calibration = calibrate(lambda index: create_probe_session(index, args.host, args.model, backend_name=args.backend),
+                            levels=args.levels,
+                            steps=args.steps,
+                            latency_factor=args.latency_factor,
+                            min_gain=args.min_gain)
+    print(pd.DataFrame(calibration['results']).drop(columns=['errors']).to_string(index=False))
+    print(f"Recommended concurrency: {calibration['recommended']} (latency target: {calibration['latency_target']} s)")
+    print(f"Written to: {write_calibration(args.output, calibration)}")
@@ -1,14 +1,26 @@
 import tempfile
 import zipfile
 import os
+import io
+import base64
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
 from CoSimDict import DATA, SETTING, CONTROL
+from CoSimEvents import EVENT_CHANNELS, get_events_template, append_changes
+from CoSimKPI import KPI_ENERGY_CHANNELS
 
 
 # Note: the keys of record and output_step are not necessarily 1-to-1 matched
 #       e.g., record[DATA.STATUS][DATA.HEATING_SETPOINT_DEADBAND_APPLIED].append(output_step[DATA.HEATING_SETPOINT_BASE])
 #             record[DATA.STATUS][DATA.HEATING_SETPOINT_BASE].append(output_step[DATA.HEATING_SETPOINT_NEW])
-def update_record(output_step, record, conditioned_zones, unconditioned_zones, debug=False):
+def update_record(output_step, record, conditioned_zones, unconditioned_zones, kpi=None, steps=1, debug=False):
     ## Update records
+    # kpi: streaming KPIs of the session (see CoSimKPI.KPIAccumulator), fed with every recorded step
+    # steps: number of steps represented by output_step (for the KPIs), whose energy channels are the mean per step over these steps
+    if kpi is not None:
+        kpi.update(output_step, steps=steps)
+
     # Update data per zones
     # Data for each zone
     for zone_name in conditioned_zones:    
@@ -24,30 +36,34 @@ def update_record(output_step, record, conditioned_zones, unconditioned_zones, d
     record[DATA.STATUS][DATA.SYSTEM_NODE_TEMPERATURE].append(output_step[DATA.SYSTEM_NODE_TEMPERATURE])
     record[DATA.STATUS][DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE].append(output_step[DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE])
 
-    record[DATA.STATUS][DATA.HEATING_SETPOINT_DEADBAND_APPLIED].append(output_step[DATA.HEATING_SETPOINT_BASE])
-    record[DATA.STATUS][DATA.HEATING_SETPOINT_BASE].append(output_step[DATA.HEATING_SETPOINT_NEW])
-    record[DATA.STATUS][DATA.HEATING_SETPOINT_DEADBAND_UP].append(output_step[DATA.HEATING_SETPOINT_DEADBAND_UP])
-    record[DATA.STATUS][DATA.HEATING_SETPOINT_DEADBAND_DOWN].append(output_step[DATA.HEATING_SETPOINT_DEADBAND_DOWN])
-
-    record[DATA.STATUS][DATA.COOLING_SETPOINT_DEADBAND_APPLIED].append(output_step[DATA.COOLING_SETPOINT_BASE])
-    record[DATA.STATUS][DATA.COOLING_SETPOINT_BASE].append(output_step[DATA.COOLING_SETPOINT_NEW])
-    record[DATA.STATUS][DATA.COOLING_SETPOINT_DEADBAND_UP].append(output_step[DATA.COOLING_SETPOINT_DEADBAND_UP])
-    record[DATA.STATUS][DATA.COOLING_SETPOINT_DEADBAND_DOWN].append(output_step[DATA.COOLING_SETPOINT_DEADBAND_DOWN])
-
     record[DATA.STATUS][DATA.HEATING_COIL_RUNTIME_FRACTION].append(output_step[DATA.HEATING_COIL_RUNTIME_FRACTION])
     record[DATA.STATUS][DATA.COOLING_COIL_RUNTIME_FRACTION].append(output_step[DATA.COOLING_COIL_RUNTIME_FRACTION])
     record[DATA.STATUS][DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE].append(output_step[DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE])
     record[DATA.STATUS][DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE].append(output_step[DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE])
 
-    # Data about thermostat and
-    record[DATA.STATUS][DATA.THERMOSTAT_SCHEDULE].append(output_step[DATA.THERMOSTAT_SCHEDULE])
-    record[DATA.STATUS][DATA.THERMOSTAT_MODE].append(output_step[DATA.THERMOSTAT_MODE])
-
-    record[DATA.STATUS][DATA.OCCUPANT_MOTION].append(output_step[DATA.OCCUPANT_MOTION])
     record[DATA.STATUS][DATA.OCCUPANT_THERMAL_FRUSTRATION].append(output_step[DATA.OCCUPANT_THERMAL_FRUSTRATION])
     record[DATA.STATUS][DATA.OCCUPANT_COMFORT_DELTA].append(output_step[DATA.OCCUPANT_COMFORT_DELTA])
-    record[DATA.STATUS][DATA.OCCUPANT_HABITUAL_OVERRIDE].append(output_step[DATA.OCCUPANT_HABITUAL_OVERRIDE])
-    record[DATA.STATUS][DATA.OCCUPANT_DISCOMFORT_OVERRIDE].append(output_step[DATA.OCCUPANT_DISCOMFORT_OVERRIDE])
+
+    # Setpoints, deadbands, thermostat and occupant flags: change events if the record has DATA.EVENTS (see CoSimEvents.py),
+    # otherwise one value per step
+    values_event = {DATA.HEATING_SETPOINT_DEADBAND_APPLIED: output_step[DATA.HEATING_SETPOINT_BASE],
+                    DATA.HEATING_SETPOINT_BASE: output_step[DATA.HEATING_SETPOINT_NEW],
+                    DATA.HEATING_SETPOINT_DEADBAND_UP: output_step[DATA.HEATING_SETPOINT_DEADBAND_UP],
+                    DATA.HEATING_SETPOINT_DEADBAND_DOWN: output_step[DATA.HEATING_SETPOINT_DEADBAND_DOWN],
+                    DATA.COOLING_SETPOINT_DEADBAND_APPLIED: output_step[DATA.COOLING_SETPOINT_BASE],
+                    DATA.COOLING_SETPOINT_BASE: output_step[DATA.COOLING_SETPOINT_NEW],
+                    DATA.COOLING_SETPOINT_DEADBAND_UP: output_step[DATA.COOLING_SETPOINT_DEADBAND_UP],
+                    DATA.COOLING_SETPOINT_DEADBAND_DOWN: output_step[DATA.COOLING_SETPOINT_DEADBAND_DOWN],
+                    DATA.THERMOSTAT_SCHEDULE: output_step[DATA.THERMOSTAT_SCHEDULE],
+                    DATA.THERMOSTAT_MODE: output_step[DATA.THERMOSTAT_MODE],
+                    DATA.OCCUPANT_MOTION: output_step[DATA.OCCUPANT_MOTION],
+                    DATA.OCCUPANT_HABITUAL_OVERRIDE: output_step[DATA.OCCUPANT_HABITUAL_OVERRIDE],
+                    DATA.OCCUPANT_DISCOMFORT_OVERRIDE: output_step[DATA.OCCUPANT_DISCOMFORT_OVERRIDE]}
+    if DATA.EVENTS in record:
+        append_changes(record[DATA.EVENTS], output_step[DATA.TIME_SIM], values_event)
+    else:
+        for channel, value in values_event.items():
+            record[DATA.STATUS][channel].append(value)
 
     # Data about HVAC energy usage
     record[DATA.STATUS][DATA.COOLING_COIL_ELECTRICITY_ENERGY].append(output_step[DATA.COOLING_COIL_ELECTRICITY_ENERGY])
@@ -61,7 +77,9 @@ def update_record(output_step, record, conditioned_zones, unconditioned_zones, d
     return
 
 
-def get_record_template(name, time_start, time_end, conditioned_zones, unconditioned_zones, is_initial_record=False, output_step=None, debug=False):
+def get_record_template(name, time_start, time_end, conditioned_zones, unconditioned_zones, is_initial_record=False, output_step=None,
+                        events=False, debug=False):
+    # events: if True, the channels of CoSimEvents.EVENT_CHANNELS are recorded as change events in record[DATA.EVENTS]
     record = dict()
 
     if is_initial_record:
@@ -120,6 +138,11 @@ def get_record_template(name, time_start, time_end, conditioned_zones, unconditi
     record[DATA.STATUS][DATA.HEATING_COIL_FUEL_ENERGY] = []
     record[DATA.STATUS][DATA.HEATING_COIL_ELECTRICITY_ENERGY] = []
 
+    if events:
+        for channel in EVENT_CHANNELS:
+            del record[DATA.STATUS][channel]
+        record[DATA.EVENTS] = get_events_template()
+
     if output_step is not None:
         update_record(output_step=output_step,
                       record=record,
@@ -129,6 +152,65 @@ def get_record_template(name, time_start, time_end, conditioned_zones, unconditi
     return record
 
 
+def resample_record(record, time_step_size=1):
+    # Resample DATA.INPUT and DATA.STATUS of a record (with non-uniform time_sim, e.g., adaptive stepping) to a uniform grid
+    # Sensor channels are interpolated linearly, while setpoints, thermostat and occupant data are held until the next record
+    # Override flags are events: they are only set at the recorded step
+    # Energy channels are the mean per step since the previous record (see CoSimCore.proceed_simulation()): held back to the previous record
+    record_data = pd.DataFrame.from_dict({**record[DATA.INPUT], **record[DATA.STATUS]})
+    record_data[DATA.TIME_SIM] = pd.to_datetime(record_data[DATA.TIME_SIM])
+    record_data = record_data.drop_duplicates(subset=DATA.TIME_SIM, keep='last').set_index(DATA.TIME_SIM)
+    time_grid = pd.date_range(record_data.index[0], record_data.index[-1], freq=pd.Timedelta(minutes=time_step_size))
+
+    columns_held = [DATA.HEATING_SETPOINT_BASE, DATA.HEATING_SETPOINT_DEADBAND_APPLIED, DATA.HEATING_SETPOINT_DEADBAND_UP, DATA.HEATING_SETPOINT_DEADBAND_DOWN,
+                    DATA.COOLING_SETPOINT_BASE, DATA.COOLING_SETPOINT_DEADBAND_APPLIED, DATA.COOLING_SETPOINT_DEADBAND_UP, DATA.COOLING_SETPOINT_DEADBAND_DOWN,
+                    DATA.THERMOSTAT_SCHEDULE, DATA.THERMOSTAT_MODE,
+                    DATA.OCCUPANT_MOTION, DATA.OCCUPANT_THERMAL_FRUSTRATION, DATA.OCCUPANT_COMFORT_DELTA]
+    columns_event = [DATA.OCCUPANT_HABITUAL_OVERRIDE, DATA.OCCUPANT_DISCOMFORT_OVERRIDE]
+    record_data = record_data.reindex(record_data.index.union(time_grid))
+    for column in record_data.columns:
+        if column in columns_event:
+            record_data[column] = record_data[column].fillna(False).astype(bool)
+        elif column in KPI_ENERGY_CHANNELS:
+            record_data[column] = record_data[column].bfill()
+        elif column not in columns_held and pd.api.types.is_numeric_dtype(record_data[column]) and not pd.api.types.is_bool_dtype(record_data[column]):
+            record_data[column] = record_data[column].interpolate(method='time')
+        else:
+            record_data[column] = record_data[column].ffill()
+    record_data = record_data.loc[time_grid]
+    record_data.index.name = DATA.TIME_SIM
+    return record_data.reset_index()
+
+
+def get_zone_names(record_data):
+    # Conditioned and unconditioned zones of a results DataFrame, from its zone columns (e.g., 'living_1::Air Temperature (CONDITIONED)')
+    conditioned_zones, unconditioned_zones = [], []
+    for column in record_data.columns:
+        if '::' + DATA.ZONE_MEAN_TEMP + ' ' in column:
+            zone_name = column.split('::')[0]
+            if column.endswith(DATA.ZONE_UNCONDITIONED):
+                unconditioned_zones.append(zone_name)
+            else:
+                conditioned_zones.append(zone_name)
+    return conditioned_zones, unconditioned_zones
+
+
+def record_to_output_data(record_data):
+    # Inverse of update_record(): the columns of a results DataFrame renamed to the keys of output_step (see the note at the top)
+    conditioned_zones, unconditioned_zones = get_zone_names(record_data)
+    columns_output_step = {DATA.HEATING_SETPOINT_DEADBAND_APPLIED: DATA.HEATING_SETPOINT_BASE,
+                           DATA.HEATING_SETPOINT_BASE: DATA.HEATING_SETPOINT_NEW,
+                           DATA.COOLING_SETPOINT_DEADBAND_APPLIED: DATA.COOLING_SETPOINT_BASE,
+                           DATA.COOLING_SETPOINT_BASE: DATA.COOLING_SETPOINT_NEW}
+    for zone_name in conditioned_zones:
+        for variable in [DATA.ZONE_MEAN_TEMP, DATA.ZONE_RELATIVE_HUMIDITY, DATA.ZONE_TEMPERATURE_SETPOINT]:
+            columns_output_step[zone_name + '::' + variable + ' ' + DATA.ZONE_CONDITIONED] = zone_name + ' ' + variable
+    for zone_name in unconditioned_zones:
+        for variable in [DATA.ZONE_MEAN_TEMP, DATA.ZONE_RELATIVE_HUMIDITY]:
+            columns_output_step[zone_name + '::' + variable + ' ' + DATA.ZONE_UNCONDITIONED] = zone_name + ' ' + variable
+    return record_data.rename(columns=columns_output_step), conditioned_zones, unconditioned_zones
+
+
 def is_convertable_to_float(input_string):
     if input_string == None:
         return False
@@ -167,6 +249,70 @@ def create_model_archive(model_path, debug=False):
     return archive_path
 
 
+def read_schedule(schedule_info):
+    # Decode the uploaded schedule file (csv or excel) and index its rows by (month, day, hour, minute)
+    schedule_filename = schedule_info['filename']
+    schedule_contents = schedule_info['contents']
+    schedule_type, schedule_content_splitted = schedule_contents.split(',')
+    schedule_content_decoded = base64.b64decode(schedule_content_splitted)
+    # Assume that the user uploaded a CSV file
+    if 'csv' in schedule_filename:
+        schedule_dataframe = pd.read_csv(io.StringIO(schedule_content_decoded.decode('utf-8')))
+    # Assume that the user uploaded an excel file
+    elif 'xls' in schedule_filename:
+        schedule_dataframe = pd.read_excel(io.BytesIO(schedule_content_decoded))
+
+    time_year = 1900
+    index_exact_same = dict()
+    index_same_except_for_year = dict()
+    for index, row in schedule_dataframe.iterrows():
+        time_parsed = row['datetime'].split('  ')
+        time_month_day = time_parsed[0].split('/')
+        time_hour_minute_second = time_parsed[1].split(':')
+
+        time_hour = int(time_hour_minute_second[0])
+        time_month = int(time_month_day[0])
+        time_day = int(time_month_day[1])
+        time_minute = int(time_hour_minute_second[1])
+
+        # EP generate 24 O'clock, which is invalid time. It should be compensated to 0 O'clock of the next day
+        if time_hour == 24:
+            time_hour = 0
+            datetime_row = datetime(time_year, time_month, time_day, time_hour, time_minute)
+            datetime_row += timedelta(days=1)
+        else:
+            datetime_row = datetime(time_year, time_month, time_day, time_hour, time_minute)
+
+        # The first row with the exact time is used, otherwise the last row with the same time except for year
+        key = (datetime_row.month, datetime_row.day, datetime_row.hour, datetime_row.minute)
+        index_exact_same.setdefault(key + (datetime_row.year,), index)
+        index_same_except_for_year[key] = index
+
+    return {'dataframe': schedule_dataframe,
+            'index_exact_same': index_exact_same,
+            'index_same_except_for_year': index_same_except_for_year}
+
+
+def get_schedule_setpoints(schedule_lookup, datetime_time_sim):
+    # Setpoints/deadbands of the schedule row for the given time (None if there is no row for that time)
+    key = (datetime_time_sim.month, datetime_time_sim.day, datetime_time_sim.hour, datetime_time_sim.minute)
+    index = schedule_lookup['index_exact_same'].get(key + (datetime_time_sim.year,),
+                                                    schedule_lookup['index_same_except_for_year'].get(key))
+    if index is None:
+        return None
+
+    schedule_dataframe = schedule_lookup['dataframe']
+    setpoints_schedule = dict()
+    setpoints_schedule[DATA.HEATING_SETPOINT_NEW] = schedule_dataframe[DATA.HEATING_SETPOINT_NEW][index]
+    setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_UP][index]
+    setpoints_schedule[DATA.HEATING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.HEATING_SETPOINT_DEADBAND_DOWN][index]
+
+    setpoints_schedule[DATA.COOLING_SETPOINT_NEW] = schedule_dataframe[DATA.COOLING_SETPOINT_NEW][index]
+    setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_UP] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_UP][index]
+    setpoints_schedule[DATA.COOLING_SETPOINT_DEADBAND_DOWN] = schedule_dataframe[DATA.COOLING_SETPOINT_DEADBAND_DOWN][index]
+    return setpoints_schedule
+
+
 def initialize_control_information():
     control_information = dict()
     control_information[DATA.HEATING_SETPOINT_NEW] = None
@@ -226,3 +372,58 @@ def apply_deadband(mode, zone_mean_temperature, state, setpoints):
             return setpoint_current
     else:
         raise ValueError("Not valid mode:", mode)
+
+
+def apply_deadband_batch(mode, zone_mean_temperature, setpoint_current, setpoint_new, deadband_up, deadband_down):
+    # Vectorized version of apply_deadband(): every argument is an array (or a scalar broadcast to the arrays) over zones
+    deadband_tolerance = 0.005
+
+    zone_mean_temperature = np.asarray(zone_mean_temperature, dtype=float)
+    setpoint_current = np.asarray(setpoint_current, dtype=float)
+    setpoint_new = np.asarray(setpoint_new, dtype=float)
+    deadband_up = np.asarray(deadband_up, dtype=float)
+    deadband_down = np.asarray(deadband_down, dtype=float)
+
+    reached_down = zone_mean_temperature <= setpoint_new - deadband_down + deadband_tolerance
+    reached_up = zone_mean_temperature >= setpoint_new + deadband_up - deadband_tolerance
+    if mode == CONTROL.HEATING:
+        # Heating mode 1: Heat until the temperature approaches deadband up
+        # Heating mode 2: Wait until the temperature approaches deadband down
+        # Heating mode 3: Otherwise, do not change the setpoint
+        return np.where(reached_down, setpoint_new + deadband_up,
+                        np.where(reached_up, setpoint_new - deadband_down, setpoint_current))
+    elif mode == CONTROL.COOLING:
+        # Cooling mode 1: Cool until the temperature approaches deadband down
+        # Cooling mode 2: Wait until the temperature approaches deadband up
+        # Cooling mode 3: Otherwise, do not change the setpoint
+        return np.where(reached_up, setpoint_new - deadband_down,
+                        np.where(reached_down, setpoint_new + deadband_up, setpoint_current))
+    else:
+        raise ValueError("Not valid mode:", mode)
+
+
+class BatchDeadbandController:
+    """
+    Deadband controller for many zones (e.g., every conditioned zone of every session of a group) computed in one NumPy pass.
+    The hysteresis state (the setpoints currently applied to each zone) is kept in arrays between calls.
+    """
+    def __init__(self, setpoint_heating_initial, setpoint_cooling_initial):
+        self.setpoint_heating = np.array(setpoint_heating_initial, dtype=float)
+        self.setpoint_cooling = np.array(setpoint_cooling_initial, dtype=float)
+
+    def compute(self, zone_mean_temperature, setpoints):
+        # setpoints: {DATA.HEATING_SETPOINT_NEW: ..., DATA.HEATING_SETPOINT_DEADBAND_UP: ..., ...}, with arrays over zones or scalars
+        # Returns the heating and cooling setpoints to apply to every zone
+        self.setpoint_heating = apply_deadband_batch(mode=CONTROL.HEATING,
+                                                     zone_mean_temperature=zone_mean_temperature,
+                                                     setpoint_current=self.setpoint_heating,
+                                                     setpoint_new=setpoints[DATA.HEATING_SETPOINT_NEW],
+                                                     deadband_up=setpoints[DATA.HEATING_SETPOINT_DEADBAND_UP],
+                                                     deadband_down=setpoints[DATA.HEATING_SETPOINT_DEADBAND_DOWN])
+        self.setpoint_cooling = apply_deadband_batch(mode=CONTROL.COOLING,
+                                                     zone_mean_temperature=zone_mean_temperature,
+                                                     setpoint_current=self.setpoint_cooling,
+                                                     setpoint_new=setpoints[DATA.COOLING_SETPOINT_NEW],
+                                                     deadband_up=setpoints[DATA.COOLING_SETPOINT_DEADBAND_UP],
+                                                     deadband_down=setpoints[DATA.COOLING_SETPOINT_DEADBAND_DOWN])
+        return self.setpoint_heating, self.setpoint_cooling
@@ -5,6 +5,11 @@ This file contains the thermostat class that is used to control the heating and
 '''
 # Import libraries
 import datetime
+import logging
+from thermostat_schedule import get_compiled_timeline
+
+# Overrides are logged at DEBUG level (see CoSimLogging.py), so that they are not formatted unless enabled
+logger = logging.getLogger('cosim.thermostat')
 
 # Define thermostat class
 class thermostat():
@@ -12,14 +17,15 @@ class thermostat():
     This class contains the thermostat object that is used to control the heating and cooling setpoints of the building model.
     '''
     # Define class methods
-    def __init__(self,units='c', schedule_type:str = 'default', current_datetime:datetime = datetime.datetime.now(), db:float = 0.0) -> None:
+    def __init__(self,units='c', schedule_type:str = 'default', current_datetime:datetime = datetime.datetime.now(), db:float = 0.0, end_datetime:datetime = None) -> None:
         '''
         This function initializes the thermostat object.
+        schedule_type is either the name of a built-in program ('default'), the path of a JSON/CSV program definition, or a definition dictionary
+        (see thermostat_schedule.py).
+        The program is compiled into a transition table from current_datetime to end_datetime (one year by default).
         '''
-        self.schedule_type = schedule_type.lower()
+        self.schedule_type = schedule_type.lower() if isinstance(schedule_type, str) and schedule_type.lower() == 'default' else schedule_type
         self.schedule = None
-        if self.schedule_type != 'default':
-            raise ValueError('Only default schedule is supported at this time.')
         self.mode = None
         self.tstp_heat = None
         self.tstp_cool = None
@@ -27,6 +33,11 @@ class thermostat():
         self.first_run = True
         self.units = units.upper()
         self.db = db
+
+        # Compiled timeline shared with other thermostats using the same program, and the index of the next transition
+        end_datetime = end_datetime if end_datetime is not None else current_datetime + datetime.timedelta(days=366)
+        self.timeline = get_compiled_timeline(self.schedule_type, current_datetime, end_datetime, units=self.units)
+        self.index_next_transition = None
     
     def C_to_F(self,T):
         return (T * 9/5) + 32
@@ -56,20 +67,7 @@ class thermostat():
         '''
         This function returns the heating and cooling setpoints for the thermostat for the current time.
         '''
-        if self.schedule_type == 'default':
-            mode = 'auto'
-            if current_datetime.hour >= 6 and current_datetime.hour < 22:
-                schedule = 'home'
-                tstp_heat = 69
-                tstp_cool = 78
-                
-            elif current_datetime.hour >= 22 or current_datetime.hour < 6:
-                schedule = 'sleep'
-                tstp_heat = 67
-                tstp_cool = 80
-        if self.units == 'C':
-            tstp_heat = round(self.F_to_C(tstp_heat))
-            tstp_cool = round(self.F_to_C(tstp_cool))
+        mode, schedule, tstp_cool, tstp_heat = self.timeline.value_at(current_datetime)
         return mode, schedule, tstp_cool, tstp_heat
     
     def manual_override(self, tstp_heat:float, tstp_cool:float):
@@ -81,31 +79,39 @@ class thermostat():
         self.tstp_heat = tstp_heat
         self.tstp_cool = tstp_cool
 
-        print(f'Occupant has manually overridden the thermostat.\nNew heating setpoint: {self.tstp_heat}{self.units}\nNew cooling setpoint: {self.tstp_cool}{self.units}')
+        logger.debug('Occupant has manually overridden the thermostat. New heating setpoint: %s%s / New cooling setpoint: %s%s',
+                     self.tstp_heat, self.units, self.tstp_cool, self.units)
         return self.mode, self.schedule, self.tstp_cool, self.tstp_heat
     
     def check_to_change_schedule(self, current_datetime:datetime):
         '''
-        This function checks to see if the thermostat should return to its regular schedule.
+        This function checks to see if the thermostat should return to its regular schedule (i.e., the next transition is reached).
         '''
-        if current_datetime.hour == 6 and current_datetime.minute == 0:
-            change_schedule = True
-        elif current_datetime.hour == 22 and current_datetime.minute == 0:
-            change_schedule =  True
-        else:
-            change_schedule = False
-        return change_schedule
+        return self.index_next_transition < len(self.timeline.times) and \
+               self.timeline.times[self.index_next_transition] <= current_datetime
+
+    def next_transition_datetime(self):
+        '''
+        This function returns the datetime of the next schedule transition (None if there is no transition left in the horizon).
+        '''
+        if self.index_next_transition is None or self.index_next_transition >= len(self.timeline.times):
+            return None
+        return self.timeline.times[self.index_next_transition]
     
     def update_output(self, current_datetime:datetime):
         '''
         This function updates the thermostat output based on the current time and the next time the thermostat will return to its regular schedule.
         '''
         if self.first_run:
+            self.index_next_transition = self.timeline.index_after(current_datetime)
             self.mode, self.schedule, self.tstp_cool, self.tstp_heat = self.get_tstat_schedule_params(current_datetime)
             self.first_run = False
         else:
             change_schedule = self.check_to_change_schedule(current_datetime)
             if change_schedule:
-                self.mode, self.schedule, self.tstp_cool, self.tstp_heat = self.get_tstat_schedule_params(current_datetime)
+                # Move the pointer past every transition reached (more than one if the step is longer than the gap between transitions)
+                while self.check_to_change_schedule(current_datetime):
+                    self.index_next_transition += 1
+                self.mode, self.schedule, self.tstp_cool, self.tstp_heat = self.timeline.values[self.index_next_transition - 1]
         return self.mode, self.schedule, self.tstp_cool, self.tstp_heat
     
\ No newline at end of file
@@ -0,0 +1,180 @@
+'''
+thermostat_schedule.py
+
+This file contains the schedule engine of the thermostat model.
+A schedule program (weekly and/or seasonal setpoint entries) is compiled once into a transition table covering the simulation horizon,
+so that the thermostat only needs to move a pointer to the next transition at each step.
+
+Program definition (JSON):
+    {
+        "units": "F",
+        "mode": "auto",
+        "program": [
+            {"days": ["mon", "tue", "wed", "thu", "fri"], "months": [6, 7, 8], "time": "06:00", "schedule": "home", "heat": 69, "cool": 76},
+            {"time": "22:00", "schedule": "sleep", "heat": 67, "cool": 80},
+            ...
+        ]
+    }
+    - "days" and "months" are optional (every day / every month if omitted)
+    - each entry is a transition: the setpoints hold from "time" until the next applicable entry
+
+Program definition (CSV): one entry per row with the columns time, schedule, heat, cool and optional columns days, months, mode, units
+    - days and months are separated by ';' (e.g., "sat;sun" or "12;1;2"), empty for every day / every month
+'''
+# Import libraries
+import bisect
+import datetime
+import json
+import os
+import csv
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# Built-in programs, which can be selected by name via `schedule_type`
+DEFAULT_PROGRAMS = {
+    'default': {
+        'units': 'F',
+        'mode': 'auto',
+        'program': [
+            {'time': '06:00', 'schedule': 'home', 'heat': 69, 'cool': 78},
+            {'time': '22:00', 'schedule': 'sleep', 'heat': 67, 'cool': 80},
+        ]
+    },
+}
+
+# Compiled timelines are shared read-only by every thermostat of this process using the same program and horizon
+_COMPILED_TIMELINES = {}
+
+
+def load_schedule_definition(schedule_type):
+    '''
+    This function returns the program definition of a built-in schedule name, a JSON/CSV file path or a definition dictionary.
+    '''
+    if isinstance(schedule_type, dict):
+        return schedule_type
+    if schedule_type.lower() in DEFAULT_PROGRAMS:
+        return DEFAULT_PROGRAMS[schedule_type.lower()]
+    if not os.path.isfile(schedule_type):
+        raise ValueError(f'Unknown thermostat schedule: {schedule_type} (not a built-in schedule nor a JSON/CSV file)')
+
+    if schedule_type.lower().endswith('.json'):
+        with open(schedule_type, 'r') as file:
+            return json.load(file)
+    elif schedule_type.lower().endswith('.csv'):
+        definition = {'units': 'F', 'mode': 'auto', 'program': []}
+        with open(schedule_type, 'r', newline='') as file:
+            for row in csv.DictReader(file):
+                entry = {'time': row['time'], 'schedule': row['schedule'],
+                         'heat': float(row['heat']), 'cool': float(row['cool'])}
+                if row.get('days'):
+                    entry['days'] = [day.strip() for day in row['days'].split(';') if day.strip()]
+                if row.get('months'):
+                    entry['months'] = [int(month) for month in row['months'].split(';') if month.strip()]
+                if row.get('mode'):
+                    entry['mode'] = row['mode']
+                if row.get('units'):
+                    definition['units'] = row['units']
+                definition['program'].append(entry)
+        return definition
+    else:
+        raise ValueError(f'Thermostat schedule file should be JSON or CSV: {schedule_type}')
+
+
+def convert_setpoint(value, units_from, units_to):
+    '''
+    This function converts a setpoint between 'F' and 'C' (rounded as the thermostat only accepts integer setpoints after conversion).
+    '''
+    if units_from == units_to:
+        return value
+    elif units_from == 'F' and units_to == 'C':
+        return round((value - 32) * 5/9)
+    else:
+        return round((value * 9/5) + 32)
+
+
+class CompiledTimeline():
+    '''
+    This class contains the transition table of a thermostat program over the simulation horizon.
+    times[i] is the datetime of the i-th transition and values[i] is (mode, schedule, tstp_cool, tstp_heat) holding from times[i].
+    '''
+    def __init__(self, definition: dict, time_start: datetime.datetime, time_end: datetime.datetime, units: str = 'C') -> None:
+        self.time_start = time_start
+        self.time_end = time_end
+        self.units = units.upper()
+        self.times = []
+        self.values = []
+        self.compile(definition)
+
+    def entries_of_day(self, definition, date):
+        '''
+        This function returns the program entries applicable for the given date, sorted by time.
+        '''
+        entries = []
+        for entry in definition['program']:
+            days = [day.lower()[:3] for day in entry.get('days', WEEKDAYS)]
+            months = entry.get('months', range(1, 13))
+            if WEEKDAYS[date.weekday()] in days and date.month in months:
+                hour, minute = entry['time'].split(':')[:2]
+                entries.append((datetime.time(int(hour), int(minute)), entry))
+        return sorted(entries, key=lambda item: item[0])
+
+    def compile(self, definition):
+        units_program = definition.get('units', 'F').upper()
+        mode_program = definition.get('mode', 'auto')
+
+        def transition(date, time_entry, entry):
+            return datetime.datetime.combine(date, time_entry), \
+                   (entry.get('mode', mode_program),
+                    entry['schedule'],
+                    convert_setpoint(entry['cool'], units_program, self.units),
+                    convert_setpoint(entry['heat'], units_program, self.units))
+
+        # Initial state: the latest transition at or before time_start (looking back up to one year)
+        date = self.time_start.date()
+        for _ in range(367):
+            entries = [(time_entry, entry) for time_entry, entry in self.entries_of_day(definition, date)
+                       if datetime.datetime.combine(date, time_entry) <= self.time_start]
+            if entries:
+                time_initial, value_initial = transition(date, *entries[-1])
+                self.times.append(time_initial)
+                self.values.append(value_initial)
+                break
+            date -= datetime.timedelta(days=1)
+        else:
+            raise ValueError('Thermostat schedule program does not contain any applicable entry')
+
+        # Every transition within the horizon
+        date = self.time_start.date()
+        while date <= self.time_end.date():
+            for time_entry, entry in self.entries_of_day(definition, date):
+                time_transition, value_transition = transition(date, time_entry, entry)
+                if self.time_start < time_transition <= self.time_end:
+                    self.times.append(time_transition)
+                    self.values.append(value_transition)
+            date += datetime.timedelta(days=1)
+
+    def index_after(self, current_datetime):
+        '''
+        This function returns the index of the first transition later than current_datetime.
+        '''
+        return bisect.bisect_right(self.times, current_datetime)
+
+    def value_at(self, current_datetime):
+        '''
+        This function returns (mode, schedule, tstp_cool, tstp_heat) active at current_datetime.
+        '''
+        return self.values[max(self.index_after(current_datetime) - 1, 0)]
+
+
+def get_compiled_timeline(schedule_type, time_start, time_end, units='C'):
+    '''
+    This function compiles the program of schedule_type over [time_start, time_end], or returns the timeline already compiled in this process.
+    '''
+    key = (json.dumps(schedule_type, sort_keys=True) if isinstance(schedule_type, dict) else schedule_type,
+           time_start, time_end, units.upper())
+    if key not in _COMPILED_TIMELINES:
+        _COMPILED_TIMELINES[key] = CompiledTimeline(definition=load_schedule_definition(schedule_type),
+                                                    time_start=time_start,
+                                                    time_end=time_end,
+                                                    units=units)
+    return _COMPILED_TIMELINES[key]
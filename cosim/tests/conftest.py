@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the co-simulation are imported from cosim/src (as when running CoSimMain.py from there)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
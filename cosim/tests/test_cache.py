@@ -0,0 +1,68 @@
+import datetime
+import shutil
+
+from CoSimCache import get_run_fingerprint, ResultCache
+from CoSimDict import SETTING
+import thermostat
+
+RUN_SETTINGS = {'replicate': 0, 'steps': 1440, 'control_mode': 'passthrough'}
+
+
+def write_model(dir_model, content='Zone,living_1;'):
+    dir_model.mkdir(parents=True, exist_ok=True)
+    (dir_model / 'model.idf').write_text(content)
+    (dir_model / 'weather.epw').write_text('weather')
+    return str(dir_model)
+
+
+def get_input(path_model, alfalfa_url='http://localhost', schedule_type='default'):
+    return {SETTING.BUILDING_MODEL_INFORMATION: {SETTING.ALFALFA_URL: alfalfa_url,
+                                                 SETTING.PATH_BUILDING_MODEL: path_model,
+                                                 SETTING.CONDITIONED_ZONES: ['living_1']},
+            SETTING.SIMULATION_INFORMATION: {SETTING.TIME_START: datetime.datetime(2019, 1, 1),
+                                             SETTING.TIME_STEP_SIZE: 1},
+            SETTING.THERMOSTAT_MODEL_INFORMATION: {SETTING.THERMOSTAT_MODEL: thermostat.thermostat,
+                                                   SETTING.THERMOSTAT_SCHEDULE_TYPE: schedule_type}}
+
+
+def test_fingerprint_is_stable(tmp_path):
+    path_model = write_model(tmp_path / 'model')
+    fingerprint = get_run_fingerprint(get_input(path_model), RUN_SETTINGS, code_version='code')
+    assert get_run_fingerprint(get_input(path_model), dict(reversed(list(RUN_SETTINGS.items()))), code_version='code') == fingerprint
+    # Where the run is simulated does not change its results
+    assert get_run_fingerprint(get_input(path_model, alfalfa_url='http://other'), RUN_SETTINGS, code_version='code') == fingerprint
+
+    assert get_run_fingerprint(get_input(path_model), {**RUN_SETTINGS, 'replicate': 1}, code_version='code') != fingerprint
+    assert get_run_fingerprint(get_input(path_model), RUN_SETTINGS, code_version='other') != fingerprint
+
+
+def test_fingerprint_hashes_the_content_of_paths(tmp_path):
+    path_model = write_model(tmp_path / 'model')
+    fingerprint = get_run_fingerprint(get_input(path_model), RUN_SETTINGS, code_version='code')
+    # Copy of the model folder elsewhere: same content, same fingerprint
+    path_copy = shutil.copytree(path_model, str(tmp_path / 'copy'))
+    assert get_run_fingerprint(get_input(path_copy), RUN_SETTINGS, code_version='code') == fingerprint
+    # Edited model: new fingerprint
+    path_edited = write_model(tmp_path / 'edited', content='Zone,living_1,edited;')
+    assert get_run_fingerprint(get_input(path_edited), RUN_SETTINGS, code_version='code') != fingerprint
+
+
+def test_fingerprint_hashes_schedule_files(tmp_path):
+    path_model = write_model(tmp_path / 'model')
+    path_schedule = tmp_path / 'schedule.json'
+    path_schedule.write_text('{"weekday": []}')
+    fingerprint = get_run_fingerprint(get_input(path_model, schedule_type=str(path_schedule)), RUN_SETTINGS, code_version='code')
+    path_schedule.write_text('{"weekday": [], "weekend": []}')
+    assert get_run_fingerprint(get_input(path_model, schedule_type=str(path_schedule)), RUN_SETTINGS, code_version='code') != fingerprint
+
+
+def test_result_cache_lookup(tmp_path):
+    result_cache = ResultCache(str(tmp_path / 'result_cache.sqlite'))
+    path_results = tmp_path / 'results.parquet'
+    path_results.write_bytes(b'results')
+    assert result_cache.lookup('fingerprint') is None
+    result_cache.store('fingerprint', str(path_results))
+    assert result_cache.lookup('fingerprint') == str(path_results)
+    # Results removed since: not served from the cache
+    path_results.unlink()
+    assert result_cache.lookup('fingerprint') is None
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+
+from CoSimDict import DATA, CONTROL
+from CoSimKPI import KPIAccumulator, KPI_ENERGY_CUMULATIVE, JOULES_PER_KWH
+from CoSimUtils import get_record_template, update_record, resample_record
+from test_env import TIME_START, create_session, write_trace
+
+
+@pytest.mark.parametrize('steps', [1, 4])
+def test_proceed_simulation_reads_energy_of_each_step(tmp_path, steps):
+    # The energy of the steps advanced together is the mean per step, so that the KPIs and the resampled record keep its sum
+    num_steps = 20
+    cosim_session = create_session(0, write_trace(str(tmp_path / 'trace.parquet'), num_steps), num_steps).initialize(shared_occupant_model=True)
+    try:
+        output_step = cosim_session.retrieve_outputs()
+        record = get_record_template('session', TIME_START, TIME_START, cosim_session.conditioned_zones, [], is_initial_record=True,
+                                     output_step=output_step)
+        for _ in range(3):
+            cosim_session.proceed_simulation({'u': {}}, control_information=None, steps=steps)
+            output_step = cosim_session.retrieve_outputs()
+            update_record(output_step, record, cosim_session.conditioned_zones, [], steps=steps)
+
+        # Heating energy of the trace: 1000 J * minute
+        assert output_step[DATA.HEATING_COIL_ELECTRICITY_ENERGY] == pytest.approx(1000.0 * (3 * steps - (steps - 1) / 2))
+        record_data = resample_record(record, time_step_size=cosim_session.time_step_size)
+        assert len(record_data) == 3 * steps + 1
+        assert record_data[DATA.HEATING_COIL_ELECTRICITY_ENERGY].iloc[1:].sum() == pytest.approx(1000.0 * sum(range(1, 3 * steps + 1)))
+    finally:
+        cosim_session.tear_down()
+
+
+@pytest.mark.parametrize('output_interval', [0, 1, 4])
+def test_fast_forward_reads_energy_of_each_step(tmp_path, output_interval):
+    # Outputs every 4 steps over 10 steps: chunks of 4, 4 and 2 steps, whose energy is summed by the KPIs
+    num_steps, steps_total = 20, 10
+    cosim_session = create_session(0, write_trace(str(tmp_path / 'trace.parquet'), num_steps), num_steps).initialize(shared_occupant_model=True)
+    try:
+        kpi = KPIAccumulator(cosim_session.alias, cosim_session.conditioned_zones)
+        list_output_step = cosim_session.fast_forward(steps=steps_total,
+                                                      input_trajectory=cosim_session.open_loop_trajectory(CONTROL.PASSTHROUGH),
+                                                      output_interval=output_interval)
+        steps_output = output_interval if output_interval else steps_total
+        for index_output, output_step in enumerate(list_output_step):
+            kpi.update(output_step, steps=min(steps_output, steps_total - index_output * steps_output))
+
+        assert list_output_step[-1][DATA.TIME_SIM] == TIME_START + datetime.timedelta(minutes=steps_total)
+        assert kpi.totals()['steps'] == len(list_output_step)
+        assert kpi.totals()['hours'] == pytest.approx(steps_total / 60)
+        assert kpi.totals()[DATA.HEATING_COIL_ELECTRICITY_ENERGY + ' [kWh]'] == pytest.approx(1000.0 * sum(range(1, steps_total + 1)) / JOULES_PER_KWH)
+    finally:
+        cosim_session.tear_down()
+
+
+def test_proceed_simulation_differences_cumulative_meters(tmp_path, monkeypatch):
+    # With the cumulative meters of the building model, the steps advanced together are not read
+    num_steps, steps = 20, 5
+    cosim_session = create_session(0, write_trace(str(tmp_path / 'trace.parquet'), num_steps), num_steps).initialize(shared_occupant_model=True)
+    get_outputs = cosim_session.backend.get_outputs
+    list_site_read = []
+
+    def get_outputs_cumulative(site_id):
+        output_step = get_outputs(site_id)
+        minute = int((output_step[DATA.TIME_SIM] - TIME_START).total_seconds() // 60)
+        output_step[KPI_ENERGY_CUMULATIVE[DATA.HEATING_COIL_ELECTRICITY_ENERGY]] = 1000.0 * minute * (minute + 1) / 2
+        list_site_read.append(site_id)
+        return output_step
+
+    monkeypatch.setattr(cosim_session.backend, 'get_outputs', get_outputs_cumulative)
+    try:
+        cosim_session.retrieve_outputs()
+        list_site_read.clear()
+        cosim_session.proceed_simulation({'u': {}}, control_information=None, steps=steps)
+        assert list_site_read == []
+        output_step = cosim_session.retrieve_outputs()
+        assert output_step[DATA.HEATING_COIL_ELECTRICITY_ENERGY] == pytest.approx(1000.0 * sum(range(1, steps + 1)) / steps)
+    finally:
+        cosim_session.tear_down()
@@ -0,0 +1,59 @@
+import time
+
+from CoSimDistributed import SQLiteJobQueue, JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+
+def get_states(job_queue):
+    return {job['job_id']: job['state'] for job in job_queue.jobs()}
+
+
+def expire(lease_seconds):
+    # Leases shorter than the sleep expire before the next claim
+    time.sleep(lease_seconds * 2)
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    job_queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite'))
+    job_queue.publish('job', {'alias': 'Model1: test'})
+    assert job_queue.claim('w1', lease_seconds=0.1, max_attempts=3)[0] == 'job'
+    assert job_queue.claim('w2', lease_seconds=10.0, max_attempts=3) is None
+
+    expire(0.1)
+    assert job_queue.claim('w2', lease_seconds=10.0, max_attempts=3)[0] == 'job'
+    # The first worker lost the job: its heartbeats, completion and failure are ignored
+    assert not job_queue.heartbeat('job', 'w1', lease_seconds=10.0)
+    assert not job_queue.complete('job', 'w1', {'path_results': 'w1.parquet'})
+    assert not job_queue.fail('job', 'w1', 'error', max_attempts=3)
+    assert get_states(job_queue) == {'job': JOB_RUNNING}
+
+    assert job_queue.complete('job', 'w2', {'path_results': 'w2.parquet'})
+    assert get_states(job_queue) == {'job': JOB_DONE}
+    assert job_queue.results() == {'job': {'path_results': 'w2.parquet'}}
+
+
+def test_expired_lease_fails_after_max_attempts(tmp_path):
+    job_queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite'))
+    job_queue.publish('job', {'alias': 'Model1: test'})
+    for worker_id in ['w1', 'w2']:
+        assert job_queue.claim(worker_id, lease_seconds=0.1, max_attempts=2)[0] == 'job'
+        expire(0.1)
+    assert job_queue.claim('w3', lease_seconds=10.0, max_attempts=2) is None
+    assert get_states(job_queue) == {'job': JOB_FAILED}
+
+    # A late completion of the last worker does not revive the failed job
+    assert not job_queue.complete('job', 'w2', {'path_results': 'w2.parquet'})
+    assert get_states(job_queue) == {'job': JOB_FAILED}
+    assert job_queue.results() == {}
+
+
+def test_failed_job_is_published_again_until_max_attempts(tmp_path):
+    job_queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite'))
+    job_queue.publish('job', {'alias': 'Model1: test'})
+    job_queue.claim('w1', lease_seconds=10.0, max_attempts=2)
+    assert job_queue.fail('job', 'w1', 'error', max_attempts=2)
+    assert get_states(job_queue) == {'job': JOB_PENDING}
+
+    job_queue.claim('w2', lease_seconds=10.0, max_attempts=2)
+    assert job_queue.fail('job', 'w2', 'error', max_attempts=2)
+    assert get_states(job_queue) == {'job': JOB_FAILED}
+    assert job_queue.claim('w3', lease_seconds=10.0, max_attempts=2) is None
@@ -0,0 +1,103 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from CoSimCore import CoSimCore
+from CoSimDict import SETTING, DATA
+from CoSimEnv import CoSimVectorEnv
+from CoSimStorage import write_results
+from CoSimUtils import get_record_template, update_record
+import thermostat
+
+TIME_START = datetime.datetime(2019, 1, 1)
+ZONE = 'Zone 1'
+
+
+def get_output_step(minute):
+    time_sim = TIME_START + datetime.timedelta(minutes=minute)
+    return {f'{ZONE} {DATA.ZONE_MEAN_TEMP}': 20.0 + 0.01 * minute,
+            f'{ZONE} {DATA.ZONE_RELATIVE_HUMIDITY}': 40.0,
+            f'{ZONE} {DATA.ZONE_TEMPERATURE_SETPOINT}': 20.0,
+            DATA.TIME_SIM: time_sim,
+            DATA.SYSTEM_NODE_TEMPERATURE: 0.0,
+            DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE: 5.0,
+            DATA.HEATING_SETPOINT_BASE: 20.0,
+            DATA.COOLING_SETPOINT_BASE: 26.0,
+            DATA.HEATING_SETPOINT_NEW: 20.0,
+            DATA.HEATING_SETPOINT_DEADBAND_UP: 0.5,
+            DATA.HEATING_SETPOINT_DEADBAND_DOWN: 0.5,
+            DATA.COOLING_SETPOINT_NEW: 26.0,
+            DATA.COOLING_SETPOINT_DEADBAND_UP: 0.5,
+            DATA.COOLING_SETPOINT_DEADBAND_DOWN: 0.5,
+            DATA.HEATING_COIL_RUNTIME_FRACTION: 0.0,
+            DATA.COOLING_COIL_RUNTIME_FRACTION: 0.0,
+            DATA.SUPPLY_FAN_AIR_MASS_FLOW_RATE: 0.0,
+            DATA.SYSTEM_NODE_CURRENT_DENSITY_VOLUME_FLOW_RATE: 0.0,
+            DATA.COOLING_COIL_ELECTRICITY_ENERGY: 0.0,
+            DATA.FAN_ELECTRICITY_ENERGY: 0.0,
+            DATA.HEATING_COIL_ELECTRICITY_ENERGY: 1000.0 * minute,
+            DATA.THERMOSTAT_SCHEDULE: None,
+            DATA.THERMOSTAT_MODE: None,
+            DATA.OCCUPANT_MOTION: False,
+            DATA.OCCUPANT_THERMAL_FRUSTRATION: 0.0,
+            DATA.OCCUPANT_COMFORT_DELTA: 0.0,
+            DATA.OCCUPANT_HABITUAL_OVERRIDE: False,
+            DATA.OCCUPANT_DISCOMFORT_OVERRIDE: False}
+
+
+def write_trace(path, num_steps):
+    # Results file played back by the trace backend: one row per minute
+    record = get_record_template('trace', TIME_START, TIME_START, [ZONE], [], is_initial_record=True, output_step=get_output_step(0))
+    for minute in range(1, num_steps):
+        update_record(get_output_step(minute), record, [ZONE], [])
+    write_results(pd.DataFrame.from_dict({**record[DATA.INPUT], **record[DATA.STATUS]}), path)
+    return path
+
+
+def create_session(index, path_trace, num_steps):
+    return CoSimCore(alias=f'env_{index}',
+                     building_model_information={SETTING.ALFALFA_URL: None,
+                                                 SETTING.BACKEND: 'trace',
+                                                 SETTING.PATH_BUILDING_MODEL: None,
+                                                 SETTING.PATH_TRACE: path_trace,
+                                                 SETTING.CONDITIONED_ZONES: [ZONE],
+                                                 SETTING.UNCONDITIONED_ZONES: []},
+                     simulation_information={SETTING.TIME_START: TIME_START,
+                                             SETTING.TIME_END: TIME_START + datetime.timedelta(minutes=num_steps - 1),
+                                             SETTING.TIME_STEP_SIZE: 1,
+                                             SETTING.TIME_SCALE_BUILDING_SIMULATION: 1,
+                                             SETTING.EXTERNAL_CLOCK: True},
+                     occupant_model_information={SETTING.OCCUPANT_MODEL: None,
+                                                 SETTING.NUM_OCCUPANT: None,
+                                                 SETTING.NUM_HOME: None,
+                                                 SETTING.DISCOMFORT_THEORY: None,
+                                                 SETTING.OCCUP_COMFORT_TEMPERATURE: None,
+                                                 SETTING.DISCOMFORT_THEORY_THRESHOLD: None,
+                                                 SETTING.TFT_ALPHA: None,
+                                                 SETTING.TFT_BETA: None,
+                                                 SETTING.PATH_OCCUPANT_MODEL_DATA: None},
+                     thermostat_model_information={SETTING.THERMOSTAT_MODEL: thermostat.thermostat,
+                                                   SETTING.THERMOSTAT_SCHEDULE_TYPE: 'default',
+                                                   SETTING.CURRENT_DATETIME: TIME_START,
+                                                   SETTING.IDF_DB: 0.5})
+
+
+def test_step_advances_each_site_steps_per_action(tmp_path):
+    # Sessions of the same trace file share the in-process client: each site must still be advanced once per simulation step
+    num_envs, num_steps, steps_per_action = 4, 60, 3
+    path_trace = write_trace(str(tmp_path / 'trace.parquet'), num_steps)
+    env = CoSimVectorEnv(lambda: [create_session(index, path_trace, num_steps) for index in range(num_envs)],
+                         steps_per_action=steps_per_action)
+    try:
+        _, infos = env.reset()
+        model_ids = [cosim_session.model_id for cosim_session in env.group.cosim_sessions]
+        assert len(set(model_ids)) == num_envs
+        assert infos[DATA.TIME_SIM] == [TIME_START] * num_envs
+
+        for index_step in range(1, 4):
+            _, _, _, _, infos = env.step(np.full((num_envs, 2), np.nan))
+            time_expected = TIME_START + datetime.timedelta(minutes=index_step * steps_per_action)
+            assert infos[DATA.TIME_SIM] == [time_expected] * num_envs
+    finally:
+        env.close()
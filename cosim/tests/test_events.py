@@ -0,0 +1,60 @@
+import datetime
+
+import pandas as pd
+
+from CoSimDict import DATA
+from CoSimEvents import get_events_template, append_changes, extend_events, events_to_frame, expand_events, split_events, EVENT_CHANNEL
+from CoSimStorage import write_results, read_results
+
+TIME_START = datetime.datetime(2019, 1, 1)
+CHANNELS = [DATA.HEATING_SETPOINT_BASE, DATA.THERMOSTAT_MODE, DATA.OCCUPANT_MOTION]
+
+
+def get_values(minute):
+    # Values of the event channels at each step: a few changes, and None before the first thermostat decision
+    return {DATA.HEATING_SETPOINT_BASE: 20.0 if minute < 30 else 21.5,
+            DATA.THERMOSTAT_MODE: None if minute < 5 else ('heat' if minute < 50 else 'off'),
+            DATA.OCCUPANT_MOTION: (minute // 20) % 2 == 1}
+
+
+def get_dense(minutes):
+    return pd.DataFrame([{DATA.TIME_SIM: TIME_START + datetime.timedelta(minutes=minute), **get_values(minute)} for minute in minutes])
+
+
+def test_append_changes_and_expand_events_round_trip():
+    events = get_events_template()
+    for minute in range(60):
+        append_changes(events, TIME_START + datetime.timedelta(minutes=minute), get_values(minute))
+    # Only the changes are recorded: 3 initial values, then 1 + 2 + 2 changes
+    assert len(events[DATA.TIME_SIM]) == 8
+
+    dense = get_dense(range(60))
+    expanded = expand_events(events, dense[DATA.TIME_SIM], channels=CHANNELS)
+    pd.testing.assert_frame_equal(expanded, dense[CHANNELS], check_dtype=False)
+
+
+def test_extend_events_skips_repeated_values():
+    # The records of the GUI callbacks start with the last step of the previous callback again
+    events, events_first, events_second = get_events_template(), get_events_template(), get_events_template()
+    for minute in range(60):
+        append_changes(events, TIME_START + datetime.timedelta(minutes=minute), get_values(minute))
+    for minute in range(0, 31):
+        append_changes(events_first, TIME_START + datetime.timedelta(minutes=minute), get_values(minute))
+    for minute in range(30, 60):
+        append_changes(events_second, TIME_START + datetime.timedelta(minutes=minute), get_values(minute))
+    extend_events(events_first, events_second)
+    pd.testing.assert_frame_equal(events_to_frame(events_first), events_to_frame(events))
+
+
+def test_results_with_events_read_as_dense(tmp_path):
+    dense = get_dense(range(60))
+    dense['Zone 1 ' + DATA.ZONE_MEAN_TEMP] = [20.0 + 0.01 * minute for minute in range(60)]
+    record_data, events_data = split_events(dense, channels=CHANNELS)
+    assert list(record_data.columns) == [DATA.TIME_SIM, 'Zone 1 ' + DATA.ZONE_MEAN_TEMP]
+    assert set(events_data[EVENT_CHANNEL]) == set(CHANNELS)
+
+    path = str(tmp_path / 'results.parquet')
+    write_results(record_data, path, events=events_data)
+    results = read_results(path, columns=[DATA.TIME_SIM, DATA.HEATING_SETPOINT_BASE, DATA.OCCUPANT_MOTION])
+    assert list(results[DATA.HEATING_SETPOINT_BASE]) == list(dense[DATA.HEATING_SETPOINT_BASE])
+    assert list(results[DATA.OCCUPANT_MOTION]) == list(dense[DATA.OCCUPANT_MOTION])
@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+from CoSimDict import DATA
+from CoSimKPI import KPIAccumulator, JOULES_PER_KWH, read_kpi_summary
+
+TIME_START = datetime.datetime(2019, 1, 31, 22, 0)
+ZONE = 'Zone 1'
+
+
+def get_output_step(minute, zone_temperature=20.0, energy=JOULES_PER_KWH / 60):
+    # 1 kWh per hour of heating coil energy by default
+    return {DATA.TIME_SIM: TIME_START + datetime.timedelta(minutes=minute),
+            f'{ZONE} {DATA.ZONE_MEAN_TEMP}': zone_temperature,
+            DATA.HEATING_SETPOINT_BASE: 20.0,
+            DATA.COOLING_SETPOINT_BASE: 26.0,
+            DATA.HEATING_COIL_ELECTRICITY_ENERGY: energy,
+            DATA.OCCUPANT_HABITUAL_OVERRIDE: minute == 30,
+            DATA.OCCUPANT_DISCOMFORT_OVERRIDE: False,
+            DATA.OCCUPANT_THERMAL_FRUSTRATION: 0.5,
+            DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE: 5.0}
+
+
+def test_rollups_sum_to_totals():
+    kpi = KPIAccumulator('kpi', [ZONE])
+    # 22:00 to 02:00 of the next day, across the end of the month
+    for minute in range(4 * 60):
+        kpi.update(get_output_step(minute))
+    totals = kpi.totals()
+    assert totals['steps'] == 240
+    assert totals['hours'] == pytest.approx(4.0)
+    assert totals['HVAC Energy [kWh]'] == pytest.approx(4.0)
+    assert totals['Habitual Overrides [steps]'] == 1
+    assert totals['Thermal Frustration Mean'] == pytest.approx(0.5)
+
+    hourly = kpi.rollup('hourly')
+    assert list(hourly['period']) == ['2019-01-31 22:00', '2019-01-31 23:00', '2019-02-01 00:00', '2019-02-01 01:00']
+    assert list(hourly['HVAC Energy [kWh]']) == pytest.approx([1.0] * 4)
+    assert list(kpi.rollup('daily')['period']) == ['2019-01-31', '2019-02-01']
+    assert list(kpi.rollup('monthly')['hours']) == pytest.approx([2.0, 2.0])
+
+
+def test_rollups_keep_the_last_periods():
+    kpi = KPIAccumulator('kpi', [ZONE], periods_kept={'hourly': 2})
+    for minute in range(5 * 60):
+        kpi.update(get_output_step(minute))
+    # Two closed periods and the current one: the totals still cover the whole run
+    assert list(kpi.rollup('hourly')['period']) == ['2019-02-01 00:00', '2019-02-01 01:00', '2019-02-01 02:00']
+    assert kpi.totals()['HVAC Energy [kWh]'] == pytest.approx(5.0)
+
+
+def test_steps_weight_energy_and_hours():
+    kpi_steps, kpi_each = KPIAccumulator('steps', [ZONE]), KPIAccumulator('each', [ZONE])
+    # Zone 1 degC below the heating setpoint: unmet heating
+    kpi_steps.update(get_output_step(4, zone_temperature=19.0), steps=5)
+    for _ in range(5):
+        kpi_each.update(get_output_step(4, zone_temperature=19.0))
+    for key in ['hours', 'HVAC Energy [kWh]', 'Unmet Heating [h]', 'Heating Setpoint Deviation [degC.h]']:
+        assert kpi_steps.totals()[key] == pytest.approx(kpi_each.totals()[key])
+    assert kpi_steps.totals()['Unmet Heating [h]'] == pytest.approx(5 / 60)
+
+
+def test_summary_is_written_next_to_the_results(tmp_path):
+    kpi = KPIAccumulator('kpi', [ZONE])
+    for minute in range(90):
+        kpi.update(get_output_step(minute))
+    path_results = str(tmp_path / 'results.parquet')
+    kpi.write_summary(path_results)
+    summary = read_kpi_summary(path_results)
+    assert summary['total']['HVAC Energy [kWh]'] == pytest.approx(1.5)
+    assert [row['period'] for row in summary['daily']] == ['2019-01-31']
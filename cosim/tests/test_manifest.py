@@ -0,0 +1,33 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from CoSimManifest import SessionManifest, reap_orphaned_sites, MANIFEST_STALE_SECONDS
+
+
+def write_entry(manifest, alias, owner, time_updated):
+    # Entry of an in-process backend (its site is not stopped by the reaper)
+    entry = manifest.write(alias, 'trace', None, alias + '#site', '2019-01-01 00:00:00', 'config')
+    entry.update({'owner': owner, 'time_updated': time_updated})
+    with open(manifest.get_path(alias), 'w') as file:
+        json.dump(entry, file)
+
+
+def test_reap_only_orphaned_sites(tmp_path):
+    manifest = SessionManifest(str(tmp_path))
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    host, now = socket.gethostname(), time.time()
+    write_entry(manifest, 'owned', f'{host}:{process.pid}', now)
+    write_entry(manifest, 'dead owner', f'{host}:{process.pid}', now)
+    write_entry(manifest, 'this process', f'{host}:{os.getpid()}', now)
+    write_entry(manifest, 'live owner', f'{host}:{os.getppid()}', now)
+    write_entry(manifest, 'other host', 'other-host:1', now)
+    write_entry(manifest, 'other host stale', 'other-host:1', now - MANIFEST_STALE_SECONDS - 1)
+
+    list_reaped = reap_orphaned_sites(str(tmp_path), aliases_owned=['owned'])
+    assert sorted(entry['alias'] for entry in list_reaped) == ['dead owner', 'other host stale', 'this process']
+    assert sorted(entry['alias'] for entry in manifest.entries()) == ['live owner', 'other host', 'owned']
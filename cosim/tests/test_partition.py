@@ -0,0 +1,62 @@
+import datetime
+
+import pandas as pd
+
+from CoSimDict import DATA
+from CoSimPartition import partition_horizon, get_segment_steps, trim_segment, stitch_segments, SEEDING_WARM_UP, SEEDING_STEADY_STATE
+from CoSimStorage import write_results, read_results
+
+TIME_START = datetime.datetime(2019, 1, 1)
+TIME_END = datetime.datetime(2019, 4, 1)
+
+
+def simulate_segment(segment, time_step_size=60):
+    # Results of a segment: from the start of its overlap to its end, including the initial step (as the records of CoSimMain.py)
+    time_sim = pd.date_range(segment['time_start_sim'], segment['time_end'], freq=pd.Timedelta(minutes=time_step_size))
+    return pd.DataFrame({DATA.TIME_SIM: time_sim,
+                         DATA.OUTDOOR_AIR_DRYBULB_TEMPERATURE: [float(index) for index in range(len(time_sim))]})
+
+
+def test_monthly_segments_cover_the_horizon():
+    list_segment = partition_horizon(TIME_START, TIME_END, segments='monthly', steps_overlap=24, time_step_size=60)
+    assert [segment['time_start'] for segment in list_segment] == [datetime.datetime(2019, month, 1) for month in [1, 2, 3]]
+    assert [segment['time_end'] for segment in list_segment] == [datetime.datetime(2019, month, 1) for month in [2, 3, 4]]
+    # The first segment starts at the start of the horizon: no overlap
+    assert [segment['steps_overlap'] for segment in list_segment] == [0, 24, 24]
+    assert list_segment[1]['time_start_sim'] == datetime.datetime(2019, 1, 31)
+    assert sum(segment['steps_record'] for segment in list_segment) == (TIME_END - TIME_START) // datetime.timedelta(hours=1)
+
+    assert get_segment_steps(list_segment[1], SEEDING_WARM_UP) == (0, 24 + list_segment[1]['steps_record'])
+    assert get_segment_steps(list_segment[1], SEEDING_STEADY_STATE) == (24, list_segment[1]['steps_record'])
+
+
+def test_segments_of_equal_length():
+    list_segment = partition_horizon(TIME_START, TIME_START + datetime.timedelta(hours=12), segments=4, steps_overlap=4, time_step_size=60)
+    assert [segment['steps_record'] for segment in list_segment] == [3, 3, 3, 3]
+    # The overlap cannot start before the start of the horizon
+    assert [segment['steps_overlap'] for segment in list_segment] == [0, 3, 4, 4]
+    assert all(segment['num_segments'] == 4 for segment in list_segment)
+
+
+def test_trimmed_segments_are_continuous():
+    list_segment = partition_horizon(TIME_START, TIME_END, segments='monthly', steps_overlap=24, time_step_size=60)
+    record_data = pd.concat([trim_segment(simulate_segment(segment), segment, last=segment is list_segment[-1]) for segment in list_segment],
+                            ignore_index=True)
+    # Every step of the horizon exactly once, including its end
+    pd.testing.assert_series_equal(record_data[DATA.TIME_SIM],
+                                   pd.Series(pd.date_range(TIME_START, TIME_END, freq='h'), name=DATA.TIME_SIM), check_freq=False)
+
+
+def test_stitch_segments(tmp_path):
+    list_segment = partition_horizon(TIME_START, TIME_END, segments='monthly', steps_overlap=24, time_step_size=60)
+    list_path_results = []
+    for segment in list_segment:
+        list_path_results.append(str(tmp_path / f"segment_{segment['index']}.parquet"))
+        write_results(simulate_segment(segment), list_path_results[-1])
+    path_output, report = stitch_segments(list_path_results, list_segment, str(tmp_path / 'stitched.parquet'))
+    record_data = read_results(path_output)
+    assert len(record_data) == sum(segment['steps_record'] for segment in list_segment) + 1
+    # The outdoor temperature of each segment restarts from 0: a discontinuity at both boundaries
+    assert list(report['boundary']) == [pd.Timestamp(2019, 2, 1), pd.Timestamp(2019, 3, 1)]
+    assert report['flagged'].all()
+    assert (tmp_path / 'stitched_boundaries.csv').is_file()
@@ -0,0 +1,45 @@
+import copy
+
+import pandas as pd
+import pytest
+
+from CoSimDict import DATA
+from CoSimSharedRecord import share_record, extend_record, get_record_frame, record_from_shared, KEY_SHARED
+from CoSimUtils import get_record_template, update_record
+
+from test_env import ZONE, get_output_step
+
+pytest.importorskip('pyarrow')
+
+
+def get_record(minutes, is_initial_record=False):
+    record = get_record_template('shared', None, None, [ZONE], [], is_initial_record=is_initial_record,
+                                 output_step=get_output_step(minutes[0]), events=True)
+    for minute in minutes[1:]:
+        output_step = get_output_step(minute)
+        # Sparse channels change now and then (change events)
+        output_step[DATA.OCCUPANT_MOTION] = minute % 7 == 0
+        update_record(output_step, record, [ZONE], [])
+    return record
+
+
+def test_extend_record_with_shared_rows_matches_record(tmp_path):
+    record_initial = get_record(range(0, 3), is_initial_record=True)
+    record_expected, record_shared = copy.deepcopy(record_initial), copy.deepcopy(record_initial)
+    for minutes in [range(3, 20), range(20, 45)]:
+        extend_record(record_expected, get_record(minutes))
+        extend_record(record_shared, share_record(get_record(minutes), dir_shared=str(tmp_path)))
+
+    # Shared rows are kept as the attached tables, without conversion to the lists of the record
+    assert len(record_shared[KEY_SHARED]) == 2
+    assert len(record_shared[DATA.STATUS][DATA.TIME_SIM]) == len(record_initial[DATA.STATUS][DATA.TIME_SIM])
+    assert record_shared[DATA.EVENTS] == record_expected[DATA.EVENTS]
+    pd.testing.assert_frame_equal(get_record_frame(record_shared), get_record_frame(record_expected), check_dtype=False)
+    # The files in shared memory are unlinked once attached
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_record_from_shared_matches_record(tmp_path):
+    record = get_record(range(0, 30))
+    record_data = record_from_shared(share_record(record, dir_shared=str(tmp_path)))
+    pd.testing.assert_frame_equal(record_data, pd.DataFrame.from_dict({**record[DATA.INPUT], **record[DATA.STATUS]}), check_dtype=False)
@@ -0,0 +1,38 @@
+import pytest
+
+from CoSimDict import DATA, CONTROL
+from CoSimStepping import AdaptiveStepPolicy
+from CoSimUtils import initialize_control_information
+from test_env import create_session, write_trace
+
+
+@pytest.fixture
+def cosim_session(tmp_path):
+    # Zone at 20 degC (+0.01 degC per step), thermostat with the default program
+    num_steps = 60
+    cosim_session = create_session(0, write_trace(str(tmp_path / 'trace.parquet'), num_steps), num_steps).initialize(shared_occupant_model=True)
+    yield cosim_session
+    cosim_session.tear_down()
+
+
+def get_control_information(override=False, motion=False):
+    control_information = initialize_control_information()
+    control_information.update({DATA.HEATING_SETPOINT_NEW: 15.0, DATA.COOLING_SETPOINT_NEW: 28.0,
+                                DATA.OCCUPANT_MOTION: motion, DATA.OCCUPANT_DISCOMFORT_OVERRIDE: override})
+    return control_information
+
+
+@pytest.mark.parametrize('control_information, output_motion, quiescent', [(get_control_information(), False, True),
+                                                                           (get_control_information(override=True), False, False),
+                                                                           (get_control_information(motion=True), False, False),
+                                                                           (get_control_information(motion=True), True, True)])
+def test_occupant_model_without_steps_until_event(cosim_session, control_information, output_motion, quiescent):
+    # Occupants without steps_until_event() are quiescent while no override is pending and their motion does not change
+    output_step = cosim_session.retrieve_outputs()
+    output_step[DATA.OCCUPANT_MOTION] = output_motion
+    step_policy = AdaptiveStepPolicy(max_steps=15)
+    steps = step_policy.next_steps(cosim_session=cosim_session,
+                                   control_mode=CONTROL.OCCUPANT_MODEL,
+                                   output_step=output_step,
+                                   control_information=control_information)
+    assert steps == (15 if quiescent else 1)
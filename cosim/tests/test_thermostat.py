@@ -0,0 +1,14 @@
+import datetime
+
+from thermostat import thermostat
+from thermostat_schedule import DEFAULT_PROGRAMS
+
+
+def test_schedule_definition_dictionary():
+    # A program definition given as a dictionary is compiled as the built-in program of the same definition
+    time_start, time_end = datetime.datetime(2019, 1, 1), datetime.datetime(2019, 1, 8)
+    thermostat_named = thermostat(schedule_type='Default', current_datetime=time_start, end_datetime=time_end)
+    thermostat_dict = thermostat(schedule_type=DEFAULT_PROGRAMS['default'], current_datetime=time_start, end_datetime=time_end)
+    assert thermostat_named.schedule_type == 'default'
+    assert thermostat_dict.schedule_type == DEFAULT_PROGRAMS['default']
+    assert list(thermostat_dict.timeline.values) == list(thermostat_named.timeline.values)